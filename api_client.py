@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import random
+from typing import Optional
+
+import aiohttp
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class ApiError(Exception):
+    """API вернул неуспешный статус (после всех повторов для 5xx)."""
+
+    def __init__(self, status: int, body: str):
+        super().__init__(f"API returned status {status}")
+        self.status = status
+        self.body = body
+
+
+def create_api_session(*, pool_size: int = 50, pool_size_per_host: int = 20,
+                       timeout: float = 20.0) -> aiohttp.ClientSession:
+    """
+    Создает общую на все приложение сессию для вызовов наших API.
+
+    Соединения переиспользуются между регистрациями (без нового TCP+TLS
+    рукопожатия на каждый запрос), DNS кэшируется, а общий дедлайн не дает
+    медленной Vercel-функции держать хэндлер бесконечно.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=pool_size,
+        limit_per_host=pool_size_per_host,
+        ttl_dns_cache=300,
+        keepalive_timeout=30
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=timeout, connect=min(10.0, timeout))
+    )
+
+
+async def post_json(session: aiohttp.ClientSession, url: str, payload: dict, *,
+                    attempts: int = 3, timeout: Optional[float] = None, backoff: float = 0.5) -> dict:
+    """
+    POST с JSON-телом и повтором на 5xx/таймаутах/обрывах соединения.
+
+    Пауза между попытками — экспонента с полным джиттером, чтобы всплеск
+    регистраций не бил в API синхронными волнами. Ответы 4xx не повторяются.
+
+    :param timeout: Дедлайн одной попытки (по умолчанию — таймаут сессии).
+    :return: Распарсенный JSON ответа со статусом 200.
+    :raises ApiError: Неуспешный статус ответа.
+    """
+    request_timeout = aiohttp.ClientTimeout(total=timeout) if timeout else None
+    for attempt in range(1, attempts + 1):
+        try:
+            async with session.post(url, json=payload, timeout=request_timeout) as response:
+                if response.status == 200:
+                    return await response.json()
+                response_text = await response.text()
+                logger.error(f"API returned status {response.status}: {response_text}")
+                if response.status < 500 or attempt == attempts:
+                    raise ApiError(response.status, response_text)
+        except (asyncio.TimeoutError, aiohttp.ClientConnectionError) as e:
+            logger.warning(f"Запрос к {url} не удался (попытка {attempt}/{attempts}): {e!r}")
+            if attempt == attempts:
+                raise
+        await asyncio.sleep(random.uniform(0, backoff * 2 ** (attempt - 1)))
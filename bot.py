@@ -1,10 +1,10 @@
 import asyncio
-import json
 import logging
 import aiohttp
 from aiohttp import web
-from typing import Union
+from typing import Dict, Optional, Union
 import base64
+import time
 from pathlib import Path
 from PIL import Image
 import io
@@ -12,15 +12,35 @@ import io
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import CommandStart
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, WebAppInfo,
-    FSInputFile
+    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, WebAppInfo
 )
-from supabase import create_client, Client
-from ocr import configure_gemini, recognize_document, recognize_document_from_images
+from ocr import (
+    configure_gemini, configure_mrz, configure_ocr_cache, configure_prompt_cache, configure_validation,
+    parse_model_overrides, warm_up_gemini,
+    get_cache_stats, get_prompt_cache_stats, recognize_document, recognize_document_from_images
+)
+from ocr_queue import OcrQueue, OcrQueueFullError
+from i18n import TranslationWatcher, init_translations, keyboard, register_keyboard, t
+import keyboards  # noqa: F401 — регистрирует клавиатуры до загрузки переводов
+from api_client import ApiError, create_api_session, post_json
+from fsm_storage import count_sessions, create_fsm_storage
+from notify_queue import NotifyQueue, QueueFullError
+from storage_client import StorageClient
+from image_prep import configure_preprocessing
+from media_registry import MediaRegistry
+from metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE, FSM_SESSIONS, REGISTER_API_RESPONSES, REGISTER_API_SECONDS, REGISTRY,
+    HandlerMetricsMiddleware, TelegramApiMetricsMiddleware
+)
+from uploads import (
+    STORAGE_BUCKET, UploadResult, configure_transfers, content_type_for, transfer_file,
+    upload_registration_files, verify_uploads
+)
+from user_tasks import UserTaskRegistry, finished_result, wait_result
+from webhook import WebhookHandler
 
 # --- Конфигурация ---
 logging.basicConfig(level=logging.INFO)
@@ -36,6 +56,62 @@ WEBAPP_REGISTER_API = 'https://steel-bike.vercel.app/api/telegram-register'
 BOT_REGISTER_API = 'https://steel-bike.vercel.app/api/auth'
 ADMIN_SECRET_KEY = 'your_super_secret_admin_key' # Секрет для уведомлений от админки
 WEB_APP_URL = 'https://steel-bike.vercel.app/' # URL вашего основного веб-приложения
+UPLOAD_CONCURRENCY = int(os.getenv('UPLOAD_CONCURRENCY', '4')) # Сколько файлов регистрации грузим одновременно
+STORAGE_POOL_SIZE = int(os.getenv('STORAGE_POOL_SIZE', '20')) # Лимит keep-alive соединений к Storage
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', str(1024 * 1024))) # Больше — буферизуем на диске, байт
+UPLOAD_MEMORY_BUDGET = int(os.getenv('UPLOAD_MEMORY_BUDGET', str(32 * 1024 * 1024))) # Суммарно в памяти на все переносы, байт
+
+# Предобработка фото перед OCR
+OCR_MAX_EDGE = int(os.getenv('OCR_MAX_EDGE', '1600')) # Длинная сторона после уменьшения, px
+OCR_IMAGE_QUALITY = int(os.getenv('OCR_IMAGE_QUALITY', '85'))
+OCR_IMAGE_FORMAT = os.getenv('OCR_IMAGE_FORMAT', 'JPEG') # JPEG | WEBP
+OCR_GRAYSCALE = os.getenv('OCR_GRAYSCALE', 'auto') # auto | always | never
+OCR_PREP_WORKERS = int(os.getenv('OCR_PREP_WORKERS', '2')) # Размер пула декодирования/кодирования фото
+OCR_PREP_PROCESSES = os.getenv('OCR_PREP_PROCESSES', 'false').lower() == 'true' # Пул процессов вместо потоков
+
+# Модели Gemini
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-lite') # Модель по умолчанию
+GEMINI_MODELS = os.getenv('GEMINI_MODELS', '') # Переопределения по варианту: 'simple_ru=gemini-2.0-flash-lite,document=gemini-2.5-flash'
+GEMINI_TEMPERATURE = float(os.getenv('GEMINI_TEMPERATURE', '0'))
+GEMINI_WARMUP = os.getenv('GEMINI_WARMUP', 'true').lower() == 'true' # Прогревать модели при старте
+GEMINI_PROMPT_CACHE = os.getenv('GEMINI_PROMPT_CACHE', 'gemini') # gemini — кэшировать большой промпт в Gemini, inline — слать каждый раз
+GEMINI_PROMPT_CACHE_TTL = int(os.getenv('GEMINI_PROMPT_CACHE_TTL', '3600'))
+
+# Кэш результатов OCR
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '512')) # Записей в памяти (LRU)
+OCR_CACHE_TTL = int(os.getenv('OCR_CACHE_TTL', str(7 * 24 * 3600))) # Время жизни записи, сек
+OCR_CACHE_DB = os.getenv('OCR_CACHE_DB') # Путь к SQLite для кэша на диске; пусто — только память
+MRZ_ENABLED = os.getenv('MRZ_ENABLED', 'true').lower() == 'true' # Читать MRZ локально (нужен tesseract)
+MRZ_SKIP_LLM = os.getenv('MRZ_SKIP_LLM', 'false').lower() == 'true' # При валидной MRZ не вызывать Gemini вовсе
+OCR_REASK_ATTEMPTS = int(os.getenv('OCR_REASK_ATTEMPTS', '1')) # Перепроверок полей, не прошедших валидацию
+
+# Очередь вызовов OCR
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '4')) # Сколько запросов к Gemini идут одновременно
+OCR_MAX_QUEUE = int(os.getenv('OCR_MAX_QUEUE', '100')) # Сверх этого новые задания отклоняются
+OCR_SPECULATIVE = os.getenv('OCR_SPECULATIVE', 'true').lower() == 'true' # Распознавать паспорт в фоне во время регистрации
+BACKGROUND_RESULT_TTL = int(os.getenv('BACKGROUND_RESULT_TTL', '3600')) # Сколько хранить результаты фоновых загрузок и распознавания, сек
+BOT_REGISTER_API_TIMEOUT = float(os.getenv('BOT_REGISTER_API_TIMEOUT', '20')) # Дедлайн одной попытки, сек
+BOT_REGISTER_API_ATTEMPTS = int(os.getenv('BOT_REGISTER_API_ATTEMPTS', '3')) # Попыток на 5xx/таймаут
+FSM_STORAGE_URL = os.getenv('FSM_STORAGE_URL', 'sqlite:///fsm_state.db') # memory:// | sqlite:///path | redis://host:port/db
+FSM_STATE_TTL = int(os.getenv('FSM_STATE_TTL', str(7 * 24 * 3600))) # Сколько хранить незаконченную регистрацию, сек
+HTTP_PORT = int(os.getenv('HTTP_PORT', '8080')) # Порт aiohttp-сервера (/notify и вебхук)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') # Bearer-токен для /metrics; пусто — без авторизации
+MEDIA_REGISTRY_PATH = os.getenv('MEDIA_REGISTRY_PATH', 'media_registry.json') # file_id загруженных соглашений и видео
+TRANSLATIONS_RELOAD_INTERVAL = float(os.getenv('TRANSLATIONS_RELOAD_INTERVAL', '2')) # Проверка translations.json на изменения, сек; 0 — без перезагрузки
+
+# Режим получения апдейтов: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', '') # Публичный https-адрес этого сервера
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') # Проверяется в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '32')) # Сколько апдейтов обрабатываем одновременно
+WEBHOOK_MAX_PENDING = int(os.getenv('WEBHOOK_MAX_PENDING', '1000')) # Сверх этого отвечаем 503
+
+# Очередь массовых уведомлений (/notify/batch)
+NOTIFY_RATE = float(os.getenv('NOTIFY_RATE', '30')) # Общий лимит, сообщений/с
+NOTIFY_PER_CHAT_INTERVAL = float(os.getenv('NOTIFY_PER_CHAT_INTERVAL', '1')) # Пауза между сообщениями в один чат, сек
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS', '8'))
+NOTIFY_MAX_QUEUE = int(os.getenv('NOTIFY_MAX_QUEUE', '10000'))
 
 # --- ВОТ ЭТОТ НОВЫЙ БЛОК ---
 # Добавь сюда ID админов, которым будут приходить уведомления
@@ -57,13 +133,42 @@ if not SUPABASE_URL or not SUPABASE_SERVICE_KEY:
 
 logger.info(f"🔗 Connecting to Supabase: {SUPABASE_URL}")
 logger.info(f"🔑 Using SERVICE_ROLE_KEY: {SUPABASE_SERVICE_KEY[:20]}...")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-logger.info("✅ Supabase client initialized.")
+storage_client = StorageClient(SUPABASE_URL, SUPABASE_SERVICE_KEY, pool_size=STORAGE_POOL_SIZE)
+logger.info("✅ Supabase Storage client initialized.")
 
 # --- Инициализация Aiogram ---
 bot = Bot(token=TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+storage = create_fsm_storage(FSM_STORAGE_URL, ttl=FSM_STATE_TTL)
+# Для Redis блокируем апдейты одного пользователя между репликами
+events_isolation = storage.create_isolation() if hasattr(storage, 'create_isolation') else None
+dp = Dispatcher(storage=storage, events_isolation=events_isolation)
+
+# Метрики: длительность хэндлеров по состоянию Reg и каждого вызова Bot API
+bot.session.middleware(TelegramApiMetricsMiddleware())
+dp.message.outer_middleware(HandlerMetricsMiddleware('message'))
+dp.callback_query.outer_middleware(HandlerMetricsMiddleware('callback_query'))
+
+webhook_handler = WebhookHandler(
+    dp, bot, secret_token=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, max_pending=WEBHOOK_MAX_PENDING
+)
+
+notify_queue = NotifyQueue(
+    bot, rate=NOTIFY_RATE, per_chat_interval=NOTIFY_PER_CHAT_INTERVAL,
+    workers=NOTIFY_WORKERS, max_size=NOTIFY_MAX_QUEUE
+)
+
+ocr_queue = OcrQueue(workers=OCR_WORKERS, max_size=OCR_MAX_QUEUE)
+
+# Фоновые загрузки документов: стартуют, как только пришло фото
+upload_tasks = UserTaskRegistry('upload', ttl=BACKGROUND_RESULT_TTL)
+# Распознавание паспорта, начатое заранее: результат уходит в анкету как ocrData
+ocr_tasks = UserTaskRegistry('ocr', ttl=BACKGROUND_RESULT_TTL)
+
+# Соглашения и видео загружаются в Telegram один раз, дальше уходят по file_id
+media_registry = MediaRegistry(MEDIA_REGISTRY_PATH)
+
+# Общая HTTP-сессия для BOT_REGISTER_API, создается в main()
+api_session: Optional[aiohttp.ClientSession] = None
 
 # --- Состояния FSM для регистрации ---
 class Reg(StatesGroup):
@@ -86,20 +191,15 @@ class Reg(StatesGroup):
     video_note = State()
 
 # --- Загрузка переводов ---
-import json
-try:
-    with open('translations.json', 'r', encoding='utf-8') as f:
-        TRANSLATIONS = json.load(f)
-except FileNotFoundError:
-    logger.error("translations.json not found!")
-    TRANSLATIONS = {'ru': {}, 'en': {}}
-
-def t(key: str, lang: str = 'en', **kwargs) -> str:
-    """Get translation by key"""
-    text = TRANSLATIONS.get(lang, {}).get(key, key)
-    if kwargs:
-        text = text.format(**kwargs)
-    return text
+@register_keyboard('open_app')
+def build_open_app_keyboard(t, lang: str) -> InlineKeyboardMarkup:
+    # Язык передаем веб-приложению через URL
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t('open_app', lang), web_app=WebAppInfo(url=f"{WEB_APP_URL}?lang={lang}"))]
+    ])
+
+init_translations('translations.json')
+translation_watcher = TranslationWatcher('translations.json', interval=TRANSLATIONS_RELOAD_INTERVAL)
 
 async def upload_file_to_supabase(file_id: str, user_id: int, key: str) -> str:
     """Download file from Telegram and upload to Supabase Storage"""
@@ -110,17 +210,129 @@ async def upload_file_to_supabase(file_id: str, user_id: int, key: str) -> str:
         file_bytes = await bot.download_file(file_info.file_path)
         # Upload to Supabase
         storage_path = f"{user_id}/{key}.jpg"
-        response = supabase.storage.from_("passports").upload(
-            path=storage_path,
-            file=file_bytes,
-            file_options={"content-type": "image/jpeg", "upsert": "true"}
-        )
+        await storage_client.upload(STORAGE_BUCKET, storage_path, file_bytes.read(), content_type="image/jpeg")
         logger.info(f"Uploaded {storage_path} to Supabase")
         return storage_path
     except Exception as e:
         logger.error(f"Failed to upload {key} for user {user_id}: {e}")
         return None
 
+def finished_uploads(user_id: int, uploaded: Optional[dict]) -> dict:
+    """uploaded_files анкеты, дополненный документами, которые уже перенесены в фоне."""
+    uploaded = dict(uploaded or {})
+    for key, result in upload_tasks.results(user_id).items():
+        if result.ok:
+            uploaded[key] = {'file_id': result.file_id, 'path': result.storage_path, 'size': result.size}
+    return uploaded
+
+def start_document_upload(user_id: int, key: str, file_id: str):
+    """Начинает перенос документа в Storage сразу, пока пользователь отвечает на следующие вопросы."""
+    upload_tasks.start(user_id, key, transfer_file(bot, storage_client, user_id, key, file_id))
+
+async def save_document(state: FSMContext, user_id: int, key: str, file_id: str):
+    """
+    Сохраняет file_id документа в анкете и начинает его загрузку.
+
+    Фоновые загрузки FSM не трогают: их запись могла бы затереть то, что
+    хэндлер сохранил между ее чтением и записью. Пути уже загруженных
+    документов пишет в анкету сам хэндлер, чтобы они пережили перезапуск.
+    """
+    data = await state.get_data()
+    await state.update_data({
+        f'{key}_file_id': file_id,
+        'uploaded_files': finished_uploads(user_id, data.get('uploaded_files')),
+    })
+    start_document_upload(user_id, key, file_id)
+
+async def _recognize_in_background(file_ids: list, country: Optional[str]) -> Optional[dict]:
+    try:
+        return await ocr_queue.run(recognize_document, bot, file_ids, country=country)
+    except OcrQueueFullError as e:
+        # Распознавание необязательное: при перегрузке анкета уйдет без него
+        logger.warning(f"Предварительное распознавание пропущено: {e}")
+        return None
+
+def start_speculative_ocr(user_id: int, file_ids: list, country: Optional[str]):
+    """Начинает распознавание паспорта, пока пользователь проходит оставшиеся шаги."""
+    file_ids = [file_id for file_id in file_ids if file_id]
+    if not OCR_SPECULATIVE or not GEMINI_API_KEY or not file_ids:
+        return
+    ocr_tasks.start(user_id, 'passport', _recognize_in_background(file_ids, country))
+
+def collect_ocr(user_id: int) -> Optional[dict]:
+    """Результат предварительного распознавания, если оно уже закончилось; анкету не задерживает."""
+    task = ocr_tasks.take(user_id).get('passport')
+    if task is None:
+        return None
+    if not task.done():
+        task.cancel()
+        logger.info(f"Распознавание паспорта пользователя {user_id} не готово к отправке анкеты")
+        return None
+    ocr_data = finished_result(task)
+    if ocr_data is None:
+        return None
+    if 'error' in ocr_data:
+        logger.warning(f"Распознавание паспорта пользователя {user_id} не удалось: {ocr_data['error']}")
+        return None
+    return ocr_data
+
+async def submit_registration(api_data: dict) -> dict:
+    """Отправляет анкету в BOT_REGISTER_API и пишет длительность и статус ответа в метрики."""
+    started, status = time.perf_counter(), 'error'
+    try:
+        result = await post_json(
+            api_session, BOT_REGISTER_API, api_data,
+            attempts=BOT_REGISTER_API_ATTEMPTS, timeout=BOT_REGISTER_API_TIMEOUT
+        )
+        status = '200'
+        return result
+    except ApiError as e:
+        status = str(e.status)
+        raise
+    except asyncio.TimeoutError:
+        status = 'timeout'
+        raise
+    except aiohttp.ClientConnectionError:
+        status = 'connection'
+        raise
+    finally:
+        REGISTER_API_SECONDS.observe(time.perf_counter() - started)
+        REGISTER_API_RESPONSES.labels(status).inc()
+
+async def collect_uploads(user_id: int, file_ids: Dict[str, str], uploaded: dict) -> Dict[str, UploadResult]:
+    """
+    Результаты переноса всех документов анкеты: дожидается фоновых загрузок,
+    берет пути, сохраненные в анкете, и загружает только то, чего нет.
+    """
+    tasks = upload_tasks.take(user_id)
+    for key, task in tasks.items():
+        if key not in file_ids:
+            task.cancel()  # Документ пропущен после отправки
+
+    async def finished(key: str, file_id: str) -> Optional[UploadResult]:
+        task = tasks.get(key)
+        if task is not None:
+            result = await wait_result(task)
+            if result is not None and result.ok and result.file_id == file_id:
+                return result
+        saved = uploaded.get(key)
+        if saved and saved.get('file_id') == file_id and saved.get('path'):
+            return UploadResult(
+                key=key, file_id=file_id, content_type=content_type_for(key),
+                storage_path=saved['path'], size=saved.get('size', 0)
+            )
+        return None
+
+    done = await asyncio.gather(*(finished(key, file_id) for key, file_id in file_ids.items()))
+    results = {result.key: result for result in done if result is not None}
+    missing = {key: file_id for key, file_id in file_ids.items() if key not in results}
+    if missing:
+        logger.info(f"Догружаем документы пользователя {user_id}, не загруженные в фоне: {sorted(missing)}")
+        results.update(await upload_registration_files(
+            bot, storage_client, user_id, missing, concurrency=UPLOAD_CONCURRENCY
+        ))
+    return results
+
 # --- Клавиатуры ---
 def get_phone_keyboard() -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
@@ -137,26 +349,22 @@ def get_city_keyboard() -> InlineKeyboardMarkup:
     ])
 
 def get_country_keyboard(lang: str = 'ru') -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t('country_russia', lang), callback_data="country_ru")],
-        [InlineKeyboardButton(text=t('country_kazakhstan', lang), callback_data="country_kz")],
-        [InlineKeyboardButton(text=t('country_kyrgyzstan', lang), callback_data="country_kg")],
-        [InlineKeyboardButton(text=t('country_uzbekistan', lang), callback_data="country_uz")],
-        [InlineKeyboardButton(text=t('country_tajikistan', lang), callback_data="country_tj")],
-        [InlineKeyboardButton(text=t('country_other', lang), callback_data="country_other")]
-    ])
+    return keyboard('country', lang)
 
 def get_skip_keyboard(lang: str = 'ru') -> InlineKeyboardMarkup:
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t('skip', lang), callback_data="skip")]
-    ])
+    return keyboard('skip', lang)
 
 # --- ВОТ ЭТА НОВАЯ ФУНКЦИЯ ---
-async def notify_admins_about_new_user(user_name: str, user_id: int):
-    """Отправляет уведомление всем админам о новом пользователе."""
+def notify_admins_about_new_user(user_name: str, user_id: int):
+    """
+    Ставит уведомления всем админам о новом пользователе в очередь рассылки.
+
+    Не ждет отправки: сообщения уходят параллельно воркерами очереди, а
+    ошибки доставки повторяются и видны в статусе задания.
+    """
     if not ADMIN_IDS:
         logger.warning("Список ADMIN_IDS пуст, уведомления админам не отправлены.")
-        return
+        return None
 
     text = (
         f"🔔 *Новая заявка на верификацию!*\n\n"
@@ -169,17 +377,17 @@ async def notify_admins_about_new_user(user_name: str, user_id: int):
         [InlineKeyboardButton(text="➡️ Открыть админ-панель", url=f"{WEB_APP_URL}/admin.html")]
     ])
 
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(
-                chat_id=admin_id,
-                text=text,
-                parse_mode='Markdown',
-                reply_markup=admin_keyboard
-            )
-            logger.info(f"Уведомление о новом пользователе {user_name} отправлено админу {admin_id}")
-        except Exception as e:
-            logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    messages = [
+        {'chat_id': admin_id, 'text': text, 'kwargs': {'parse_mode': 'Markdown', 'reply_markup': admin_keyboard}}
+        for admin_id in ADMIN_IDS
+    ]
+    try:
+        job = notify_queue.submit(messages, priority=NotifyQueue.PRIORITY_HIGH)
+    except QueueFullError as e:
+        logger.error(f"Не удалось поставить уведомление админам о пользователе {user_name}: {e}")
+        return None
+    logger.info(f"Уведомление о новом пользователе {user_name} поставлено в очередь для {len(ADMIN_IDS)} админов (job {job.id})")
+    return job
 # --- КОНЕЦ НОВОЙ ФУНКЦИИ ---
 
 # --- Функции переходов ---
@@ -189,11 +397,11 @@ async def go_to_driver(msg: Union[Message, CallbackQuery], state: FSMContext):
     data = await state.get_data()
     lang = data.get('language', 'ru')
     text = t('driver_license', lang)
-    keyboard = get_skip_keyboard(lang)
+    skip_kb = get_skip_keyboard(lang)
     if isinstance(msg, CallbackQuery):
-        await msg.message.edit_text(text, parse_mode='Markdown', reply_markup=keyboard)
+        await msg.message.edit_text(text, parse_mode='Markdown', reply_markup=skip_kb)
     else:
-        await msg.answer(text, parse_mode='Markdown', reply_markup=keyboard)
+        await msg.answer(text, parse_mode='Markdown', reply_markup=skip_kb)
     await state.set_state(Reg.driver_license)
 
 async def go_to_emergency(msg: Union[Message, CallbackQuery], state: FSMContext):
@@ -210,33 +418,27 @@ async def go_to_emergency(msg: Union[Message, CallbackQuery], state: FSMContext)
 
 @dp.message(CommandStart())
 async def start_handler(message: Message, state: FSMContext):
+    # Регистрация начинается заново: незаконченные загрузки прежней анкеты не нужны
+    await upload_tasks.cancel_user(message.from_user.id)
+    await ocr_tasks.cancel_user(message.from_user.id)
     await state.clear()
     args = message.text.split()[1] if len(message.text.split()) > 1 else None
 
     if args == 'register':
         # Сначала выбор языка
-        language_kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru")],
-            [InlineKeyboardButton(text="🇬🇧 English", callback_data="lang_en")]
-        ])
         await message.answer(
             "🌍 Выберите язык / Choose language:",
-            reply_markup=language_kb
+            reply_markup=keyboard('language', 'ru')
         )
         await state.set_state(Reg.language)
         return
 
     # Пытаемся определить язык пользователя (по умолчанию русский)
     user_lang = message.from_user.language_code if message.from_user.language_code in ['ru', 'en'] else 'ru'
-    app_url_with_lang = f"{WEB_APP_URL}?lang={user_lang}"
-    
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t('open_app', user_lang), web_app=WebAppInfo(url=app_url_with_lang))]
-    ])
     await message.answer(
         t('welcome', user_lang, name=message.from_user.first_name or 'пользователь'),
         parse_mode='Markdown',
-        reply_markup=keyboard
+        reply_markup=keyboard('open_app', user_lang)
     )
 
 @dp.callback_query(Reg.language, F.data.startswith("lang_"))
@@ -245,23 +447,14 @@ async def process_language(callback: CallbackQuery, state: FSMContext):
     await state.update_data(language=lang)
     
     try:
-        # Создаем объекты файлов
-        agreement_file = FSInputFile('soglashenie.docx')
-        appendix_file = FSInputFile('prilozhenie.docx')
-
-        # Создаем клавиатуру с кнопкой согласия
-        agreement_kb = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=t('agree_button', lang), callback_data="agree_and_continue")]
-        ])
-
         # Отправляем документы и сообщение с кнопкой
-        await callback.message.answer_document(agreement_file)
-        await callback.message.answer_document(
-            appendix_file,
+        await media_registry.send('soglashenie.docx', callback.message.answer_document)
+        await media_registry.send('prilozhenie.docx', lambda document: callback.message.answer_document(
+            document,
             caption=t('agreement_text', lang),
             parse_mode='Markdown',
-            reply_markup=agreement_kb
-        )
+            reply_markup=keyboard('agreement', lang)
+        ))
         await callback.message.edit_text(t('language_saved', lang))
         await state.set_state(Reg.agreement)
     except FileNotFoundError:
@@ -278,17 +471,10 @@ async def process_agreement(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     # Начинаем стандартный процесс регистрации
     
-    # Создаем клавиатуру с переводом
-    phone_kb = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text=t('share_contact', lang), request_contact=True)]],
-        resize_keyboard=True,
-        one_time_keyboard=True
-    )
-    
     await callback.message.answer(
         t('thanks_start', lang),
         parse_mode='Markdown',
-        reply_markup=phone_kb
+        reply_markup=keyboard('share_contact', lang)
     )
     await state.set_state(Reg.phone)
     await callback.answer()
@@ -486,7 +672,7 @@ async def process_other_country(message: Message, state: FSMContext):
 
 @dp.message(Reg.passport_main, F.photo)
 async def process_passport_main(message: Message, state: FSMContext):
-    await state.update_data(passport_main_file_id=message.photo[-1].file_id)
+    await save_document(state, message.from_user.id, 'passport_main', message.photo[-1].file_id)
     data = await state.get_data()
     lang = data.get('language', 'ru')
     country = data.get('citizenship')
@@ -504,10 +690,15 @@ async def process_passport_main(message: Message, state: FSMContext):
 
 @dp.message(Reg.passport_reg, F.photo)
 async def process_passport_reg_photo(message: Message, state: FSMContext):
-    await state.update_data(passport_reg_file_id=message.photo[-1].file_id)
+    await save_document(state, message.from_user.id, 'passport_reg', message.photo[-1].file_id)
     
     # --- ИЗМЕНЕННАЯ ЛОГИКА: Вместо go_to_inn ---
     data = await state.get_data()
+    # Оба фото паспорта есть — распознаем их, пока пользователь отвечает дальше
+    start_speculative_ocr(
+        message.from_user.id, [data.get('passport_main_file_id'), data.get('passport_reg_file_id')],
+        data.get('citizenship')
+    )
     lang = data.get('language', 'ru')
     patent_required = data.get('patent_required', False)
     if patent_required:
@@ -534,6 +725,7 @@ async def process_passport_reg_text(message: Message, state: FSMContext):
         return
     # Skip for non-RU
     await state.update_data(passport_reg_file_id=None)
+    start_speculative_ocr(message.from_user.id, [data.get('passport_main_file_id')], country)
     
     # --- ИЗМЕНЕННАЯ ЛОГИКА: Вместо go_to_inn ---
     patent_required = data.get('patent_required', False)
@@ -554,7 +746,7 @@ async def process_passport_reg_text(message: Message, state: FSMContext):
 
 @dp.message(Reg.patent_front, F.photo)
 async def process_patent_front(message: Message, state: FSMContext):
-    await state.update_data(patent_front_file_id=message.photo[-1].file_id)
+    await save_document(state, message.from_user.id, 'patent_front', message.photo[-1].file_id)
     await message.answer(
         "📄 *Фото получено!*\n\n"
         "📄 *Шаг 9:* Отправьте фото патента (оборотная сторона).\n"
@@ -577,7 +769,7 @@ async def skip_patent_front(callback: CallbackQuery, state: FSMContext):
 
 @dp.message(Reg.patent_back, F.photo)
 async def process_patent_back(message: Message, state: FSMContext):
-    await state.update_data(patent_back_file_id=message.photo[-1].file_id)
+    await save_document(state, message.from_user.id, 'patent_back', message.photo[-1].file_id)
     await message.answer(
         "📄 *Фото получено!*\n\n"
         "📄 *Шаг 10:* Отправьте фото чека об оплате патента.\n"
@@ -604,7 +796,7 @@ async def skip_patent_back(callback: CallbackQuery, state: FSMContext):
 
 @dp.message(Reg.patent_receipt, F.photo)
 async def process_patent_receipt(message: Message, state: FSMContext):
-    await state.update_data(patent_receipt_file_id=message.photo[-1].file_id)
+    await save_document(state, message.from_user.id, 'patent_receipt', message.photo[-1].file_id)
     await go_to_driver(message, state)
 
 @dp.callback_query(Reg.patent_receipt, F.data == "skip")
@@ -620,7 +812,7 @@ async def skip_patent_receipt(callback: CallbackQuery, state: FSMContext):
 
 @dp.message(Reg.driver_license, F.photo)
 async def process_driver_license(message: Message, state: FSMContext):
-    await state.update_data(driver_license_file_id=message.photo[-1].file_id)
+    await save_document(state, message.from_user.id, 'driver_license', message.photo[-1].file_id)
     await message.answer("🚗 *Фото получено!*\n\n", reply_markup=None)
     await go_to_emergency(message, state)
 
@@ -673,45 +865,22 @@ async def process_video_note(message: Message, state: FSMContext):
             for key in user_data if key.endswith('_file_id') and user_data[key]
         }
 
-        images_for_gemini = []
+        # --- ШАГ 2: Фото уже грузятся в фоне с момента получения; дожидаемся их и догружаем остальное ---
+        upload_results = await collect_uploads(user_id, file_ids_to_upload, user_data.pop('uploaded_files', None) or {})
+        # Одна сверка с бакетом в конце, с повторной загрузкой только битых файлов
+        storage_manifest = await verify_uploads(
+            bot, storage_client, user_id, upload_results, concurrency=UPLOAD_CONCURRENCY
+        )
 
-        # --- ШАГ 2: Скачиваем файлы ОДИН РАЗ и загружаем ВСЕ в Storage ---
-        for key, file_id in file_ids_to_upload.items():
-            try:
-                file_info = await bot.get_file(file_id)
-                file_bytes_io = await bot.download_file(file_info.file_path)
-                file_bytes = file_bytes_io.read() # Читаем байты в переменную
-
-                # Определяем тип контента
-                if key == 'video_note':
-                    content_type = 'video/mp4'
-                else:
-                    content_type = 'image/jpeg'
-
-                # Загружаем ЛЮБОЙ файл в Supabase Storage
-                storage_path = f"{user_id}/{key}.{content_type.split('/')[1]}" # e.g., .../passport_main.jpeg or .../video_note.mp4
-                
-                logger.info(f"📤 Uploading {key} to Storage: {storage_path}, size: {len(file_bytes)} bytes")
-                
-                upload_response = supabase.storage.from_("passports").upload(
-                    path=storage_path,
-                    file=file_bytes,
-                    file_options={"content-type": content_type, "upsert": "true"}
-                )
-                
-                logger.info(f"✅ Upload response for {key}: {upload_response}")
-                
-                # Проверяем, что файл действительно загрузился
-                list_response = supabase.storage.from_("passports").list(str(user_id))
-                logger.info(f"📁 Files in user folder after upload: {list_response}")
-
-                # Заменяем file_id на путь в Storage прямо в user_data
-                user_data[key + '_storage_path'] = storage_path
-                del user_data[key + '_file_id'] # Удаляем старый ключ с file_id
-
-            except Exception as e:
-                logger.error(f"Ошибка при обработке файла {key}: {e}")
-                continue # Пропускаем битый файл и идем дальше
+        for key, result in upload_results.items():
+            if not result.ok:
+                continue # Пропускаем битый файл, file_id остается в анкете
+            # Заменяем file_id на путь в Storage прямо в user_data
+            user_data[key + '_storage_path'] = result.storage_path
+            del user_data[key + '_file_id'] # Удаляем старый ключ с file_id
+
+        failed = [key for key, result in upload_results.items() if not result.ok]
+        logger.info(f"Загружено {len(upload_results) - len(failed)}/{len(upload_results)} файлов пользователя {user_id}, ошибки: {failed}")
 
         # --- ШАГ 3: Готовим данные для отправки на сервер ---
         await message.answer("✅ Документы загружены! Отправляю анкету на сервер для обработки...")
@@ -721,6 +890,11 @@ async def process_video_note(message: Message, state: FSMContext):
         user_data.pop('back_optional', None)
         # Удаляем ИНН, если он вдруг где-то сохранился
         user_data.pop('inn', None)
+        user_data['storageManifest'] = storage_manifest
+        # Распознанные поля паспорта для предзаполнения в админке
+        ocr_data = collect_ocr(user_id)
+        if ocr_data:
+            user_data['ocrData'] = ocr_data
 
         api_data = {
             "action": "bot-register",
@@ -728,47 +902,35 @@ async def process_video_note(message: Message, state: FSMContext):
             "formData": user_data # Отправляем все, что собрали
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(BOT_REGISTER_API, json=api_data) as response:
-                if response.status != 200:
-                    response_text = await response.text()
-                    logger.error(f"API returned status {response.status}: {response_text}")
-                    raise Exception(f"API returned status {response.status}")
-
-                result = await response.json()
-                if result.get('success'):
-
-                    # --- ВОТ ЭТУ СТРОЧКУ НУЖНО ДОБАВИТЬ ---
-                    await notify_admins_about_new_user(user_name=user_data.get('name'), user_id=user_id)
-                    # --- КОНЕЦ ДОБАВЛЕНИЯ ---
-
-                    await message.answer(
-                        t('registration_complete', lang),
-                        parse_mode='Markdown'
-                    )
-                    # Send video with app button - передаем язык через URL
-                    app_url_with_lang = f"{WEB_APP_URL}?lang={lang}"
-                    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text=t('open_app', lang), web_app=WebAppInfo(url=app_url_with_lang))]
-                    ])
-                    # Убедитесь, что файл IMG_7164.MP4 лежит в той же папке
-                    try:
-                        video_for_send = FSInputFile('IMG_7164.MP4')
-                        await message.answer_video(
-                            video=video_for_send,
-                            caption="Посмотрите короткое видео о том, как пользоваться приложением!",
-                            reply_markup=keyboard
-                        )
-                    except FileNotFoundError:
-                        logger.warning("Файл с видео-инструкцией (IMG_7164.MP4) не найден.")
-                        # Просто отправляем сообщение без видео, если файла нет
-                        await message.answer("🚀 Нажмите кнопку ниже, чтобы открыть приложение.", reply_markup=keyboard)
-
-                else:
-                    await message.answer(
-                        f"❌ *Ошибка регистрации*\n\n{result.get('error', 'Неизвестная ошибка')}\n\nПопробуйте еще раз или обратитесь в поддержку.",
-                        parse_mode='Markdown'
-                    )
+        result = await submit_registration(api_data)
+        if result.get('success'):
+
+            # --- ВОТ ЭТУ СТРОЧКУ НУЖНО ДОБАВИТЬ ---
+            notify_admins_about_new_user(user_name=user_data.get('name'), user_id=user_id)
+            # --- КОНЕЦ ДОБАВЛЕНИЯ ---
+
+            await message.answer(
+                t('registration_complete', lang),
+                parse_mode='Markdown'
+            )
+            # Send video with app button - передаем язык через URL
+            # Убедитесь, что файл IMG_7164.MP4 лежит в той же папке
+            try:
+                await media_registry.send('IMG_7164.MP4', lambda video: message.answer_video(
+                    video=video,
+                    caption="Посмотрите короткое видео о том, как пользоваться приложением!",
+                    reply_markup=keyboard('open_app', lang)
+                ))
+            except FileNotFoundError:
+                logger.warning("Файл с видео-инструкцией (IMG_7164.MP4) не найден.")
+                # Просто отправляем сообщение без видео, если файла нет
+                await message.answer("🚀 Нажмите кнопку ниже, чтобы открыть приложение.", reply_markup=keyboard('open_app', lang))
+
+        else:
+            await message.answer(
+                f"❌ *Ошибка регистрации*\n\n{result.get('error', 'Неизвестная ошибка')}\n\nПопробуйте еще раз или обратитесь в поддержку.",
+                parse_mode='Markdown'
+            )
     except Exception as e:
         logger.error("Final registration API call failed: %s", e)
         await message.answer("❌ Произошла ошибка при регистрации. Попробуйте позже.")
@@ -802,31 +964,155 @@ async def notify_handler(request: web.Request):
         logger.error("Notify handler error: %s", e)
         return web.json_response({'error': 'Failed to send message'}, status=500)
 
-async def start_http_server():
+async def notify_batch_handler(request: web.Request):
+    """
+    Массовая рассылка через очередь. Тело запроса:
+    {"messages": [{"user_id": 1, "text": "..."}, ...]} или {"user_ids": [1, 2], "text": "..."}.
+    Сразу возвращает job_id, прогресс — в /notify/status/{job_id}.
+    """
+    if request.headers.get('Authorization') != f'Bearer {ADMIN_SECRET_KEY}':
+        return web.Response(status=401, text='Unauthorized')
+
+    try:
+        data = await request.json()
+        if 'messages' in data:
+            messages = [{'chat_id': item['user_id'], 'text': item['text']} for item in data['messages']]
+        else:
+            messages = [{'chat_id': user_id, 'text': data['text']} for user_id in data['user_ids']]
+        if not messages or not all(item['chat_id'] and item['text'] for item in messages):
+            raise ValueError('empty user_id or text')
+    except (ValueError, KeyError, TypeError) as e:
+        return web.json_response({'error': f'Invalid batch: {e}'}, status=400)
+
+    try:
+        job = notify_queue.submit(messages)
+    except QueueFullError as e:
+        logger.warning("Notify batch rejected: %s", e)
+        return web.json_response({'error': 'Queue is full, try again later'}, status=429)
+
+    logger.info(f"Рассылка {job.id}: {job.total} сообщений поставлено в очередь")
+    return web.json_response({'success': True, 'job_id': job.id, 'total': job.total}, status=202)
+
+async def notify_status_handler(request: web.Request):
+    if request.headers.get('Authorization') != f'Bearer {ADMIN_SECRET_KEY}':
+        return web.Response(status=401, text='Unauthorized')
+
+    job = notify_queue.get_job(request.match_info['job_id'])
+    if job is None:
+        return web.json_response({'error': 'Job not found'}, status=404)
+    return web.json_response(job.to_dict())
+
+async def ocr_stats_handler(request: web.Request):
+    """Глубина и время ожидания очереди OCR, счетчики кэшей."""
+    if request.headers.get('Authorization') != f'Bearer {ADMIN_SECRET_KEY}':
+        return web.Response(status=401, text='Unauthorized')
+
+    return web.json_response({
+        'queue': ocr_queue.stats(),
+        'cache': get_cache_stats(),
+        'prompt_cache': get_prompt_cache_stats(),
+    })
+
+async def metrics_handler(request: web.Request):
+    """Метрики в текстовом формате Prometheus."""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return web.Response(status=401, text='Unauthorized')
+
+    sessions = await count_sessions(storage)
+    if sessions is not None:
+        FSM_SESSIONS.set(sessions)
+    return web.Response(body=REGISTRY.render().encode('utf-8'), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+def create_http_app() -> web.Application:
+    """HTTP API бота: уведомления, статистика, /metrics и вебхук."""
     app = web.Application()
     app.router.add_post('/notify', notify_handler)
-    runner = web.AppRunner(app)
+    app.router.add_post('/notify/batch', notify_batch_handler)
+    app.router.add_get('/notify/status/{job_id}', notify_status_handler)
+    app.router.add_get('/ocr/stats', ocr_stats_handler)
+    app.router.add_get('/metrics', metrics_handler)
+    if BOT_MODE == 'webhook':
+        app.router.add_post(WEBHOOK_PATH, webhook_handler)
+    return app
+
+async def start_http_server() -> web.AppRunner:
+    runner = web.AppRunner(create_http_app())
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8080)
+    site = web.TCPSite(runner, '0.0.0.0', HTTP_PORT)
     await site.start()
-    logger.info("HTTP server for notifications started on port 8080")
+    logger.info(f"HTTP server for notifications started on port {HTTP_PORT}")
+    return runner
 
 # --- Главная функция запуска ---
 async def main():
+    global api_session
+    warmup_task = None
     # Конфигурируем Gemini при старте бота
     if GEMINI_API_KEY:
-        configure_gemini(GEMINI_API_KEY)
+        configure_gemini(
+            GEMINI_API_KEY,
+            default_model=GEMINI_MODEL,
+            models=parse_model_overrides(GEMINI_MODELS),
+            generation_config={'temperature': GEMINI_TEMPERATURE, 'response_mime_type': 'application/json'}
+        )
+        configure_prompt_cache(GEMINI_PROMPT_CACHE, ttl=GEMINI_PROMPT_CACHE_TTL)
+        # Прогрев идет в фоне и не задерживает старт бота
+        warmup_task = asyncio.create_task(warm_up_gemini()) if GEMINI_WARMUP else None
     else:
         logger.error("Ключ GEMINI_API_KEY не найден. Распознавание не будет работать.")
+    configure_preprocessing(
+        max_edge=OCR_MAX_EDGE, quality=OCR_IMAGE_QUALITY, grayscale=OCR_GRAYSCALE,
+        image_format=OCR_IMAGE_FORMAT, workers=OCR_PREP_WORKERS, use_processes=OCR_PREP_PROCESSES
+    )
+    configure_ocr_cache(max_entries=OCR_CACHE_SIZE, ttl=OCR_CACHE_TTL, db_path=OCR_CACHE_DB)
+    configure_mrz(enabled=MRZ_ENABLED, skip_llm=MRZ_SKIP_LLM)
+    configure_validation(reask_attempts=OCR_REASK_ATTEMPTS)
+
+    configure_transfers(UPLOAD_SPOOL_THRESHOLD, UPLOAD_MEMORY_BUDGET)
+    api_session = create_api_session(timeout=BOT_REGISTER_API_TIMEOUT * BOT_REGISTER_API_ATTEMPTS)
+    await notify_queue.start()
+    await ocr_queue.start()
+    if TRANSLATIONS_RELOAD_INTERVAL > 0:
+        translation_watcher.start()
 
-    # Запускаем HTTP сервер параллельно с ботом
-    http_server_task = asyncio.create_task(start_http_server())
+    # HTTP сервер (уведомления и, в режиме вебхука, апдейты Telegram)
+    http_runner = await start_http_server()
 
-    logger.info("🤖 Бот запущен!")
-    await dp.start_polling(bot)
+    logger.info(f"🤖 Бот запущен! Режим: {BOT_MODE}")
+    try:
+        if BOT_MODE == 'webhook':
+            if not WEBHOOK_SECRET:
+                logger.warning("WEBHOOK_SECRET не задан: вебхук принимает запросы без проверки токена.")
+            await bot.set_webhook(
+                f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+            await asyncio.Event().wait()
+        else:
+            # Вебхук и long polling взаимоисключающие
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if warmup_task is not None and not warmup_task.done():
+            warmup_task.cancel()
+            await asyncio.gather(warmup_task, return_exceptions=True)
+        await http_runner.cleanup()
+        await webhook_handler.shutdown()
+        if BOT_MODE == 'webhook':
+            # В режиме polling это делает dp.start_polling: shutdown-хэндлеры (закрывают FSM) и сессия бота
+            await dp.emit_shutdown(bot=bot)
+            await bot.session.close()
+        await notify_queue.stop()
+        await ocr_queue.stop()
+        await upload_tasks.stop()
+        await ocr_tasks.stop()
+        await translation_watcher.stop()
+        await api_session.close()
+        await storage_client.close()
 
 if __name__ == '__main__':
     try:
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
-        logger.info("🛑 Бот остановлен.")
\ No newline at end of file
+        logger.info("🛑 Бот остановлен.")
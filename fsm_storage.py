@@ -0,0 +1,146 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+def compact_dumps(data: Any) -> str:
+    """Компактная сериализация данных FSM: без пробелов и \\u-экранирования кириллицы."""
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище во встроенной SQLite.
+
+    Переживает перезапуск бота и может использоваться несколькими процессами
+    на одной машине (WAL). Запись о пользователе живет `ttl` секунд с момента
+    последнего изменения; просроченные записи не возвращаются и периодически
+    удаляются. Все обращения к базе идут через один выделенный поток, чтобы
+    не блокировать event loop.
+    """
+
+    _PRUNE_EVERY = 500  # Чистим просроченные записи раз в N записей
+
+    def __init__(self, path: str, *, ttl: Optional[int] = None):
+        self._ttl = ttl
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-sqlite')
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm ("
+            " key TEXT PRIMARY KEY,"
+            " state TEXT,"
+            " data TEXT,"
+            " expires_at REAL)"
+        )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _expires_at(self) -> Optional[float]:
+        return time.time() + self._ttl if self._ttl else None
+
+    def _read(self, key: str, column: str):
+        row = self._conn.execute(
+            f"SELECT {column} FROM fsm WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, key: str, column: str, value: Optional[str]):
+        now = time.time()
+        # Просроченная запись не должна «воскреснуть» вместе с продлением TTL
+        self._conn.execute("DELETE FROM fsm WHERE key = ? AND expires_at <= ?", (key, now))
+        self._conn.execute(
+            f"INSERT INTO fsm (key, {column}, expires_at) VALUES (?, ?, ?) "
+            f"ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}, expires_at = excluded.expires_at",
+            (key, value, self._expires_at())
+        )
+        # Пустые записи (без состояния и данных) не храним
+        self._conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data IS NULL", (key,))
+        self._writes += 1
+        if self._writes % self._PRUNE_EVERY == 0:
+            self._conn.execute("DELETE FROM fsm WHERE expires_at <= ?", (now,))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._run(self._write, self._key_builder.build(key), 'state', value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._run(self._read, self._key_builder.build(key), 'state')
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        value = compact_dumps(dict(data)) if data else None
+        await self._run(self._write, self._key_builder.build(key), 'data', value)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self._run(self._read, self._key_builder.build(key), 'data')
+        return json.loads(value) if value else {}
+
+    def _count_sessions(self) -> int:
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM fsm WHERE state IS NOT NULL AND (expires_at IS NULL OR expires_at > ?)",
+            (time.time(),)
+        ).fetchone()
+        return row[0]
+
+    async def count_sessions(self) -> int:
+        """Сколько пользователей сейчас в каком-либо состоянии (незаконченные сценарии)."""
+        return await self._run(self._count_sessions)
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=False)
+
+
+async def count_sessions(storage: BaseStorage) -> Optional[int]:
+    """
+    Число активных сессий FSM для метрик; None, если хранилище не умеет считать
+    дешево (Redis — пришлось бы сканировать все ключи).
+    """
+    if isinstance(storage, SQLiteStorage):
+        return await storage.count_sessions()
+    if isinstance(storage, MemoryStorage):
+        return sum(1 for record in storage.storage.values() if record.state is not None)
+    return None
+
+
+def create_fsm_storage(url: str, ttl: Optional[int] = None) -> BaseStorage:
+    """
+    Создает FSM-хранилище по URL.
+
+    - memory://                 — память процесса (как раньше, без персистентности)
+    - sqlite:///path/to/fsm.db  — встроенная SQLite
+    - redis://host:6379/0       — Redis (или совместимый сервер), общий для нескольких реплик
+    """
+    if url.startswith('memory://'):
+        return MemoryStorage()
+    if url.startswith('sqlite://'):
+        path = url[len('sqlite:///'):] if url.startswith('sqlite:///') else url[len('sqlite://'):]
+        logger.info(f"FSM storage: SQLite ({path})")
+        return SQLiteStorage(path or 'fsm_state.db', ttl=ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        # redis — необязательная зависимость, нужна только для этого бэкенда
+        from aiogram.fsm.storage.redis import RedisStorage
+        logger.info("FSM storage: Redis")
+        return RedisStorage.from_url(
+            url,
+            key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+            state_ttl=ttl,
+            data_ttl=ttl,
+            json_dumps=compact_dumps
+        )
+    raise ValueError(f"Unsupported FSM_STORAGE_URL: {url}")
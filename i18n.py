@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+from string import Formatter
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+_formatter = Formatter()
+
+
+class Template:
+    """
+    Перевод с подстановками, разобранный один раз при загрузке.
+
+    render() склеивает готовые куски текста со значениями вместо разбора
+    строки на каждом вызове, как это делает str.format.
+    """
+    __slots__ = ('source', '_pieces', '_simple')
+
+    def __init__(self, source: str):
+        self.source = source
+        self._pieces = list(_formatter.parse(source))
+        # Спецификаторы формата ({x:>5}, {x!r}) и составные имена ({a.b}) отдаем str.format
+        self._simple = all(
+            not spec and not conversion and (name is None or name.isidentifier())
+            for _, name, spec, conversion in self._pieces
+        )
+
+    def render(self, kwargs: Dict[str, Any]) -> str:
+        if not self._simple:
+            return self.source.format(**kwargs)
+        parts = []
+        for literal, name, _, _ in self._pieces:
+            parts.append(literal)
+            if name is not None:
+                parts.append(str(kwargs[name]))
+        return ''.join(parts)
+
+
+def _compile(text: str) -> Union[str, Template]:
+    # Строки без подстановок остаются строками: t() отдает их без лишней работы
+    if '{' not in text and '}' not in text:
+        return text
+    return Template(text)
+
+
+_EMPTY: Dict[str, str] = {}
+
+KeyboardBuilder = Callable[[Callable[..., str], str], Any]
+
+# Построители клавиатур: name → builder(t, lang), см. register_keyboard()
+_keyboard_builders: Dict[str, KeyboardBuilder] = {}
+
+
+def register_keyboard(name: str):
+    """Декоратор: клавиатура, которая строится один раз на язык при загрузке переводов."""
+    def decorator(builder: KeyboardBuilder) -> KeyboardBuilder:
+        _keyboard_builders[name] = builder
+        return builder
+    return decorator
+
+
+class TranslationBundle:
+    """
+    Скомпилированные переводы: таблица на язык с готовыми строками и шаблонами,
+    плюс клавиатуры, построенные заранее для каждого языка. Объект не меняется
+    после создания — новая версия переводов приходит новым бандлом.
+    """
+
+    def __init__(self, translations: Dict[str, Dict[str, str]], version: Optional[float] = None):
+        self.version = version
+        self.tables: Dict[str, Dict[str, Union[str, Template]]] = {
+            lang: {key: _compile(text) for key, text in table.items()}
+            for lang, table in translations.items()
+        }
+        self._keyboards: Dict[Tuple[str, str], Any] = {}
+        for name in _keyboard_builders:
+            for lang in self.tables:
+                self.keyboard(name, lang)
+
+    def t(self, key: str, lang: str = 'en', **kwargs) -> str:
+        text = self.tables.get(lang, _EMPTY).get(key, key)
+        if text.__class__ is str:
+            # Строки без фигурных скобок str.format не меняет
+            return text
+        return text.render(kwargs) if kwargs else text.source
+
+    def keyboard(self, name: str, lang: str):
+        markup = self._keyboards.get((name, lang))
+        if markup is None:
+            # Клавиатура зарегистрирована после загрузки или язык без таблицы — строим и запоминаем
+            markup = _keyboard_builders[name](self.t, lang)
+            self._keyboards[(name, lang)] = markup
+        return markup
+
+
+def load_bundle(path: str) -> TranslationBundle:
+    """Читает и компилирует translations.json; исключение, если файл битый."""
+    version = os.stat(path).st_mtime_ns
+    with open(path, 'r', encoding='utf-8') as f:
+        translations = json.load(f)
+    if not isinstance(translations, dict) or not all(isinstance(table, dict) for table in translations.values()):
+        raise ValueError(f"{path}: expected {{lang: {{key: text}}}}")
+    return TranslationBundle(translations, version=version)
+
+
+# Текущий бандл; замена — одно присваивание ссылки, читатели видят старый или новый целиком
+_bundle = TranslationBundle({'ru': {}, 'en': {}})
+
+
+def init_translations(path: str = 'translations.json') -> TranslationBundle:
+    global _bundle
+    try:
+        _bundle = load_bundle(path)
+    except FileNotFoundError:
+        logger.error(f"{path} not found!")
+    return _bundle
+
+
+def t(key: str, lang: str = 'en', **kwargs) -> str:
+    """Get translation by key"""
+    # Горячий путь: то же, что TranslationBundle.t, без лишнего вызова и перепаковки kwargs
+    text = _bundle.tables.get(lang, _EMPTY).get(key, key)
+    if text.__class__ is str:
+        return text
+    return text.render(kwargs) if kwargs else text.source
+
+
+def keyboard(name: str, lang: str):
+    """Готовая клавиатура на языке lang (общий неизменяемый объект)."""
+    return _bundle.keyboard(name, lang)
+
+
+class TranslationWatcher:
+    """
+    Следит за mtime файла переводов и подменяет бандл без перезапуска бота.
+
+    Новый файл читается и компилируется в потоке; если он битый (например,
+    сохранен наполовину), остается старый бандл, а попытка повторится при
+    следующем изменении файла.
+    """
+
+    def __init__(self, path: str = 'translations.json', interval: float = 2.0):
+        self._path = path
+        self._interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _watch(self):
+        global _bundle
+        failed_version = None
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                version = os.stat(self._path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if version == _bundle.version or version == failed_version:
+                continue
+            try:
+                bundle = await asyncio.to_thread(load_bundle, self._path)
+            except Exception as e:
+                failed_version = version
+                logger.error(f"Не удалось перезагрузить {self._path}, остаются прежние переводы: {e}")
+                continue
+            _bundle = bundle
+            logger.info(f"Переводы перезагружены из {self._path}: {', '.join(bundle.tables)}")
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import io
+import logging
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Union
+
+from PIL import Image, ImageChops, ImageOps, ImageStat
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class PreparedImage:
+    """Сжатое изображение, готовое к отправке в Gemini, и статистика сжатия."""
+    data: bytes
+    mime_type: str
+    bytes_in: int
+    pixels_in: int
+    pixels_out: int
+
+    @property
+    def bytes_out(self) -> int:
+        return len(self.data)
+
+    def as_part(self) -> dict:
+        """Часть запроса generate_content в виде inline blob."""
+        return {'mime_type': self.mime_type, 'data': self.data}
+
+
+@dataclass(frozen=True)
+class PrepSettings:
+    """Параметры предобработки; передаются в воркер явно, чтобы работал и пул процессов."""
+    max_edge: int = 1600
+    quality: int = 85
+    grayscale: str = 'auto'  # 'auto' | 'always' | 'never'
+    image_format: str = 'JPEG'
+
+
+# Настройки предобработки, см. configure_preprocessing()
+_settings = PrepSettings()
+_executor: Executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='image-prep')
+
+# Накопленная статистика сжатия за время работы процесса
+PREP_STATS = {'images': 0, 'bytes_in': 0, 'bytes_out': 0, 'pixels_in': 0, 'pixels_out': 0}
+
+_BORDER_THRESHOLD = 24  # Насколько пиксель должен отличаться от фона, чтобы не считаться полем
+_GRAYSCALE_SATURATION = 20  # Средняя насыщенность (0..255), ниже которой цвет не несет информации
+_BORDER_PROBE_EDGE = 512  # Поля ищем на уменьшенной копии: меньше работы и короче удержание GIL
+
+
+def configure_preprocessing(max_edge: int = 1600, quality: int = 85, grayscale: str = 'auto',
+                            image_format: str = 'JPEG', workers: int = 2, use_processes: bool = False):
+    """
+    Настраивает предобработку фото документов перед OCR.
+
+    Все декодирование и кодирование изображений идет в отдельном пуле, event
+    loop только ждет готовые байты.
+
+    :param max_edge: Длинная сторона после уменьшения, px.
+    :param quality: Качество JPEG/WebP.
+    :param grayscale: 'auto' — в оттенки серого только почти бесцветные фото, 'always', 'never'.
+    :param image_format: 'JPEG' или 'WEBP'.
+    :param workers: Размер пула.
+    :param use_processes: Пул процессов вместо потоков (обходит GIL на больших пачках).
+    """
+    global _settings, _executor
+    _settings = PrepSettings(max_edge=max_edge, quality=quality, grayscale=grayscale,
+                             image_format=image_format.upper())
+    _executor.shutdown(wait=False)
+    if use_processes:
+        _executor = ProcessPoolExecutor(max_workers=workers)
+    else:
+        _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-prep')
+    logger.info(f"Предобработка фото: {_settings}, пул {'процессов' if use_processes else 'потоков'} x{workers}")
+
+
+def _crop_borders(image: Image.Image) -> Image.Image:
+    """Обрезает однотонные поля вокруг документа (цвет фона берется из угла)."""
+    factor = max(1, max(image.size) // _BORDER_PROBE_EDGE)
+    rgb = image.convert('RGB')
+    if factor > 1:
+        rgb = rgb.reduce(factor)
+    background = Image.new('RGB', rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, background).convert('L').point(lambda p: 255 if p > _BORDER_THRESHOLD else 0)
+    bbox = diff.getbbox()
+    if not bbox:
+        return image
+    # Границы с уменьшенной копии — в координаты оригинала, с запасом на округление
+    width, height = image.size
+    left, top, right, bottom = bbox
+    bbox = (max(0, (left - 1) * factor), max(0, (top - 1) * factor),
+            min(width, (right + 1) * factor), min(height, (bottom + 1) * factor))
+    # Режем только заметные поля, чтобы не терять края документа из-за шума
+    left, top, right, bottom = bbox
+    if (right - left) * (bottom - top) > 0.95 * width * height:
+        return image
+    return image.crop(bbox)
+
+
+def _is_colorless(image: Image.Image) -> bool:
+    saturation = image.convert('RGB').convert('HSV').getchannel('S')
+    return ImageStat.Stat(saturation).mean[0] < _GRAYSCALE_SATURATION
+
+
+def prepare_image(source_image: Union[bytes, Image.Image], settings: PrepSettings) -> PreparedImage:
+    """
+    Декодирует фото и готовит его к OCR: поворот по EXIF, обрезка полей,
+    уменьшение до settings.max_edge по длинной стороне, при необходимости
+    оттенки серого и перекодирование в компактный JPEG/WebP.
+
+    Принимает байты файла или уже открытый PIL Image. Вызывается только в пуле.
+    """
+    if isinstance(source_image, Image.Image):
+        # Чужой объект не закрываем
+        source = source_image
+        bytes_in = source.width * source.height * len(source.getbands())
+        owner = contextlib.nullcontext()
+    else:
+        source = Image.open(io.BytesIO(source_image))
+        bytes_in = len(source_image)
+        owner = source
+
+    with owner:
+        pixels_in = source.width * source.height
+        scale = settings.max_edge / max(source.size)
+        if owner is source and scale < 1:
+            # JPEG сразу декодируется в уменьшенном масштабе (не меньше max_edge): быстрее и меньше памяти.
+            # draft уменьшает, только пока обе стороны не меньше заданных, поэтому размер — с пропорциями фото
+            source.draft(source.mode, (int(source.width * scale), int(source.height * scale)))
+        image = ImageOps.exif_transpose(source)
+        image = _crop_borders(image)
+        if max(image.size) > settings.max_edge:
+            image = image.copy() if image is source else image
+            image.thumbnail((settings.max_edge, settings.max_edge), Image.LANCZOS)
+
+        if settings.grayscale == 'always' or (settings.grayscale == 'auto' and _is_colorless(image)):
+            image = image.convert('L')
+        else:
+            image = image.convert('RGB')
+
+        buffer = io.BytesIO()
+        image.save(buffer, settings.image_format, quality=settings.quality, optimize=True)
+
+    return PreparedImage(
+        data=buffer.getvalue(),
+        mime_type=f"image/{settings.image_format.lower()}",
+        bytes_in=bytes_in,
+        pixels_in=pixels_in,
+        pixels_out=image.width * image.height
+    )
+
+
+async def run_in_pool(func, *args):
+    """
+    Выполняет func(*args) в пуле предобработки (например, чтение MRZ).
+    Для пула процессов func и аргументы должны сериализоваться pickle.
+    """
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+async def prepare_images(images: List[Union[bytes, Image.Image]]) -> List[PreparedImage]:
+    """Готовит пачку фото параллельно в пуле, event loop только ждет результаты."""
+    loop = asyncio.get_running_loop()
+    prepared = await asyncio.gather(*(
+        loop.run_in_executor(_executor, prepare_image, image, _settings) for image in images
+    ))
+
+    bytes_in = sum(p.bytes_in for p in prepared)
+    bytes_out = sum(p.bytes_out for p in prepared)
+    pixels_in = sum(p.pixels_in for p in prepared)
+    pixels_out = sum(p.pixels_out for p in prepared)
+    PREP_STATS['images'] += len(prepared)
+    PREP_STATS['bytes_in'] += bytes_in
+    PREP_STATS['bytes_out'] += bytes_out
+    PREP_STATS['pixels_in'] += pixels_in
+    PREP_STATS['pixels_out'] += pixels_out
+    if prepared:
+        logger.info(
+            f"Предобработка {len(prepared)} фото: {bytes_in} → {bytes_out} байт "
+            f"({bytes_out / max(bytes_in, 1):.0%}), {pixels_in} → {pixels_out} px"
+        )
+    return list(prepared)
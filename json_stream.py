@@ -0,0 +1,162 @@
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = ' \t\r\n'
+_decoder = json.JSONDecoder()
+# Начало следующего поля: ',"ключ":' (кавычка после запятой не может быть внутри строки)
+_NEXT_FIELD = re.compile(r',\s*"(?:[^"\\]|\\.)*"\s*:')
+
+
+class JsonObjectStream:
+    """
+    Инкрементальный разбор одного JSON-объекта верхнего уровня из потока кусков текста.
+
+    feed() возвращает поля, значения которых полностью пришли в этом куске,
+    поэтому данные можно проверять или показывать, не дожидаясь конца ответа.
+    Все до первой '{' (```json, пояснения модели) и все после закрывающей '}'
+    пропускается. Мусор между полями пропускается до следующего ключа, битое
+    значение — до следующего ',"ключ":', а оборванный хвост не трогает уже
+    разобранные поля.
+    """
+
+    def __init__(self):
+        self._buffer = ''
+        self._pos = 0
+        self._state = 'seek'  # seek | key | colon | value | after_value | done
+        self._key = None
+        self.fields: Dict[str, Any] = {}
+
+    @property
+    def started(self) -> bool:
+        return self._state != 'seek'
+
+    @property
+    def complete(self) -> bool:
+        return self._state == 'done'
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Добавляет кусок текста и возвращает новые готовые поля [(ключ, значение)]."""
+        self._buffer += chunk
+        return self._parse(final=False)
+
+    def finish(self) -> List[Tuple[str, Any]]:
+        """Конец потока: дописывает последнее поле, если его можно разобрать."""
+        return self._parse(final=True)
+
+    def _skip_whitespace(self):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+            self._pos += 1
+
+    def _decode_at(self, final: bool):
+        """Значение с текущей позиции или None, если оно еще не пришло целиком."""
+        try:
+            value, end = _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError:
+            return None
+        # Число в конце буфера может продолжиться в следующем куске ("12" → "123")
+        if end == len(self._buffer) and not final and isinstance(value, (int, float)) and not isinstance(value, bool):
+            return None
+        return value, end
+
+    def _next_field(self) -> Optional[int]:
+        """
+        Позиция следующего ',"ключ":', если значение с текущей позиции битое,
+        а не просто еще не пришло целиком; иначе None.
+        """
+        match = _NEXT_FIELD.search(self._buffer, self._pos)
+        if match is None:
+            return None
+        try:
+            _decoder.raw_decode(self._buffer, self._pos)
+        except json.JSONDecodeError as e:
+            # Ошибка до следующего поля — значение битое; за ним — просто недописано
+            return match.start() if e.pos < match.start() else None
+        return None
+
+    def _parse(self, final: bool) -> List[Tuple[str, Any]]:
+        emitted = []
+        buffer = self._buffer
+        while self._pos < len(buffer) and self._state != 'done':
+            if self._state == 'seek':
+                start = buffer.find('{', self._pos)
+                if start < 0:
+                    self._pos = len(buffer)
+                    break
+                self._pos = start + 1
+                self._state = 'key'
+                continue
+
+            self._skip_whitespace()
+            if self._pos >= len(buffer):
+                break
+            char = buffer[self._pos]
+
+            if self._state == 'key':
+                if char == '}':
+                    self._pos += 1
+                    self._state = 'done'
+                elif char == '"':
+                    decoded = self._decode_at(final)
+                    if decoded is None:
+                        break
+                    self._key, self._pos = decoded
+                    self._state = 'colon'
+                else:
+                    # Запятая или мусор между полями
+                    self._pos += 1
+
+            elif self._state == 'colon':
+                if char == ':':
+                    self._pos += 1
+                    self._state = 'value'
+                else:
+                    # Ключ без двоеточия — считаем мусором и ищем следующий
+                    self._state = 'key'
+
+            elif self._state == 'value':
+                decoded = self._decode_at(final)
+                if decoded is None:
+                    next_field = self._next_field()
+                    if next_field is not None:
+                        logger.warning(f"Не удалось разобрать значение поля '{self._key}', поле пропущено.")
+                        self._pos = next_field
+                        self._state = 'key'
+                        continue
+                    if final:
+                        logger.warning(f"Не удалось разобрать значение поля '{self._key}', хвост ответа отброшен.")
+                    break
+                value, self._pos = decoded
+                self.fields[self._key] = value
+                emitted.append((self._key, value))
+                self._state = 'after_value'
+
+            elif self._state == 'after_value':
+                # ',' перед следующим ключом или '}' в конце объекта; мусор пропустит состояние key
+                if char in ',}':
+                    self._pos += 1
+                self._state = 'done' if char == '}' else 'key'
+        return emitted
+
+    def result(self) -> Dict[str, Any]:
+        """Разобранные поля после finish(); ValueError, если объекта нет или не разобрано ни одного поля."""
+        if not self.started:
+            raise ValueError(f"No JSON object in model response: {self._buffer[:200]!r}")
+        if not self.complete and not self.fields:
+            raise ValueError(f"Malformed JSON object in model response: {self._buffer[:200]!r}")
+        return self.fields
+
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """
+    Разбирает ответ модели с JSON-объектом: терпит ```json-обертку, текст вокруг
+    и битый хвост.
+    """
+    stream = JsonObjectStream()
+    stream.feed(text)
+    stream.finish()
+    return stream.result()
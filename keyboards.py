@@ -0,0 +1,54 @@
+"""
+Клавиатуры регистрации, которые зависят только от языка.
+
+Строятся один раз на язык при загрузке переводов (см. i18n.register_keyboard)
+и переиспользуются во всех апдейтах. Объекты aiogram неизменяемые (frozen),
+поэтому один экземпляр безопасно отдавать всем пользователям.
+"""
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, KeyboardButton, ReplyKeyboardMarkup
+
+from i18n import register_keyboard
+
+
+@register_keyboard('language')
+def build_language_keyboard(t, lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🇷🇺 Русский", callback_data="lang_ru")],
+        [InlineKeyboardButton(text="🇬🇧 English", callback_data="lang_en")]
+    ])
+
+
+@register_keyboard('agreement')
+def build_agreement_keyboard(t, lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t('agree_button', lang), callback_data="agree_and_continue")]
+    ])
+
+
+@register_keyboard('share_contact')
+def build_share_contact_keyboard(t, lang: str) -> ReplyKeyboardMarkup:
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text=t('share_contact', lang), request_contact=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+
+
+@register_keyboard('country')
+def build_country_keyboard(t, lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t('country_russia', lang), callback_data="country_ru")],
+        [InlineKeyboardButton(text=t('country_kazakhstan', lang), callback_data="country_kz")],
+        [InlineKeyboardButton(text=t('country_kyrgyzstan', lang), callback_data="country_kg")],
+        [InlineKeyboardButton(text=t('country_uzbekistan', lang), callback_data="country_uz")],
+        [InlineKeyboardButton(text=t('country_tajikistan', lang), callback_data="country_tj")],
+        [InlineKeyboardButton(text=t('country_other', lang), callback_data="country_other")]
+    ])
+
+
+@register_keyboard('skip')
+def build_skip_keyboard(t, lang: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=t('skip', lang), callback_data="skip")]
+    ])
+
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, Message
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Вложения сообщения, из которых берем file_id загруженного файла
+_MEDIA_ATTRIBUTES = ('document', 'video', 'animation', 'audio', 'voice', 'video_note', 'photo')
+
+SendMedia = Callable[[Union[str, FSInputFile]], Awaitable[Message]]
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_id_of(message: Message) -> Optional[str]:
+    for attribute in _MEDIA_ATTRIBUTES:
+        media = getattr(message, attribute, None)
+        if media:
+            # У фото — список размеров, берем самый большой
+            return media[-1].file_id if isinstance(media, list) else media.file_id
+    return None
+
+
+def _is_file_id_error(error: TelegramBadRequest) -> bool:
+    # "wrong file identifier/HTTP URL specified", "FILE_REFERENCE_EXPIRED" и т.п.
+    return 'file' in str(error).lower()
+
+
+class MediaRegistry:
+    """
+    Реестр file_id статических файлов (соглашения, видео-инструкция).
+
+    Файл загружается в Telegram один раз; file_id из ответа сохраняется в JSON
+    по sha256 содержимого, дальше файл отправляется по file_id. Изменился файл —
+    изменился хэш, и при следующей отправке он загрузится заново. Если Telegram
+    отверг file_id (например, сменился токен бота), запись удаляется и файл
+    тоже загружается заново.
+    """
+
+    def __init__(self, path: str = 'media_registry.json'):
+        self._path = path
+        self._entries: Dict[str, dict] = {}
+        self._digests: Dict[str, Tuple[int, int, str]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.uploads = 0
+        self.reused = 0
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Реестр медиа {path} не прочитан, файлы будут загружены заново: {e}")
+
+    async def _digest(self, path: str) -> str:
+        """sha256 файла; пересчитывается, только если изменились mtime или размер."""
+        stat = await asyncio.to_thread(os.stat, path)
+        cached = self._digests.get(path)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = await asyncio.to_thread(_file_digest, path)
+        self._digests[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _save(self, entries: Dict[str, dict]):
+        tmp_path = f"{self._path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self._path)
+
+    async def _store(self, path: str, digest: str, file_id: str):
+        name = os.path.basename(path)
+        # Записи прежних версий того же файла больше не нужны
+        for key in [key for key, entry in self._entries.items() if entry.get('name') == name and key != digest]:
+            del self._entries[key]
+        self._entries[digest] = {'name': name, 'file_id': file_id, 'uploaded_at': time.time()}
+        try:
+            await asyncio.to_thread(self._save, dict(self._entries))
+        except OSError as e:
+            logger.warning(f"Не удалось сохранить реестр медиа {self._path}: {e}")
+
+    async def _send_by_id(self, path: str, digest: str, send: SendMedia) -> Optional[Message]:
+        """Отправка по сохраненному file_id; None — записи нет или Telegram ее отверг."""
+        entry = self._entries.get(digest)
+        if not entry:
+            return None
+        try:
+            message = await send(entry['file_id'])
+        except TelegramBadRequest as e:
+            if not _is_file_id_error(e):
+                raise
+            logger.warning(f"file_id для {path} больше не действует, загружаем заново: {e}")
+            if self._entries.get(digest) is entry:
+                del self._entries[digest]
+            return None
+        self.reused += 1
+        return message
+
+    async def send(self, path: str, send: SendMedia) -> Message:
+        """
+        Отправляет файл через `send(media)`, где media — file_id или FSInputFile.
+
+        :raises FileNotFoundError: файла нет на диске.
+        """
+        digest = await self._digest(path)
+        message = await self._send_by_id(path, digest, send)
+        if message is not None:
+            return message
+
+        # Загружает один: параллельные отправки того же файла дождутся его file_id
+        async with self._locks.setdefault(digest, asyncio.Lock()):
+            message = await self._send_by_id(path, digest, send)
+            if message is not None:
+                return message
+            message = await send(FSInputFile(path))
+            self.uploads += 1
+            file_id = _file_id_of(message)
+            if file_id:
+                await self._store(path, digest, file_id)
+                logger.info(f"{path} загружен в Telegram, file_id сохранен")
+            return message
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'uploads': self.uploads, 'reused': self.reused}
@@ -0,0 +1,261 @@
+"""
+Метрики бота в текстовом формате Prometheus (GET /metrics).
+
+Без внешних зависимостей: счетчики живут в памяти процесса, запись — это
+поиск дочерней серии по кортежу меток и сложение, гистограмма — еще и
+bisect по границам бакетов. Текст собирается только при запросе /metrics.
+"""
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Секунды: от быстрых хэндлеров до долгих загрузок и распознавания
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ('_bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._bounds = bounds
+        # Последняя ячейка — наблюдения больше верхней границы (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self._bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional['Registry'] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values: str) -> Any:
+        """Серия с этими значениями меток (строки, в порядке labelnames); создается при первом обращении."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _series(self):
+        return sorted(self._children.items(), key=lambda series: tuple(map(str, series[0])))
+
+    def _render_samples(self, lines: List[str]):
+        raise NotImplementedError
+
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.type}")
+        self._render_samples(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик."""
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_samples(self, lines: List[str]):
+        for values, child in self._series():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.value)}")
+
+
+class Gauge(_Metric):
+    """Текущее значение, может расти и убывать."""
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    _render_samples = Counter._render_samples
+
+
+class Histogram(_Metric):
+    """Распределение значений (обычно длительностей) по бакетам."""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional['Registry'] = None):
+        self._bounds = tuple(sorted(float(bound) for bound in buckets if not math.isinf(bound)))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramChild(self._bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_samples(self, lines: List[str]):
+        for values, child in self._series():
+            cumulative = 0
+            for bound, count in zip(self._bounds + (math.inf,), child.counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            metric.render(lines)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# --- Метрики бота ---
+HANDLER_SECONDS = Histogram(
+    'bot_handler_seconds', 'Время обработки апдейта по типу события и состоянию регистрации',
+    ('event', 'state')
+)
+HANDLER_ERRORS = Counter(
+    'bot_handler_errors_total', 'Исключения в хэндлерах по типу события и состоянию регистрации',
+    ('event', 'state')
+)
+TELEGRAM_API_SECONDS = Histogram('telegram_api_seconds', 'Время вызова Telegram Bot API', ('method',))
+TELEGRAM_API_ERRORS = Counter('telegram_api_errors_total', 'Ошибки вызовов Telegram Bot API', ('method', 'error'))
+STORAGE_SECONDS = Histogram('storage_request_seconds', 'Время запроса к Supabase Storage', ('operation',))
+STORAGE_BYTES = Counter('storage_bytes_total', 'Байт передано в/из Supabase Storage', ('operation',))
+STORAGE_ERRORS = Counter('storage_errors_total', 'Неудачные запросы к Supabase Storage', ('operation',))
+REGISTER_API_SECONDS = Histogram(
+    'register_api_seconds', 'Время отправки анкеты в BOT_REGISTER_API (с повторами)'
+)
+REGISTER_API_RESPONSES = Counter(
+    'register_api_responses_total', 'Ответы BOT_REGISTER_API по статусу (timeout/connection — без ответа)',
+    ('status',)
+)
+GEMINI_SECONDS = Histogram(
+    'gemini_request_seconds', 'Время запроса к Gemini по модели и исходу', ('model', 'outcome')
+)
+GEMINI_TOKENS = Counter('gemini_tokens_total', 'Токены Gemini по модели и виду', ('model', 'kind'))
+GEMINI_PARSE_FAILURES = Counter(
+    'gemini_parse_failures_total', 'Ответы Gemini без JSON (no_json) или с оборванным JSON (truncated)',
+    ('model', 'reason')
+)
+FSM_SESSIONS = Gauge('bot_fsm_sessions', 'Незаконченные сессии FSM (пользователи в процессе регистрации)')
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Outer-middleware событий: длительность и ошибки обработки по состоянию FSM."""
+
+    def __init__(self, event: str):
+        self._event = event
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event: Any,
+                       data: Dict[str, Any]) -> Any:
+        state = data.get('raw_state') or 'none'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(self._event, state).inc()
+            raise
+        finally:
+            HANDLER_SECONDS.labels(self._event, state).observe(time.perf_counter() - started)
+
+
+class TelegramApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: длительность и ошибки каждого вызова Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            TELEGRAM_API_ERRORS.labels(name, type(e).__name__).inc()
+            raise
+        finally:
+            TELEGRAM_API_SECONDS.labels(name).observe(time.perf_counter() - started)
+
@@ -0,0 +1,230 @@
+import io
+import logging
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, List, Optional, Union
+
+from PIL import Image, ImageOps
+
+from image_prep import run_in_pool
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+_WEIGHTS = (7, 3, 1)
+_MRZ_LINE = re.compile(r'[A-Z0-9<]{28,46}')
+
+# Что OCR путает в цифровых позициях MRZ
+_TO_DIGIT = str.maketrans({'O': '0', 'Q': '0', 'D': '0', 'I': '1', 'L': '1', 'Z': '2', 'S': '5', 'G': '6', 'B': '8'})
+
+# Код страны ISO 3166-1 alpha-3 → суффикс documentType, как в примерах промпта
+_COUNTRY_SUFFIX = {
+    'RUS': 'rf', 'KAZ': 'kazakhstan', 'KGZ': 'kyrgyzstan', 'UZB': 'uzbekistan', 'TJK': 'tajikistan',
+    'ARM': 'armenia', 'AZE': 'azerbaijan', 'BLR': 'belarus', 'MDA': 'moldova', 'GEO': 'georgia',
+    'UKR': 'ukraine',
+}
+
+# Поля схемы, которые заполняются из MRZ
+MRZ_FIELDS = ('documentType', 'lastName', 'firstName', 'birthDate', 'number', 'personalNumber', 'expiryDate')
+
+
+def check_digit(value: str) -> str:
+    """Контрольная цифра ICAO 9303: веса 7-3-1, A=10 … Z=35, '<'=0."""
+    total = 0
+    for i, char in enumerate(value):
+        if char.isdigit():
+            digit = int(char)
+        elif char.isalpha():
+            digit = ord(char) - ord('A') + 10
+        else:
+            digit = 0
+        total += digit * _WEIGHTS[i % 3]
+    return str(total % 10)
+
+
+def _format_date(yymmdd: str, is_expiry: bool) -> Optional[str]:
+    """YYMMDD → ДД.ММ.ГГГГ. Век: срок действия — всегда 20xx, дата рождения не в будущем."""
+    if not yymmdd.isdigit():
+        return None
+    year, month, day = int(yymmdd[:2]), int(yymmdd[2:4]), int(yymmdd[4:])
+    if is_expiry:
+        year += 2000
+    else:
+        year += 2000 if year <= date.today().year % 100 else 1900
+    try:
+        return date(year, month, day).strftime('%d.%m.%Y')
+    except ValueError:
+        return None
+
+
+def _names(value: str):
+    surname, _, given = value.partition('<<')
+    return surname.replace('<', ' ').strip(), given.replace('<', ' ').strip()
+
+
+@dataclass
+class MrzResult:
+    """Разобранная машиносчитываемая зона и результаты проверки контрольных цифр."""
+    format: str
+    document_code: str
+    issuing_country: str
+    surname: str
+    given_names: str
+    number: str
+    nationality: str
+    birth_date: Optional[str]
+    sex: str
+    expiry_date: Optional[str]
+    personal_number: Optional[str]
+    checks: Dict[str, bool] = field(default_factory=dict)
+
+    @property
+    def valid(self) -> bool:
+        return bool(self.checks) and all(self.checks.values()) and bool(self.birth_date and self.expiry_date)
+
+    def to_fields(self) -> dict:
+        """Поля схемы документа (см. MRZ_FIELDS)."""
+        kind = 'international_passport' if self.document_code.startswith('P') else 'id_card'
+        country = _COUNTRY_SUFFIX.get(self.issuing_country, self.issuing_country.lower())
+        return {
+            'documentType': f"{kind}_{country}",
+            'lastName': self.surname or None,
+            'firstName': self.given_names or None,
+            'birthDate': self.birth_date,
+            'number': self.number,
+            'personalNumber': self.personal_number or None,
+            'expiryDate': self.expiry_date,
+        }
+
+
+def _parse_td3(line1: str, line2: str) -> MrzResult:
+    number = line2[0:9]
+    birth = line2[13:19].translate(_TO_DIGIT)
+    expiry = line2[21:27].translate(_TO_DIGIT)
+    personal = line2[28:42]
+    digits = {i: line2[i].translate(_TO_DIGIT) for i in (9, 19, 27, 42, 43)}
+    composite = line2[0:10] + birth + digits[19] + expiry + digits[27] + personal + digits[42]
+    checks = {
+        'number': check_digit(number) == digits[9],
+        'birth_date': check_digit(birth) == digits[19],
+        'expiry_date': check_digit(expiry) == digits[27],
+        # Пустой личный номер может иметь '<' вместо контрольной цифры
+        'personal_number': check_digit(personal) == digits[42] or (personal.strip('<') == '' and line2[42] == '<'),
+        'composite': check_digit(composite) == digits[43],
+    }
+    surname, given = _names(line1[5:44])
+    return MrzResult(
+        format='TD3', document_code=line1[0:2].rstrip('<'), issuing_country=line1[2:5].rstrip('<'),
+        surname=surname, given_names=given, number=number.rstrip('<'), nationality=line2[10:13].rstrip('<'),
+        birth_date=_format_date(birth, False), sex=line2[20], expiry_date=_format_date(expiry, True),
+        personal_number=personal.rstrip('<'), checks=checks
+    )
+
+
+def _parse_td1(line1: str, line2: str, line3: str) -> MrzResult:
+    number, number_check = line1[5:14], line1[14]
+    optional1 = line1[15:30]
+    if number_check == '<' and optional1.strip('<'):
+        # Длинный номер: продолжение в optional data, контрольная цифра — последний символ перед '<'
+        tail = optional1.split('<', 1)[0]
+        number, number_check = number + tail[:-1], tail[-1:]
+        optional1 = optional1[len(tail):]
+    birth = line2[0:6].translate(_TO_DIGIT)
+    expiry = line2[8:14].translate(_TO_DIGIT)
+    digits = {i: line2[i].translate(_TO_DIGIT) for i in (6, 14, 29)}
+    composite = line1[5:30] + birth + digits[6] + expiry + digits[14] + line2[18:29]
+    checks = {
+        'number': check_digit(number) == number_check.translate(_TO_DIGIT),
+        'birth_date': check_digit(birth) == digits[6],
+        'expiry_date': check_digit(expiry) == digits[14],
+        'composite': check_digit(composite) == digits[29],
+    }
+    surname, given = _names(line3)
+    # Личный номер (ИИН, ПИН) — в optional data первой или второй строки
+    personal = optional1.strip('<') or line2[18:29].strip('<')
+    return MrzResult(
+        format='TD1', document_code=line1[0:2].rstrip('<'), issuing_country=line1[2:5].rstrip('<'),
+        surname=surname, given_names=given, number=number.rstrip('<'), nationality=line2[15:18].rstrip('<'),
+        birth_date=_format_date(birth, False), sex=line2[7], expiry_date=_format_date(expiry, True),
+        personal_number=personal, checks=checks
+    )
+
+
+def parse_mrz(text: str) -> Optional[MrzResult]:
+    """
+    Ищет в тексте MRZ формата TD3 (паспорт, 2×44) или TD1 (ID-карта, 3×30)
+    и разбирает ее. Возвращает None, если зона не найдена.
+    """
+    lines = []
+    for raw in text.upper().splitlines():
+        line = raw.replace(' ', '').replace('«', '<').replace('‹', '<')
+        if _MRZ_LINE.fullmatch(line):
+            lines.append(line)
+
+    for i in range(len(lines) - 1):
+        line1, line2 = lines[i], lines[i + 1]
+        # PN — зона внутреннего паспорта РФ: кириллица в своей транслитерации, не ICAO
+        if 43 <= len(line1) <= 45 and 43 <= len(line2) <= 45 and line1[0] == 'P' and line1[1] != 'N':
+            return _parse_td3(line1[:44].ljust(44, '<'), line2[:44].ljust(44, '<'))
+        if i + 2 < len(lines) and all(29 <= len(line) <= 31 for line in lines[i:i + 3]) and line1[0] in 'ACI':
+            return _parse_td1(*(line[:30].ljust(30, '<') for line in lines[i:i + 3]))
+    return None
+
+
+def _read_mrz_zone(image_bytes: bytes, zone_height: float, config: str) -> Optional[MrzResult]:
+    """Распознает нижнюю часть кадра и ищет в тексте MRZ. Модульная функция — чтобы работал и пул процессов."""
+    import pytesseract
+
+    with Image.open(io.BytesIO(image_bytes)) as source:
+        image = ImageOps.grayscale(ImageOps.exif_transpose(source))
+    width, height = image.size
+    zone = image.crop((0, int(height * (1 - zone_height)), width, height))
+    return parse_mrz(pytesseract.image_to_string(zone, config=config))
+
+
+class MrzReader:
+    """
+    Считывает MRZ с фото через Tesseract (pytesseract необязателен: без него
+    reader просто недоступен). Распознает нижнюю часть кадра, где на паспортах
+    и ID-картах находится зона, с алфавитом MRZ.
+    """
+
+    TESSERACT_CONFIG = '--psm 6 -c tessedit_char_whitelist=ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789<'
+    ZONE_HEIGHT = 0.4  # Доля высоты кадра снизу, где ищем MRZ
+
+    def __init__(self):
+        try:
+            import pytesseract
+            pytesseract.get_tesseract_version()
+        except Exception as e:
+            self._tesseract = None
+            logger.info(f"MRZ reader недоступен (pytesseract/tesseract не найден): {e}")
+        else:
+            self._tesseract = pytesseract
+
+    @property
+    def available(self) -> bool:
+        return self._tesseract is not None
+
+
+    async def read(self, images: List[Union[bytes, bytearray]]) -> Optional[MrzResult]:
+        """Первая MRZ, прошедшая все проверки контрольных цифр, или None."""
+        if not self.available:
+            return None
+        for image_bytes in images:
+            try:
+                # Декодирование и Tesseract — в общем пуле предобработки, не в event loop
+                result = await run_in_pool(
+                    _read_mrz_zone, bytes(image_bytes), self.ZONE_HEIGHT, self.TESSERACT_CONFIG
+                )
+            except Exception as e:
+                logger.warning(f"Ошибка чтения MRZ: {e}")
+                continue
+            if result is None:
+                continue
+            if result.valid:
+                return result
+            failed = [name for name, ok in result.checks.items() if not ok]
+            logger.info(f"MRZ найдена ({result.format}), но не прошла проверки: {failed}")
+        return None
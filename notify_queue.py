@@ -0,0 +1,224 @@
+import asyncio
+import itertools
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """В очереди рассылки нет места под новое задание."""
+
+
+class TokenBucket:
+    """Классический token bucket: не больше `rate` операций в секунду, всплеск до `capacity`."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class NotifyJob:
+    """Задание рассылки и прогресс его доставки."""
+    id: str
+    total: int
+    sent: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.sent + self.failed >= self.total
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.id,
+            'status': 'done' if self.done else 'in_progress',
+            'total': self.total,
+            'sent': self.sent,
+            'failed': self.failed,
+            'pending': self.total - self.sent - self.failed,
+            'errors': self.errors,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+        }
+
+
+@dataclass
+class _Delivery:
+    job: NotifyJob
+    chat_id: int
+    text: str
+    kwargs: Dict[str, Any]
+    priority: int
+    attempt: int = 0
+
+
+class NotifyQueue:
+    """
+    Внутрипроцессная очередь рассылки сообщений через бота.
+
+    Глобальный token bucket держит общий темп (~30 сообщений/с, лимит Telegram),
+    а ограничитель по чату — не чаще одного сообщения в `per_chat_interval`
+    секунд в один чат. На TelegramRetryAfter все воркеры ставятся на паузу
+    на запрошенное время, а сообщение повторяется. Сетевые ошибки и 5xx
+    повторяются с экспоненциальной паузой до `max_attempts` попыток.
+    """
+
+    MAX_ERRORS_PER_JOB = 50  # Сколько ошибок храним в статусе задания
+    RETRY_BACKOFF = 2.0  # Базовая пауза перед повтором после сетевой ошибки, сек
+    PRIORITY_HIGH = 0  # Служебные уведомления (админам) обгоняют массовые рассылки
+    PRIORITY_BULK = 10
+
+    def __init__(self, bot: Bot, *, rate: float = 30, per_chat_interval: float = 1.0,
+                 workers: int = 8, max_size: int = 10000, max_attempts: int = 3, job_ttl: int = 3600):
+        self._bot = bot
+        self._bucket = TokenBucket(rate)
+        self._per_chat_interval = per_chat_interval
+        self._workers_count = workers
+        self._max_size = max_size
+        self._max_attempts = max_attempts
+        self._job_ttl = job_ttl
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._seq = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self._jobs: Dict[str, NotifyJob] = {}
+        self._chat_next_send: Dict[int, float] = {}
+        self._chat_last_sent: Dict[int, float] = {}
+        self._paused_until = 0.0
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+        logger.info(f"Очередь уведомлений запущена: {self._workers_count} воркеров, {self._bucket.rate} msg/s")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, messages: List[dict], priority: int = PRIORITY_BULK) -> NotifyJob:
+        """
+        Ставит пачку сообщений в очередь.
+
+        :param messages: Список {'chat_id': ..., 'text': ..., 'kwargs': {...}}; kwargs
+                         передаются в bot.send_message (parse_mode, reply_markup и т.п.).
+        :param priority: Меньше — раньше; внутри одного приоритета порядок FIFO.
+        :raises QueueFullError: Очередь переполнена.
+        """
+        if self._queue is None:
+            raise RuntimeError("NotifyQueue is not started")
+        if self._queue.qsize() + len(messages) > self._max_size:
+            raise QueueFullError(f"Notify queue is full ({self._queue.qsize()} pending)")
+
+        self._prune_jobs()
+        job = NotifyJob(id=uuid.uuid4().hex, total=len(messages))
+        self._jobs[job.id] = job
+        for message in messages:
+            self._put(_Delivery(job, message['chat_id'], message['text'], message.get('kwargs') or {}, priority))
+        if not messages:
+            job.finished_at = time.time()
+        return job
+
+    def _put(self, delivery: _Delivery):
+        self._queue.put_nowait((delivery.priority, next(self._seq), delivery))
+
+    def get_job(self, job_id: str) -> Optional[NotifyJob]:
+        return self._jobs.get(job_id)
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _prune_jobs(self):
+        expired_before = time.time() - self._job_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at and job.finished_at < expired_before]:
+            del self._jobs[job_id]
+        now = time.monotonic()
+        if len(self._chat_next_send) > 10000:
+            self._chat_next_send = {chat_id: at for chat_id, at in self._chat_next_send.items() if at > now}
+            self._chat_last_sent = {chat_id: at for chat_id, at in self._chat_last_sent.items()
+                                    if at + self._per_chat_interval > now}
+
+    async def _wait_turn(self, chat_id: int):
+        now = time.monotonic()
+        start = max(now, self._paused_until, self._chat_next_send.get(chat_id, 0.0))
+        # Резервируем слот чата до ожидания, чтобы соседние воркеры встали за нами
+        self._chat_next_send[chat_id] = start + self._per_chat_interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        await self._bucket.acquire()
+        # Очередь к bucket могла «сжать» интервал с предыдущим сообщением в этот чат
+        gap = self._chat_last_sent.get(chat_id, float('-inf')) + self._per_chat_interval - time.monotonic()
+        if gap > 0:
+            await asyncio.sleep(gap)
+        self._chat_last_sent[chat_id] = time.monotonic()
+
+    def _finish(self, delivery: _Delivery, error: Optional[str] = None):
+        job = delivery.job
+        if error is None:
+            job.sent += 1
+        else:
+            job.failed += 1
+            if len(job.errors) < self.MAX_ERRORS_PER_JOB:
+                job.errors.append({'chat_id': delivery.chat_id, 'error': error})
+        if job.done:
+            job.finished_at = time.time()
+
+    async def _worker(self):
+        while True:
+            _, _, delivery = await self._queue.get()
+            try:
+                await self._wait_turn(delivery.chat_id)
+                await self._bot.send_message(chat_id=delivery.chat_id, text=delivery.text, **delivery.kwargs)
+                self._finish(delivery)
+            except TelegramRetryAfter as e:
+                delivery.attempt += 1
+                logger.warning(f"Flood control: пауза {e.retry_after} с (чат {delivery.chat_id})")
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+                if delivery.attempt < self._max_attempts:
+                    self._put(delivery)
+                else:
+                    self._finish(delivery, str(e))
+            except (TelegramNetworkError, TelegramServerError) as e:
+                delivery.attempt += 1
+                if delivery.attempt < self._max_attempts:
+                    delay = self.RETRY_BACKOFF * 2 ** (delivery.attempt - 1)
+                    logger.warning(f"Временная ошибка отправки в чат {delivery.chat_id}, повтор через {delay} с: {e}")
+                    asyncio.get_running_loop().call_later(delay, self._put, delivery)
+                else:
+                    logger.error(f"Не удалось отправить сообщение в чат {delivery.chat_id} после {delivery.attempt} попыток: {e}")
+                    self._finish(delivery, str(e))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Не удалось отправить сообщение в чат {delivery.chat_id}: {e}")
+                self._finish(delivery, str(e))
+            finally:
+                self._queue.task_done()
@@ -1,23 +1,27 @@
 import google.generativeai as genai
+import inspect
 import logging
-from PIL import Image
-import io
+import time
 from aiogram import Bot
+from image_prep import prepare_images
+from json_stream import JsonObjectStream
+from metrics import GEMINI_PARSE_FAILURES, GEMINI_SECONDS, GEMINI_TOKENS
+from mrz import MrzReader
+from ocr_validate import build_reask_prompt, field_confidence, validate_document
+from ocr_cache import OcrCache, make_cache_key
+from prompt_cache import CACHE_MISSING_ERRORS, GeminiCachedContentBackend, InlinePromptBackend, PromptCache
 
 # Настраиваем логгер
 logger = logging.getLogger(__name__)
 
-# Промпт из prompt.txt
-GEMINI_PROMPT = """
+# Промпт из prompt.txt, разбитый на общее ядро и секции по странам:
+# в запрос уходит только секция страны пользователя (см. build_document_prompt)
+_PROMPT_INTRO = """
 Супер-строгий промпт для OCR документов (РФ + СНГ)
 
-Ты — высокоточный OCR/IE-эксперт по документам, удостоверяющим личность, включая:
+Ты — высокоточный OCR/IE-эксперт по документам, удостоверяющим личность. На изображениях:
 
-внутренний паспорт РФ,
-
-загранпаспорт РФ,
-
-ID-карты и/или загранпаспорта стран СНГ: Казахстан, Кыргызстан, Узбекистан, Таджикистан, Армения, Азербайджан, Беларусь, Молдова, Грузия, Украина.
+{documents}.
 
 0) Глобальные требования
 
@@ -36,7 +40,7 @@ ID-карты и/или загранпаспорта стран СНГ: Каза
 Даты выводи строго в формате "ДД.ММ.ГГГГ".
 
 1) Обязательная JSON-схема (всегда один и тот же набор ключей)
-{
+{{
   "documentType": "тип документа",
   "lastName": "ФАМИЛИЯ",
   "firstName": "ИМЯ",
@@ -51,110 +55,13 @@ ID-карты и/или загранпаспорта стран СНГ: Каза
   "expiryDate": "ДД.ММ.ГГГГ или null",
   "departmentCode": "код подразделения или null",
   "registrationAddress": "адрес регистрации или null"
-}
-
-2) Где искать поля (макетные подсказки)
-
-Внутренний паспорт РФ (разворот с фото + страница «Паспорт выдан» + «Место жительства»):
-
-series, number — Ищи в двух местах:
-1. Стандартное расположение: правый верх страницы с фото. Формат: 4 цифры (серия) и 6 цифр (номер). Примеры: «4312 321313».
-2. Новое расположение (приоритет): вертикально вдоль правого края страницы с фото. Номер напечатан красным цветом. Считывай цифры сверху вниз. Первые 4 цифры - это серия, следующие 6 - номер. Формат на изображении: XX XX XXXXXX. Собери их в "XXXX XXXXXX". Пример: на фото "40 24 884016" должно быть распознано как series: "4024", number: "884016".
-
-departmentCode — справа от фразы «Код подразделения», формат XXX-XXX (пример «772-001»).
-
-issueDate — сразу под заголовком «Паспорт выдан» (формат «ДД.ММ.ГГГГ»).
-
-issuedBy — строка(и) под датой: «ОУФМС…», «ГУВМ МВД…».
-
-lastName/firstName/middleName — на странице с фото (сверху вниз).
-
-birthDate — под ФИО (строго «ДД.ММ.ГГГГ»).
-
-birthPlace — строка после даты рождения.
-
-registrationAddress — в развороте «Место жительства», может быть в несколько строк — соединяй в одну строку запятыми.
-
-Загранпаспорт РФ (биометрический):
-
-number — верхний правый угол, часто «NN NNNNNNN» (2+7 цифр), пример «70 1234567».
-
-ФИО — латиница/кириллица (оставляй как на документе, можно через « / »).
-
-birthDate, birthPlace — под ФИО.
-
-issueDate, expiryDate — нижний блок.
+}}
 
-issuedBy — «ГУВМ МВД РОССИИ» / «FMS RUSSIA».
-
-series — null (для биометрических).
-
-departmentCode — null.
-
-registrationAddress — null.
-
-ID/паспорт СНГ (общие подсказки):
-
-number — крупно сверху/справа на лицевой стороне (буквенно-цифровой).
-
-personalNumber — уникальный идентификатор (ИИН/ПИН/IDNP и т.п.) — под фото или на обороте.
-
-issueDate, expiryDate — в нижней части лицевой стороны.
-
-issuedBy — МВД/Полиция/Госорган, обычно в центре или снизу.
-
-registrationAddress — чаще отсутствует → null.
-
-Если есть MRZ (машиносчитываемая зона): используй её для проверки/нормализации number, birthDate, expiryDate (но формат вывода дат — всё равно «ДД.ММ.ГГГГ»).
-
-3) Страны и типичные паттерны номеров (ориентиры, не жёсткие маски)
-
-Казахстан (ID)
-number: N\d{8} или похожий; personalNumber = ИИН \d{12} (пример «901010301234»).
-issuedBy: «МИНИСТЕРСТВО ВНУТРЕННИХ ДЕЛ» / «МИНИСТРЛІК…».
-
-Кыргызстан (ID, биометрический)
-number: ID\d{7}; personalNumber: чаще 14 цифр.
-issuedBy: «ГНС КЫРГЫЗСКОЙ РЕСПУБЛИКИ» / «МИНИСТЕРСТВО…».
-
-Узбекистан (загран)
-number: [A-Z]{2}\d{7} (пример «AB1234567»).
-issuedBy: «OʻZBEKISTON RESPUBLIKASI IIV».
-Часто есть MRZ.
-
-Таджикистан (загран)
-number: [A-Z]{2}\d{7} (например «AC1234567»).
-personalNumber: может присутствовать; сверяй MRZ.
-issuedBy: МВД Республики Таджикистан.
-
-Армения (ID/паспорт)
-number: AR\d{7} или буквенно-цифровой; personalNumber: 10 цифр.
-issuedBy: «POLICE OF ARMENIA».
-
-Азербайджан (ID/паспорт)
-number: часто AZE\d{7} (варианты возможны); personalNumber: AZ\d{11,13}.
-issuedBy: МВД/ASAN.
-
-Беларусь (паспорт)
-series+number: например «MP 1234567» (серия из 2 букв/символов + 7 цифр).
-issuedBy: МВД Республики Беларусь.
-personalNumber: может присутствовать (см. MRZ/поле PPN).
-
-Молдова (ID)
-number: ID\d{6}; personalNumber (IDNP) = 13 цифр.
-issuedBy: «AGENȚIA SERVICII PUBLICE» и т.п.
-
-Грузия (ID)
-number: GE\d{7} (различается); personalNumber: 11 цифр.
-issuedBy: МВД Грузии.
-
-Украина (ID/загран)
-number: буквенно-цифровой (загран часто [A-Z]{2}\d{6}/\d{8}); personalNumber (РНОКПП) может отсутствовать на документе.
-Сверяй MRZ.
-
-Если формат номера отличается — всё равно снимай ровно то, что напечатано, без нормализации под маску.
+2) Где искать поля, паттерны номеров и примеры значений
+"""
 
-4) Валидация, нормализация и анти-ошибки OCR
+_PROMPT_RULES = """
+3) Валидация, нормализация и анти-ошибки OCR
 
 Замены похожих символов (не применяй слепо; только при явной уверенности и контексте):
 
@@ -186,7 +93,7 @@ MRZ-проверки (если есть):
 
 Никаких догадок: если символ(ы) неразборчивы — ставь null.
 
-5) Правила по полям (когда null обязателен)
+4) Правила по полям (когда null обязателен)
 
 departmentCode: только внутренний паспорт РФ. Для всех остальных — null.
 
@@ -194,9 +101,31 @@ registrationAddress: обычно есть только во внутренне
 
 series: во внутреннем паспорте РФ — 4 цифры; в загране РФ — null. В других странах — по факту; если нет явной серии — null.
 
-6) Мини-примеры (правильный вид значений)
+Итог: выдай строго один JSON-объект по схеме из п.1, используя подсказки по документу и проверки из пп.2–4. Если какое-то поле не читается или отсутствует — ставь null без догадок.
+"""
+
+_SECTION_RU_INTERNAL = """
+Внутренний паспорт РФ (разворот с фото + страница «Паспорт выдан» + «Место жительства»):
 
-Внутренний паспорт РФ (пример значений):
+series, number — Ищи в двух местах:
+1. Стандартное расположение: правый верх страницы с фото. Формат: 4 цифры (серия) и 6 цифр (номер). Примеры: «4312 321313».
+2. Новое расположение (приоритет): вертикально вдоль правого края страницы с фото. Номер напечатан красным цветом. Считывай цифры сверху вниз. Первые 4 цифры - это серия, следующие 6 - номер. Формат на изображении: XX XX XXXXXX. Собери их в "XXXX XXXXXX". Пример: на фото "40 24 884016" должно быть распознано как series: "4024", number: "884016".
+
+departmentCode — справа от фразы «Код подразделения», формат XXX-XXX (пример «772-001»).
+
+issueDate — сразу под заголовком «Паспорт выдан» (формат «ДД.ММ.ГГГГ»).
+
+issuedBy — строка(и) под датой: «ОУФМС…», «ГУВМ МВД…».
+
+lastName/firstName/middleName — на странице с фото (сверху вниз).
+
+birthDate — под ФИО (строго «ДД.ММ.ГГГГ»).
+
+birthPlace — строка после даты рождения.
+
+registrationAddress — в развороте «Место жительства», может быть в несколько строк — соединяй в одну строку запятыми.
+
+Пример значений:
 
 {
   "documentType": "internal_passport_rf",
@@ -214,9 +143,28 @@ series: во внутреннем паспорте РФ — 4 цифры; в з
   "departmentCode": "772-001",
   "registrationAddress": "Г. МОСКВА, УЛ. ПУШКИНА, Д. 10, КВ. 5"
 }
+"""
+
+_SECTION_RU_INTERNATIONAL = """
+Загранпаспорт РФ (биометрический):
+
+number — верхний правый угол, часто «NN NNNNNNN» (2+7 цифр), пример «70 1234567».
+
+ФИО — латиница/кириллица (оставляй как на документе, можно через « / »).
+
+birthDate, birthPlace — под ФИО.
 
+issueDate, expiryDate — нижний блок.
 
-Загранпаспорт РФ (пример значений):
+issuedBy — «ГУВМ МВД РОССИИ» / «FMS RUSSIA».
+
+series — null (для биометрических).
+
+departmentCode — null.
+
+registrationAddress — null.
+
+Пример значений:
 
 {
   "documentType": "international_passport_rf",
@@ -234,9 +182,32 @@ series: во внутреннем паспорте РФ — 4 цифры; в з
   "departmentCode": null,
   "registrationAddress": null
 }
+"""
+
+_SECTION_CIS_COMMON = """
+ID/паспорт СНГ (общие подсказки):
 
+number — крупно сверху/справа на лицевой стороне (буквенно-цифровой).
+
+personalNumber — уникальный идентификатор (ИИН/ПИН/IDNP и т.п.) — под фото или на обороте.
 
-ID Казахстан (пример значений):
+issueDate, expiryDate — в нижней части лицевой стороны.
+
+issuedBy — МВД/Полиция/Госорган, обычно в центре или снизу.
+
+registrationAddress — чаще отсутствует → null.
+
+Если есть MRZ (машиносчитываемая зона): используй её для проверки/нормализации number, birthDate, expiryDate (но формат вывода дат — всё равно «ДД.ММ.ГГГГ»).
+
+Паттерны номеров ниже — ориентиры, не жёсткие маски. Если формат номера отличается — всё равно снимай ровно то, что напечатано, без нормализации под маску.
+"""
+
+_SECTION_KZ = """
+Казахстан (ID)
+number: N\\d{8} или похожий; personalNumber = ИИН \\d{12} (пример «901010301234»).
+issuedBy: «МИНИСТЕРСТВО ВНУТРЕННИХ ДЕЛ» / «МИНИСТРЛІК…».
+
+Пример значений:
 
 {
   "documentType": "id_card_kazakhstan",
@@ -254,9 +225,14 @@ ID Казахстан (пример значений):
   "departmentCode": null,
   "registrationAddress": null
 }
+"""
 
+_SECTION_KG = """
+Кыргызстан (ID, биометрический)
+number: ID\\d{7}; personalNumber: чаще 14 цифр.
+issuedBy: «ГНС КЫРГЫЗСКОЙ РЕСПУБЛИКИ» / «МИНИСТЕРСТВО…».
 
-ID Кыргызстан (пример значений):
+Пример значений:
 
 {
   "documentType": "id_card_kyrgyzstan",
@@ -274,9 +250,15 @@ ID Кыргызстан (пример значений):
   "departmentCode": null,
   "registrationAddress": null
 }
+"""
 
+_SECTION_UZ = """
+Узбекистан (загран)
+number: [A-Z]{2}\\d{7} (пример «AB1234567»).
+issuedBy: «OʻZBEKISTON RESPUBLIKASI IIV».
+Часто есть MRZ.
 
-Загран Узбекистан (пример значений):
+Пример значений:
 
 {
   "documentType": "international_passport_uzbekistan",
@@ -294,26 +276,371 @@ ID Кыргызстан (пример значений):
   "departmentCode": null,
   "registrationAddress": null
 }
+"""
 
+_SECTION_TJ = """
+Таджикистан (загран)
+number: [A-Z]{2}\\d{7} (например «AC1234567»).
+personalNumber: может присутствовать; сверяй MRZ.
+issuedBy: МВД Республики Таджикистан.
+"""
+
+_SECTION_OTHER_CIS = """
+Армения (ID/паспорт)
+number: AR\\d{7} или буквенно-цифровой; personalNumber: 10 цифр.
+issuedBy: «POLICE OF ARMENIA».
+
+Азербайджан (ID/паспорт)
+number: часто AZE\\d{7} (варианты возможны); personalNumber: AZ\\d{11,13}.
+issuedBy: МВД/ASAN.
+
+Беларусь (паспорт)
+series+number: например «MP 1234567» (серия из 2 букв/символов + 7 цифр).
+issuedBy: МВД Республики Беларусь.
+personalNumber: может присутствовать (см. MRZ/поле PPN).
 
-Итог: выдай строго один JSON-объект по схеме из п.1, используя правила локализации полей, страновые подсказки и проверки из пп.2–5. Если какое-то поле не читается или отсутствует — ставь null без догадок.
+Молдова (ID)
+number: ID\\d{6}; personalNumber (IDNP) = 13 цифр.
+issuedBy: «AGENȚIA SERVICII PUBLICE» и т.п.
+
+Грузия (ID)
+number: GE\\d{7} (различается); personalNumber: 11 цифр.
+issuedBy: МВД Грузии.
+
+Украина (ID/загран)
+number: буквенно-цифровой (загран часто [A-Z]{2}\\d{6}/\\d{8}); personalNumber (РНОКПП) может отсутствовать на документе.
+Сверяй MRZ.
+
+Для документов других стран снимай поля по общим подсказкам выше.
 """
 
-def configure_gemini(api_key: str):
-    """Конфигурирует Gemini API."""
+# Что перечислить во вступлении и какие секции подставить для каждой страны.
+# Коды совпадают с citizenship из process_country_callback; 'ru_internal' и
+# 'ru_international' — если тип паспорта РФ известен заранее
+COUNTRY_PROMPT_SECTIONS = {
+    'ru': ("внутренний паспорт РФ или загранпаспорт РФ",
+           (_SECTION_RU_INTERNAL, _SECTION_RU_INTERNATIONAL)),
+    'ru_internal': ("внутренний паспорт РФ", (_SECTION_RU_INTERNAL,)),
+    'ru_international': ("загранпаспорт РФ", (_SECTION_RU_INTERNATIONAL,)),
+    'kz': ("ID-карта или паспорт Казахстана", (_SECTION_CIS_COMMON, _SECTION_KZ)),
+    'kg': ("ID-карта или паспорт Кыргызстана", (_SECTION_CIS_COMMON, _SECTION_KG)),
+    'uz': ("загранпаспорт или ID-карта Узбекистана", (_SECTION_CIS_COMMON, _SECTION_UZ)),
+    'tj': ("загранпаспорт или ID-карта Таджикистана", (_SECTION_CIS_COMMON, _SECTION_TJ)),
+    'other': ("ID-карта и/или загранпаспорт иностранного государства (чаще СНГ: Армения, Азербайджан, "
+              "Беларусь, Молдова, Грузия, Украина)", (_SECTION_CIS_COMMON, _SECTION_OTHER_CIS)),
+}
+
+_ALL_DOCUMENTS = ("внутренний паспорт РФ, загранпаспорт РФ, ID-карты и/или загранпаспорта стран СНГ: "
+                  "Казахстан, Кыргызстан, Узбекистан, Таджикистан, Армения, Азербайджан, Беларусь, "
+                  "Молдова, Грузия, Украина")
+_ALL_SECTIONS = (_SECTION_RU_INTERNAL, _SECTION_RU_INTERNATIONAL, _SECTION_CIS_COMMON,
+                 _SECTION_KZ, _SECTION_KG, _SECTION_UZ, _SECTION_TJ, _SECTION_OTHER_CIS)
+
+
+def build_document_prompt(country: str = None) -> str:
+    """
+    Собирает промпт документа: общее ядро + секция страны.
+
+    :param country: Код страны ('ru', 'kz', 'kg', 'uz', 'tj', ...). Неизвестные коды
+                    (в т.ч. название страны, введенное вручную) получают общую секцию
+                    'other'; None — полный промпт со всеми странами.
+    """
+    if country is None:
+        documents, sections = _ALL_DOCUMENTS, _ALL_SECTIONS
+    else:
+        documents, sections = COUNTRY_PROMPT_SECTIONS.get(country, COUNTRY_PROMPT_SECTIONS['other'])
+    return _PROMPT_INTRO.format(documents=documents) + ''.join(sections) + _PROMPT_RULES
+
+
+# Промпты собираются один раз: одинаковый текст — одинаковые ключи кэшей
+_DOCUMENT_PROMPTS = {country: build_document_prompt(country) for country in COUNTRY_PROMPT_SECTIONS}
+
+# Полный промпт для всех стран, когда страна неизвестна
+GEMINI_PROMPT = build_document_prompt()
+
+
+def get_document_prompt(country: str = None) -> str:
+    """Готовый промпт для страны (см. build_document_prompt)."""
+    if country is None:
+        return GEMINI_PROMPT
+    return _DOCUMENT_PROMPTS.get(country, _DOCUMENT_PROMPTS['other'])
+
+
+# Ключи JSON-схемы документа (п.1 промпта)
+DOCUMENT_FIELDS = (
+    'documentType', 'lastName', 'firstName', 'middleName', 'birthDate', 'birthPlace', 'series', 'number',
+    'personalNumber', 'issuedBy', 'issueDate', 'expiryDate', 'departmentCode', 'registrationAddress',
+)
+
+# Кэш результатов распознавания, см. configure_ocr_cache()
+_cache = OcrCache()
+
+
+def configure_ocr_cache(max_entries: int = 512, ttl: int = 7 * 24 * 3600, db_path: str = None):
+    """
+    Настраивает кэш результатов OCR.
+
+    :param max_entries: Сколько результатов держать в памяти (LRU).
+    :param ttl: Время жизни записи, сек.
+    :param db_path: Путь к SQLite для второго уровня на диске (None — только память).
+    """
+    global _cache
+    _cache = OcrCache(max_entries=max_entries, ttl=ttl, db_path=db_path)
+    logger.info(f"Кэш OCR: {max_entries} записей в памяти, TTL {ttl} с, диск: {db_path or 'нет'}")
+
+
+def get_cache_stats() -> dict:
+    """Счетчики попаданий/промахов кэша OCR."""
+    return _cache.stats()
+
+
+def _cache_key(prompt: str, model_name: str, *parts) -> str:
+    # Версия промпта и модель входят в ключ: после их смены старые ответы не используются
+    return make_cache_key(make_cache_key(prompt)[:16], model_name, *parts)
+
+
+DEFAULT_MODEL_NAME = 'gemini-2.5-flash-lite'
+
+# Варианты промптов, для каждого — своя заранее созданная модель
+MODEL_VARIANTS = ('document', 'simple_ru', 'simple_foreign')
+
+DEFAULT_GENERATION_CONFIG = {
+    'temperature': 0.0,
+    'response_mime_type': 'application/json',
+}
+
+
+class ModelRegistry:
+    """
+    Заранее созданные GenerativeModel для каждого варианта промпта.
+
+    Модели создаются один раз в configure_gemini, а не на каждый вызов;
+    имя модели и настройки генерации задаются конфигурацией, и для дешевых
+    вариантов (например, простых анкет) можно выбрать более быструю модель.
+    """
+
+    def __init__(self, default_model: str = DEFAULT_MODEL_NAME, models: dict = None,
+                 generation_config: dict = None):
+        self._model_names = {variant: (models or {}).get(variant, default_model) for variant in MODEL_VARIANTS}
+        self._generation_config = generation_config or DEFAULT_GENERATION_CONFIG
+        self._models = {
+            variant: genai.GenerativeModel(name, generation_config=self._generation_config)
+            for variant, name in self._model_names.items()
+        }
+
+    def model_name(self, variant: str) -> str:
+        return self._model_names[variant]
+
+    @property
+    def model_names(self) -> dict:
+        """{вариант промпта: имя модели} (копия)."""
+        return dict(self._model_names)
+
+    @property
+    def generation_config(self) -> dict:
+        return self._generation_config
+
+    def get(self, variant: str) -> genai.GenerativeModel:
+        return self._models[variant]
+
+    async def warm_up(self):
+        """Дешевый запрос к каждой модели при старте: соединение и авторизация до первого пользователя."""
+        warmed = {}
+        for variant, model in self._models.items():
+            name = self._model_names[variant]
+            if name in warmed:
+                continue
+            try:
+                await model.count_tokens_async("ping")
+                warmed[name] = True
+            except Exception as e:
+                warmed[name] = False
+                logger.warning(f"Прогрев модели {name} не удался: {e}")
+        logger.info(f"Модели Gemini прогреты: {warmed}")
+
+
+_registry: ModelRegistry = None
+
+# Как доставлять большой промпт документа, см. configure_prompt_cache()
+_prompts = PromptCache(InlinePromptBackend())
+
+
+def _get_registry() -> ModelRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ModelRegistry()
+    return _registry
+
+
+def parse_model_overrides(value: str) -> dict:
+    """Разбирает строку вида 'simple_ru=gemini-2.0-flash-lite,document=gemini-2.5-flash'."""
+    overrides = {}
+    for item in filter(None, (part.strip() for part in (value or '').split(','))):
+        variant, _, name = item.partition('=')
+        if variant.strip() not in MODEL_VARIANTS or not name.strip():
+            raise ValueError(f"Invalid model override: {item}")
+        overrides[variant.strip()] = name.strip()
+    return overrides
+
+
+def configure_gemini(api_key: str, default_model: str = DEFAULT_MODEL_NAME, models: dict = None,
+                     generation_config: dict = None):
+    """
+    Конфигурирует Gemini API и создает модели для всех вариантов промптов.
+
+    :param default_model: Модель по умолчанию.
+    :param models: Переопределения {вариант промпта: имя модели}, см. MODEL_VARIANTS.
+    :param generation_config: Настройки генерации (по умолчанию детерминированный JSON).
+    """
+    global _registry
     try:
         genai.configure(api_key=api_key)
-        logger.info("Gemini API успешно сконфигурирован.")
+        _registry = ModelRegistry(default_model, models, generation_config)
+        logger.info(f"Gemini API успешно сконфигурирован. Модели: {_registry.model_names}")
     except Exception as e:
         logger.error(f"Ошибка конфигурации Gemini API: {e}")
         raise
 
-async def recognize_document_from_images(images: list, country: str = 'ru') -> dict:
+
+def configure_prompt_cache(backend: str = 'gemini', ttl: int = 3600):
     """
-    Отправляет готовые PIL изображения в Gemini и возвращает JSON.
+    Выбирает способ отправки статического промпта документа.
+
+    :param backend: 'gemini' — промпт кэшируется на стороне Gemini (CachedContent)
+                    и в запросах не повторяется; 'inline' — шлется в каждом запросе.
+    :param ttl: Время жизни кэша промпта в Gemini, сек.
+    """
+    global _prompts
+    if backend == 'gemini':
+        _prompts = PromptCache(GeminiCachedContentBackend(ttl=ttl))
+    elif backend == 'inline':
+        _prompts = PromptCache(InlinePromptBackend())
+    else:
+        raise ValueError(f"Unknown prompt cache backend: {backend}")
+    logger.info(f"Промпт документа отправляется через бэкенд '{backend}'")
+
+
+def get_prompt_cache_stats() -> dict:
+    """Сколько запросов ушло через кэш промпта и сколько токенов он сэкономил."""
+    return _prompts.stats()
+
+
+# Локальное чтение MRZ до Gemini, см. configure_mrz()
+_mrz_reader: MrzReader = None
+_mrz_skip_llm = False
+
+# На фото внутреннего паспорта РФ нет ICAO MRZ
+_NO_MRZ_COUNTRIES = ('ru', 'ru_internal')
+
+
+def configure_mrz(enabled: bool = True, skip_llm: bool = False):
+    """
+    Включает быстрый путь через MRZ для загранпаспортов и ID-карт.
+
+    Если MRZ прочитана и все контрольные цифры сошлись, номер, даты, ФИО и
+    личный номер берутся из нее, а у Gemini спрашиваются только остальные поля.
+
+    :param enabled: Читать MRZ (нужны pytesseract и tesseract, иначе путь выключен).
+    :param skip_llm: Не вызывать Gemini вовсе: поля вне MRZ остаются null.
+    """
+    global _mrz_reader, _mrz_skip_llm
+    _mrz_reader = MrzReader() if enabled else None
+    if _mrz_reader is not None and not _mrz_reader.available:
+        _mrz_reader = None
+    _mrz_skip_llm = skip_llm
+    logger.info(f"Чтение MRZ: {'включено' if _mrz_reader else 'выключено'}, без Gemini: {skip_llm}")
+
+
+# Сколько раз перепрашивать поля, не прошедшие проверку, см. configure_validation()
+_reask_attempts = 1
+
+
+def configure_validation(reask_attempts: int = 1):
+    """
+    :param reask_attempts: Сколько раз перепрашивать у модели поля, не прошедшие
+                           проверку (0 — только проставлять флаги).
+    """
+    global _reask_attempts
+    _reask_attempts = reask_attempts
+
+
+async def warm_up_gemini():
+    """Прогревает модели Gemini; ошибки только логируются."""
+    await _get_registry().warm_up()
 
-    :param images: Список PIL Image объектов для распознавания.
+async def _emit_fields(on_field, fields):
+    if on_field is None:
+        return
+    for key, value in fields:
+        result = on_field(key, value)
+        if inspect.isawaitable(result):
+            await result
+
+
+# Поля usage_metadata → метка kind в gemini_tokens_total
+_USAGE_TOKEN_KINDS = (
+    ('prompt', 'prompt_token_count'),
+    ('cached', 'cached_content_token_count'),
+    ('output', 'candidates_token_count'),
+)
+
+
+async def _generate_json(model: genai.GenerativeModel, parts: list, on_field=None):
+    """
+    Запрос к модели и разбор JSON из ответа. Возвращает (данные, usage_metadata,
+    ответ_полный); при оборванном или битом хвосте данные — уже разобранные поля.
+
+    С `on_field` ответ читается потоком (stream=True), и каждое поле передается
+    в on_field(ключ, значение) сразу, как только его значение пришло целиком.
+    """
+    stream = JsonObjectStream()
+    model_name = getattr(model, 'model_name', 'unknown').rsplit('/', 1)[-1]
+    started, outcome = time.perf_counter(), 'error'
+    try:
+        if on_field is None:
+            response = await model.generate_content_async(parts)
+            stream.feed(response.text)
+        else:
+            response = await model.generate_content_async(parts, stream=True)
+            async for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Кусок без текста (например, последний, только с finish_reason)
+                    continue
+                await _emit_fields(on_field, stream.feed(text))
+        await _emit_fields(on_field, stream.finish())
+        try:
+            data = stream.result()
+        except ValueError:
+            outcome = 'no_json'
+            GEMINI_PARSE_FAILURES.labels(model_name, 'no_json').inc()
+            raise
+        if stream.complete:
+            outcome = 'ok'
+        else:
+            outcome = 'truncated'
+            GEMINI_PARSE_FAILURES.labels(model_name, 'truncated').inc()
+    finally:
+        GEMINI_SECONDS.labels(model_name, outcome).observe(time.perf_counter() - started)
+
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is not None:
+        for kind, attribute in _USAGE_TOKEN_KINDS:
+            tokens = getattr(usage, attribute, 0) or 0
+            if tokens:
+                GEMINI_TOKENS.labels(model_name, kind).inc(tokens)
+    return data, usage, stream.complete
+
+
+async def recognize_document_from_images(images: list, country: str = 'ru', on_field=None) -> dict:
+    """
+    Отправляет готовые изображения в Gemini и возвращает JSON.
+
+    :param images: Список PIL Image объектов или байтов файлов для распознавания.
     :param country: Страна ('ru' для РФ, иначе для иностранцев).
+    :param on_field: Необязательный колбэк on_field(ключ, значение) (может быть async):
+                     ответ читается потоком, поля приходят по мере распознавания.
     :return: Словарь с распознанными данными или пустой словарь в случае ошибки.
     """
     if not images:
@@ -321,9 +648,11 @@ async def recognize_document_from_images(images: list, country: str = 'ru') -> d
         return {}
 
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash-lite')
-
         # Выбираем промпт в зависимости от страны
+        variant = 'simple_ru' if country == 'ru' else 'simple_foreign'
+        model = _get_registry().get(variant)
+        model_name = _get_registry().model_name(variant)
+
         if country == 'ru':
             prompt = """
             Проанализируй эти изображения: основной разворот паспорта РФ, страница с пропиской и селфи с паспортом.
@@ -341,21 +670,27 @@ async def recognize_document_from_images(images: list, country: str = 'ru') -> d
             Ответ должен быть только чистым JSON.
             """
 
-        # Формируем запрос: промпт + изображения
-        prompt_parts = [prompt] + images
+        # Кодируем PIL изображения в компактные JPEG в пуле, а не внутри
+        # запроса SDK на event loop
+        prepared = await prepare_images(images)
+        image_parts = [image.as_part() for image in prepared]
 
-        logger.info(f"Отправка {len(images)} изображений в Gemini для распознавания...")
-        response = await model.generate_content_async(prompt_parts)
+        cache_key = _cache_key(prompt, model_name, *(image.data for image in prepared))
+        cached = await _cache.get(cache_key)
+        if cached is not None:
+            logger.info("Результат распознавания взят из кэша.")
+            await _emit_fields(on_field, cached.items())
+            return cached
 
-        # Извлекаем и чистим JSON из ответа
-        response_text = response.text.strip()
-        # Убираем "обертку" ```json ... ```, если она есть
-        if response_text.startswith("```json"):
-            response_text = response_text[7:-3].strip()
+        # Формируем запрос: промпт + изображения
+        prompt_parts = [prompt] + image_parts
 
-        import json
-        recognized_data = json.loads(response_text)
+        logger.info(f"Отправка {len(image_parts)} изображений в Gemini для распознавания...")
+        recognized_data, _, complete = await _generate_json(model, prompt_parts, on_field)
         logger.info("Данные от Gemini успешно распознаны и распарсены.")
+        # Частичный ответ не кэшируем: следующая попытка может вернуть все поля
+        if complete:
+            await _cache.set(cache_key, recognized_data)
 
         return recognized_data
 
@@ -363,12 +698,99 @@ async def recognize_document_from_images(images: list, country: str = 'ru') -> d
         logger.error(f"Произошла ошибка во время распознавания в Gemini: {e}", exc_info=True)
         return {"error": str(e)} # Возвращаем ошибку, чтобы ее можно было обработать
 
-async def recognize_document(bot: Bot, file_ids: list) -> dict:
+async def _recognize_with_prompt(variant: str, prompt: str, image_parts: list, mrz_fields: dict,
+                                 on_field, country: str):
+    """Основной запрос документа. Возвращает (данные, ответ_полный)."""
+    request_parts = list(image_parts)
+    if mrz_fields:
+        remaining = [key for key in DOCUMENT_FIELDS if key not in mrz_fields]
+        request_parts.append(
+            f"Поля {', '.join(mrz_fields)} уже считаны из MRZ и проверены по контрольным цифрам — "
+            f"не распознавай их. Верни JSON только с ключами: {', '.join(remaining)}."
+        )
+    if mrz_fields and on_field is not None:
+        def model_on_field(key, value):
+            return None if key in mrz_fields else on_field(key, value)
+    else:
+        model_on_field = on_field
+
+    # Статический промпт уходит либо ссылкой на кэш в Gemini, либо inline с моделью из реестра
+    model = _get_registry().get(variant)
+    generation_config = _get_registry().generation_config
+    prepared_prompt = await _prompts.resolve(model, prompt, generation_config)
+
+    logger.info(f"Отправка {len(image_parts)} изображений в Gemini для распознавания "
+                f"(страна: {country or 'все'}, промпт {len(prompt)} символов)...")
+    try:
+        recognized_data, usage, complete = await _generate_json(
+            prepared_prompt.model, prepared_prompt.prefix + request_parts, model_on_field
+        )
+    except ValueError as e:
+        # Ответ без JSON: не сдаемся, недостающие поля дозапросит проверка
+        logger.warning(f"Gemini вернул ответ без JSON: {e}")
+        return {}, False
+    except CACHE_MISSING_ERRORS as e:
+        if not prepared_prompt.cached:
+            raise
+        # Кэш промпта истек или удален на стороне Gemini — повторяем inline
+        logger.warning(f"Кэш промпта недоступен, повтор inline: {e}")
+        await _prompts.invalidate(model, prompt, prepared_prompt)
+        prepared_prompt = await _prompts.resolve_inline(model, prompt, generation_config)
+        recognized_data, usage, complete = await _generate_json(
+            prepared_prompt.model, prepared_prompt.prefix + request_parts, model_on_field
+        )
+    _prompts.record_usage(prepared_prompt, usage)
+    return recognized_data, complete
+
+
+async def _validate_and_reask(variant: str, image_parts: list, data: dict, mrz_fields: dict,
+                              on_field, country: str) -> dict:
+    """
+    Проверяет документ (ocr_validate) и перезапрашивает у модели только поля,
+    не прошедшие проверку. Флаги по полям кладет в data['fieldConfidence'].
+    """
+    failures = validate_document(data, country)
+    reasked = set()
+    for _ in range(_reask_attempts):
+        targets = {key: reason for key, reason in failures.items() if key not in mrz_fields}
+        if not targets:
+            break
+        logger.info(f"Перепроверка полей: {targets}")
+        try:
+            fixes, _, _ = await _generate_json(
+                _get_registry().get(variant), image_parts + [build_reask_prompt(targets, data)]
+            )
+        except ValueError as e:
+            logger.warning(f"Перепроверка не дала JSON: {e}")
+            break
+        for key in targets:
+            if key not in fixes:
+                continue
+            # Берем новое значение, если оно прошло проверку или старого не было вовсе
+            if key not in validate_document({**data, key: fixes[key]}, country) or data.get(key) in (None, ''):
+                data[key] = fixes[key]
+                reasked.add(key)
+                await _emit_fields(on_field, [(key, fixes[key])])
+        failures = validate_document(data, country)
+
+    data['fieldConfidence'] = field_confidence(data, failures, DOCUMENT_FIELDS, mrz_fields, reasked)
+    if failures:
+        logger.warning(f"Поля не прошли проверку: {failures}")
+    return data
+
+
+async def recognize_document(bot: Bot, file_ids: list, variant: str = 'document', country: str = None,
+                             on_field=None) -> dict:
     """
     Скачивает файлы по file_id, отправляет их в Gemini и возвращает JSON.
 
     :param bot: Экземпляр aiogram Bot.
     :param file_ids: Список file_id фотографий для распознавания.
+    :param variant: Вариант из MODEL_VARIANTS, определяет модель (см. configure_gemini).
+    :param country: Гражданство пользователя (citizenship); в промпт попадает только
+                    секция этой страны. None — полный промпт для всех стран.
+    :param on_field: Необязательный колбэк on_field(ключ, значение) (может быть async):
+                     ответ читается потоком, поля приходят по мере распознавания.
     :return: Словарь с распознанными данными или пустой словарь в случае ошибки.
     """
     if not file_ids:
@@ -376,40 +798,73 @@ async def recognize_document(bot: Bot, file_ids: list) -> dict:
         return {}
 
     try:
-        model = genai.GenerativeModel('gemini-2.5-flash-lite')
-
-        image_parts = []
-        for file_id in file_ids:
-            if not file_id: continue
-            # Скачиваем файл с серверов Telegram в память
-            file_info = await bot.get_file(file_id)
-            downloaded_file = await bot.download_file(file_info.file_path)
+        model_name = _get_registry().model_name(variant)
+        prompt = get_document_prompt(country)
 
-            # Конвертируем в PIL Image, чтобы убедиться, что это изображение
-            image = Image.open(io.BytesIO(downloaded_file.read()))
-
-            # Gemini SDK сам обработает PIL Image
-            image_parts.append(image)
-
-        if not image_parts:
+        file_infos = [await bot.get_file(file_id) for file_id in file_ids if file_id]
+        if not file_infos:
             logger.warning("Не удалось подготовить ни одного изображения для Gemini.")
             return {}
 
-        # Формируем запрос: промпт + изображения
-        prompt_parts = [GEMINI_PROMPT] + image_parts
-
-        logger.info(f"Отправка {len(image_parts)} изображений в Gemini для распознавания...")
-        response = await model.generate_content_async(prompt_parts)
+        # Повторная отправка тех же фото (перезапуск регистрации, повторное
+        # распознавание админом) не должна стоить нового вызова Gemini
+        id_key = _cache_key(prompt, model_name, *(file_info.file_unique_id for file_info in file_infos))
+        cached = await _cache.get(id_key)
+        if cached is not None:
+            logger.info("Результат распознавания взят из кэша (file_unique_id).")
+            await _emit_fields(on_field, cached.items())
+            return cached
+
+        raw_images = []
+        for file_info in file_infos:
+            # Скачиваем файл с серверов Telegram в память
+            downloaded_file = await bot.download_file(file_info.file_path)
+            raw_images.append(downloaded_file.read())
+
+        # Поворот, обрезка, уменьшение и перекодирование — в пуле потоков,
+        # в Gemini уходят компактные JPEG вместо полноразмерных фото
+        prepared = await prepare_images(raw_images)
+        image_parts = [image.as_part() for image in prepared]
+
+        # Те же фото, загруженные заново, получают новый file_unique_id — ищем по содержимому
+        content_key = _cache_key(prompt, model_name, *(image.data for image in prepared))
+        cached = await _cache.get(content_key)
+        if cached is not None:
+            logger.info("Результат распознавания взят из кэша (содержимое фото).")
+            await _cache.set(id_key, cached)
+            await _emit_fields(on_field, cached.items())
+            return cached
+
+        # Проверенная MRZ надежнее модели: ее поля в Gemini не запрашиваем
+        mrz_fields = {}
+        if _mrz_reader is not None and country not in _NO_MRZ_COUNTRIES:
+            mrz = await _mrz_reader.read(raw_images)
+            if mrz is not None:
+                mrz_fields = {key: value for key, value in mrz.to_fields().items() if value}
+                logger.info(f"MRZ ({mrz.format}) прочитана, поля из нее: {list(mrz_fields)}")
+                await _emit_fields(on_field, mrz_fields.items())
+
+        if mrz_fields and _mrz_skip_llm:
+            recognized_data = {key: mrz_fields.get(key) for key in DOCUMENT_FIELDS}
+            await _emit_fields(on_field, [(key, None) for key in DOCUMENT_FIELDS if key not in mrz_fields])
+            complete = True
+        else:
+            recognized_data, complete = await _recognize_with_prompt(
+                variant, prompt, image_parts, mrz_fields, on_field, country
+            )
+            recognized_data.update(mrz_fields)
 
-        # Извлекаем и чистим JSON из ответа
-        response_text = response.text.strip()
-        # Убираем "обертку" ```json ... ```, если она есть
-        if response_text.startswith("```json"):
-            response_text = response_text[7:-3].strip()
+        recognized_data = await _validate_and_reask(
+            variant, image_parts, recognized_data, mrz_fields, on_field, country
+        )
+        if not any(recognized_data.get(key) for key in DOCUMENT_FIELDS):
+            raise ValueError("Model returned no document fields")
 
-        import json
-        recognized_data = json.loads(response_text)
         logger.info("Данные от Gemini успешно распознаны и распарсены.")
+        # Частичный ответ не кэшируем: следующая попытка может вернуть все поля
+        if complete:
+            await _cache.set(id_key, recognized_data)
+            await _cache.set(content_key, recognized_data)
 
         return recognized_data
 
@@ -0,0 +1,108 @@
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Union
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(*parts: Union[str, bytes]) -> str:
+    """Ключ кэша: sha256 от версии промпта, модели и file_unique_id/содержимого фото."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class OcrCache:
+    """
+    Кэш результатов распознавания.
+
+    Первый уровень — LRU в памяти с ограничением по числу записей и TTL.
+    Второй (необязательный) — SQLite на диске, переживает перезапуск;
+    найденное на диске поднимается обратно в память.
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: int = 7 * 24 * 3600, db_path: Optional[str] = None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._conn = None
+        self._executor = None
+        if db_path:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ocr-cache')
+            self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_cache (key TEXT PRIMARY KEY, value TEXT, expires_at REAL)"
+            )
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        row = self._conn.execute(
+            "SELECT value, expires_at FROM ocr_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def _disk_set(self, key: str, value: dict, expires_at: float):
+        now = time.time()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO ocr_cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False, separators=(',', ':')), expires_at)
+        )
+        self._conn.execute("DELETE FROM ocr_cache WHERE expires_at <= ?", (now,))
+
+    def _remember(self, key: str, value: dict, expires_at: float):
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self._max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, expires_at = entry
+            if expires_at > time.time():
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(value)
+            del self._memory[key]
+
+        if self._conn is not None:
+            entry = await self._run(self._disk_get, key)
+            if entry is not None:
+                self._remember(key, *entry)
+                self.hits += 1
+                self.disk_hits += 1
+                return copy.deepcopy(entry[0])
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: dict):
+        expires_at = time.time() + self._ttl
+        value = copy.deepcopy(value)
+        self._remember(key, value, expires_at)
+        if self._conn is not None:
+            await self._run(self._disk_set, key, value, expires_at)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'disk_hits': self.disk_hits,
+            'entries': len(self._memory),
+        }
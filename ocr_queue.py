@@ -0,0 +1,177 @@
+import asyncio
+import itertools
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class OcrQueueFullError(Exception):
+    """В очереди OCR нет места, а ждать освобождения нельзя (или время ожидания вышло)."""
+
+
+@dataclass
+class _OcrJob:
+    func: Callable[..., Awaitable[Any]]
+    args: Tuple
+    kwargs: dict
+    priority: int
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class OcrQueue:
+    """
+    Внутрипроцессная очередь вызовов OCR с фиксированным пулом воркеров.
+
+    Одновременно к Gemini идет не больше `workers` запросов, остальные ждут
+    в очереди по приоритету (регистрация раньше пакетной переобработки).
+    Очередь ограничена `max_size` заданиями: при переполнении submit либо
+    сразу отказывает, либо ждет места не дольше `wait_timeout` секунд.
+    submit возвращает future, которую хэндлер может дождаться или отменить.
+    """
+
+    PRIORITY_INTERACTIVE = 0  # Пользователь ждет ответа в чате
+    PRIORITY_BATCH = 10  # Пакетная переобработка, повторное распознавание
+    WAIT_SAMPLES = 500  # Сколько последних ожиданий держим для перцентилей
+
+    def __init__(self, *, workers: int = 4, max_size: int = 100):
+        self._workers_count = workers
+        self._max_size = max_size
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._seq = itertools.count()
+        self._workers: List[asyncio.Task] = []
+        self._running = 0
+        self._waits = deque(maxlen=self.WAIT_SAMPLES)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.rejected = 0
+        self.deferred = 0
+
+    async def start(self):
+        self._queue = asyncio.PriorityQueue()
+        self._space = asyncio.Condition()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+        logger.info(f"Очередь OCR запущена: {self._workers_count} воркеров, до {self._max_size} заданий")
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Задания, которые так и не начались, отменяем, чтобы никто не ждал их вечно
+        while self._queue is not None and not self._queue.empty():
+            _, _, job = self._queue.get_nowait()
+            job.future.cancel()
+        self._queue = None
+
+    async def submit(self, func: Callable[..., Awaitable[Any]], *args, priority: int = PRIORITY_INTERACTIVE,
+                     wait_timeout: Optional[float] = 0, **kwargs) -> asyncio.Future:
+        """
+        Ставит вызов `await func(*args, **kwargs)` в очередь.
+
+        :param priority: Меньше — раньше; внутри одного приоритета порядок FIFO.
+        :param wait_timeout: Сколько секунд ждать места в переполненной очереди;
+                             0 — отказать сразу, None — ждать сколько потребуется.
+        :return: Future с результатом func. Отмена future отменяет и сам вызов.
+        :raises OcrQueueFullError: Очередь переполнена.
+        """
+        if self._queue is None:
+            raise RuntimeError("OcrQueue is not started")
+
+        if self._queue.qsize() >= self._max_size:
+            if wait_timeout is not None and wait_timeout <= 0:
+                self.rejected += 1
+                raise OcrQueueFullError(f"OCR queue is full ({self._queue.qsize()} pending)")
+            self.deferred += 1
+            try:
+                async with self._space:
+                    await asyncio.wait_for(
+                        self._space.wait_for(lambda: self._queue.qsize() < self._max_size), wait_timeout
+                    )
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise OcrQueueFullError(f"OCR queue is still full after {wait_timeout} s")
+
+        job = _OcrJob(func, args, kwargs, priority, asyncio.get_running_loop().create_future())
+        self._queue.put_nowait((priority, next(self._seq), job))
+        self.submitted += 1
+        return job.future
+
+    async def run(self, func: Callable[..., Awaitable[Any]], *args, priority: int = PRIORITY_INTERACTIVE,
+                  wait_timeout: Optional[float] = 0, **kwargs) -> Any:
+        """submit + ожидание результата."""
+        return await (await self.submit(func, *args, priority=priority, wait_timeout=wait_timeout, **kwargs))
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(len(waits) * p))], 3) if waits else 0.0
+
+        return {
+            'depth': self.depth,
+            'running': self._running,
+            'workers': self._workers_count,
+            'max_size': self._max_size,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'rejected': self.rejected,
+            'deferred': self.deferred,
+            'wait_p50': percentile(0.5),
+            'wait_p95': percentile(0.95),
+            'wait_max': round(waits[-1], 3) if waits else 0.0,
+        }
+
+    async def _notify_space(self):
+        async with self._space:
+            self._space.notify_all()
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._notify_space()
+                if job.future.done():
+                    # Хэндлер отменил задание, пока оно ждало в очереди
+                    self.cancelled += 1
+                    continue
+                self._waits.append(time.monotonic() - job.enqueued_at)
+                self._running += 1
+                task = asyncio.ensure_future(job.func(*job.args, **job.kwargs))
+                job.future.add_done_callback(lambda future, task=task: task.cancel() if future.cancelled() else None)
+                try:
+                    result = await asyncio.shield(task)
+                except asyncio.CancelledError:
+                    if not job.future.cancelled():
+                        # Отменили сам воркер (stop), а не задание
+                        task.cancel()
+                        job.future.cancel()
+                        raise
+                    self.cancelled += 1
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Задание OCR завершилось ошибкой: {e}")
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    self.completed += 1
+                    if not job.future.done():
+                        job.future.set_result(result)
+                finally:
+                    self._running -= 1
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,157 @@
+import re
+from datetime import date, datetime
+from typing import Dict, Iterable, Optional
+
+# Поля, без которых документ не принять (для внутреннего паспорта РФ — плюс свои)
+REQUIRED_FIELDS = ('documentType', 'lastName', 'firstName', 'birthDate', 'number')
+_RF_INTERNAL_REQUIRED = ('series', 'issuedBy', 'issueDate', 'departmentCode')
+
+DATE_FIELDS = ('birthDate', 'issueDate', 'expiryDate')
+DATE_FORMAT = '%d.%m.%Y'
+_DATE_SHAPE = re.compile(r'\d{2}\.\d{2}\.\d{4}')
+
+# Суффикс documentType (см. примеры в промпте) → код страны
+_TYPE_COUNTRY = {
+    'rf': 'ru', 'kazakhstan': 'kz', 'kyrgyzstan': 'kg', 'uzbekistan': 'uz', 'tajikistan': 'tj',
+    'armenia': 'am', 'azerbaijan': 'az', 'belarus': 'by', 'moldova': 'md', 'georgia': 'ge', 'ukraine': 'ua',
+}
+
+# Паттерны из п.3 промпта (пробелы перед сравнением убираются). Это ориентиры:
+# несовпадение — повод перепроверить поле, а не отбросить документ
+FIELD_PATTERNS = {
+    'internal_passport_rf': {'series': r'\d{4}', 'number': r'\d{6}', 'departmentCode': r'\d{3}-\d{3}'},
+    'international_passport_rf': {'number': r'\d{9}'},
+    'kz': {'number': r'[A-Z]\d{7,8}', 'personalNumber': r'\d{12}'},
+    'kg': {'number': r'[A-Z]{2}\d{7}', 'personalNumber': r'\d{14}'},
+    'uz': {'number': r'[A-Z]{2}\d{7}'},
+    'tj': {'number': r'[A-Z]{2}\d{7}'},
+    'am': {'number': r'[A-Z]{2}\d{7}', 'personalNumber': r'\d{10}'},
+    'az': {'number': r'[A-Z]{0,3}\d{7,8}'},
+    'by': {'number': r'([A-Z]{2})?\d{7}'},
+    'md': {'number': r'[A-Z]{0,2}\d{6,9}', 'personalNumber': r'\d{13}'},
+    'ge': {'number': r'[A-Z]{0,2}\d{7,9}', 'personalNumber': r'\d{11}'},
+    'ua': {'number': r'[A-Z]{2}\d{6}|\d{8,9}'},
+}
+
+# Что просить у модели при перепроверке поля
+FIELD_HINTS = {
+    'documentType': "тип документа (internal_passport_rf, international_passport_rf, id_card_<страна>, "
+                    "international_passport_<страна>)",
+    'lastName': "фамилия",
+    'firstName': "имя",
+    'middleName': "отчество или null",
+    'birthDate': "дата рождения, ДД.ММ.ГГГГ",
+    'birthPlace': "место рождения",
+    'series': "серия",
+    'number': "номер документа ровно как напечатан",
+    'personalNumber': "личный номер (ИИН/ПИН/IDNP) или null",
+    'issuedBy': "кем выдан",
+    'issueDate': "дата выдачи, ДД.ММ.ГГГГ",
+    'expiryDate': "срок действия, ДД.ММ.ГГГГ или null",
+    'departmentCode': "код подразделения, XXX-XXX",
+    'registrationAddress': "адрес регистрации одной строкой или null",
+}
+
+REASONS = {
+    'missing': "не найдено",
+    'format': "неверный формат",
+    'pattern': "не похоже на номер этой страны",
+    'order': "противоречит другим датам",
+}
+
+
+def _parse_date(value) -> Optional[date]:
+    if not isinstance(value, str) or not _DATE_SHAPE.fullmatch(value.strip()):
+        return None
+    try:
+        return datetime.strptime(value.strip(), DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def patterns_for(document_type: Optional[str], country: Optional[str] = None) -> Dict[str, str]:
+    """Паттерны полей для типа документа; страна из documentType важнее выбранной пользователем."""
+    document_type = document_type or ''
+    if document_type in FIELD_PATTERNS:
+        return FIELD_PATTERNS[document_type]
+    suffix = document_type.rsplit('_', 1)[-1]
+    return FIELD_PATTERNS.get(_TYPE_COUNTRY.get(suffix, country), {})
+
+
+def validate_document(data: dict, country: Optional[str] = None, today: Optional[date] = None) -> Dict[str, str]:
+    """
+    Детерминированная проверка распознанного документа.
+
+    :return: {поле: причина} для полей, не прошедших проверку (причины — ключи REASONS).
+    """
+    today = today or date.today()
+    document_type = data.get('documentType') or ''
+    failures = {}
+
+    required = REQUIRED_FIELDS + (_RF_INTERNAL_REQUIRED if document_type == 'internal_passport_rf' else ())
+    for field in required:
+        if not data.get(field):
+            failures[field] = 'missing'
+
+    dates = {}
+    for field in DATE_FIELDS:
+        value = data.get(field)
+        if value in (None, ''):
+            continue
+        parsed = _parse_date(value)
+        if parsed is None:
+            failures[field] = 'format'
+        else:
+            dates[field] = parsed
+
+    for field, pattern in patterns_for(document_type, country).items():
+        value = data.get(field)
+        if value and not re.fullmatch(pattern, str(value).replace(' ', '').upper()):
+            failures.setdefault(field, 'pattern')
+
+    birth, issue, expiry = dates.get('birthDate'), dates.get('issueDate'), dates.get('expiryDate')
+    if birth and birth >= today:
+        failures.setdefault('birthDate', 'order')
+    if issue and (issue > today or (birth and issue <= birth)):
+        failures.setdefault('issueDate', 'order')
+    if expiry and ((issue and expiry <= issue) or (birth and expiry <= birth)):
+        failures.setdefault('expiryDate', 'order')
+    return failures
+
+
+def build_reask_prompt(failures: Dict[str, str], data: dict) -> str:
+    """Короткий промпт для перепроверки только проблемных полей."""
+    lines = []
+    for field, reason in failures.items():
+        current = data.get(field)
+        seen = f", распознано «{current}»" if current not in (None, '') else ""
+        lines.append(f"- {field}: {FIELD_HINTS.get(field, field)} ({REASONS.get(reason, reason)}{seen})")
+    return (
+        "Перепроверь на изображениях документа только эти поля:\n"
+        + "\n".join(lines)
+        + "\n\nВерни один JSON-объект только с этими ключами. Даты — строго ДД.ММ.ГГГГ. "
+          "Если поле не читается или отсутствует — null, без догадок. Никакого текста вне JSON."
+    )
+
+
+def field_confidence(data: dict, failures: Dict[str, str], fields: Iterable[str],
+                     mrz_fields: Iterable[str] = (), reasked: Iterable[str] = ()) -> Dict[str, str]:
+    """
+    Флаги по полям: 'mrz' — из проверенной MRZ, 'ok' — прошло проверки,
+    'reasked' — исправлено перепроверкой, 'invalid' — не прошло проверки,
+    'missing' — пусто и это допустимо.
+    """
+    mrz_fields, reasked = set(mrz_fields), set(reasked)
+    flags = {}
+    for field in fields:
+        if field in failures:
+            flags[field] = 'invalid'
+        elif field in mrz_fields:
+            flags[field] = 'mrz'
+        elif data.get(field) in (None, ''):
+            flags[field] = 'missing'
+        elif field in reasked:
+            flags[field] = 'reasked'
+        else:
+            flags[field] = 'ok'
+    return flags
@@ -0,0 +1,169 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, Tuple
+
+import google.generativeai as genai
+from google.api_core.exceptions import NotFound, PermissionDenied
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+# Кэш промпта удален или недоступен на стороне Gemini: только тогда запрос
+# повторяется inline, остальные ошибки (429, таймауты, сеть) идут дальше как есть
+CACHE_MISSING_ERRORS = (NotFound, PermissionDenied)
+
+
+@dataclass
+class PreparedPrompt:
+    """Модель, к которой уже «привязан» статический промпт, и что слать перед изображениями."""
+    model: genai.GenerativeModel
+    prefix: list
+    cached: bool
+    expires_at: float = field(default=float('inf'))
+    handle: Any = None  # Ресурс бэкенда (CachedContent), см. PromptBackend.release()
+
+
+class PromptBackend:
+    """Способ доставки большого статического промпта в модель."""
+    name = 'base'
+
+    async def prepare(self, model: genai.GenerativeModel, prompt: str, generation_config: dict) -> PreparedPrompt:
+        raise NotImplementedError
+
+    async def release(self, prepared: PreparedPrompt):
+        """Освобождает ресурс подготовленного промпта, который больше не используется."""
+
+
+class InlinePromptBackend(PromptBackend):
+    """Промпт целиком уходит первой частью каждого запроса (как было раньше)."""
+    name = 'inline'
+
+    async def prepare(self, model: genai.GenerativeModel, prompt: str, generation_config: dict) -> PreparedPrompt:
+        # Та же модель, что создана и прогрета в ModelRegistry
+        return PreparedPrompt(model=model, prefix=[prompt], cached=False)
+
+
+class GeminiCachedContentBackend(PromptBackend):
+    """
+    Промпт регистрируется один раз как CachedContent (system instruction),
+    дальше в запросах идет только ссылка на кэш и изображения.
+    """
+    name = 'gemini'
+
+    def __init__(self, ttl: int = 3600):
+        self._ttl = ttl
+
+    async def prepare(self, model: genai.GenerativeModel, prompt: str, generation_config: dict) -> PreparedPrompt:
+        # CachedContent.create — синхронный сетевой вызов SDK
+        cached_content = await asyncio.to_thread(
+            genai.caching.CachedContent.create,
+            model=model.model_name,
+            system_instruction=prompt,
+            ttl=datetime.timedelta(seconds=self._ttl)
+        )
+        cached_model = genai.GenerativeModel.from_cached_content(cached_content, generation_config=generation_config)
+        logger.info(f"Промпт ({len(prompt)} символов) закэширован в Gemini как {cached_content.name}")
+        # Обновляем кэш заранее, до истечения TTL на стороне Gemini
+        return PreparedPrompt(model=cached_model, prefix=[], cached=True,
+                              expires_at=time.time() + self._ttl * 0.9, handle=cached_content)
+
+    async def release(self, prepared: PreparedPrompt):
+        # Хранение кэша оплачивается до конца TTL, если его не удалить
+        await asyncio.to_thread(prepared.handle.delete)
+        logger.info(f"Кэш промпта {prepared.handle.name} удален из Gemini")
+
+
+class PromptCache:
+    """
+    Хранит подготовленные промпты по (модель, хэш промпта).
+
+    Если основной бэкенд не смог (модель не поддерживает кэш, промпт короче
+    минимума и т.п.), используется inline-отправка, а попытка повторяется
+    через `retry_after` секунд. Замененный или сброшенный кэш удаляется
+    из Gemini. Считает токены, сэкономленные кэшем.
+    """
+
+    def __init__(self, backend: PromptBackend, fallback: PromptBackend = None, retry_after: int = 600):
+        self._backend = backend
+        self._fallback = fallback or InlinePromptBackend()
+        self._retry_after = retry_after
+        self._entries: Dict[Tuple[str, str], PreparedPrompt] = {}
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self.requests = 0
+        self.cached_requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def backend_name(self) -> str:
+        return self._backend.name
+
+    @staticmethod
+    def _key(model: genai.GenerativeModel, prompt: str) -> Tuple[str, str]:
+        return model.model_name, hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+
+    async def _release(self, prepared: PreparedPrompt):
+        # Запись inline-фолбэка основному бэкенду не принадлежит
+        if not prepared.cached:
+            return
+        try:
+            await self._backend.release(prepared)
+        except Exception as e:
+            logger.warning(f"Не удалось освободить подготовленный промпт бэкенда '{self._backend.name}': {e}")
+
+    async def resolve(self, model: genai.GenerativeModel, prompt: str, generation_config: dict) -> PreparedPrompt:
+        key = self._key(model, prompt)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.time():
+            return entry
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > time.time():
+                return entry
+            try:
+                prepared = await self._backend.prepare(model, prompt, generation_config)
+            except Exception as e:
+                logger.warning(f"Бэкенд промптов '{self._backend.name}' недоступен для {model.model_name}, шлем промпт inline: {e}")
+                prepared = await self._fallback.prepare(model, prompt, generation_config)
+                prepared.expires_at = time.time() + self._retry_after
+            self._entries[key] = prepared
+        if entry is not None:
+            await self._release(entry)
+        return prepared
+
+    async def invalidate(self, model: genai.GenerativeModel, prompt: str, prepared: PreparedPrompt):
+        """
+        Сбрасывает подготовленный промпт, с которым запрос не удался (например,
+        кэш удален на стороне Gemini). Если его уже заменили, новый не трогаем.
+        """
+        key = self._key(model, prompt)
+        if self._entries.get(key) is prepared:
+            del self._entries[key]
+            await self._release(prepared)
+
+    async def resolve_inline(self, model: genai.GenerativeModel, prompt: str, generation_config: dict) -> PreparedPrompt:
+        return await self._fallback.prepare(model, prompt, generation_config)
+
+    def record_usage(self, prepared: PreparedPrompt, usage_metadata):
+        self.requests += 1
+        if prepared.cached:
+            self.cached_requests += 1
+        if usage_metadata is not None:
+            self.prompt_tokens += getattr(usage_metadata, 'prompt_token_count', 0) or 0
+            self.cached_tokens += getattr(usage_metadata, 'cached_content_token_count', 0) or 0
+
+    def stats(self) -> dict:
+        return {
+            'backend': self._backend.name,
+            'requests': self.requests,
+            'cached_requests': self.cached_requests,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+        }
@@ -0,0 +1,231 @@
+"""
+Пакетное повторное распознавание документов из бакета passports.
+
+Обходит папки passports/{user_id}/, скачивает фото документов и прогоняет их
+через recognize_document_from_images с ограниченным параллелизмом. Результаты
+дописываются в JSONL, обработанные user_id — в файл чекпоинта, поэтому
+прерванный прогон можно продолжить той же командой.
+
+    python reocr.py --output reocr.jsonl --since 2025-01-01 --limit 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import List, Optional, Set
+
+from dotenv import load_dotenv
+
+from ocr import configure_gemini, configure_ocr_cache, parse_model_overrides, recognize_document_from_images
+from ocr_queue import OcrQueue
+from storage_client import StorageClient
+from uploads import STORAGE_BUCKET
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+# Фото, которые уходят в OCR, в порядке передачи модели
+OCR_KEYS = ('passport_main', 'passport_reg', 'patent_front', 'patent_back')
+LIST_PAGE_SIZE = 1000
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class Checkpoint:
+    """Append-only список обработанных user_id: строка на пользователя, переживает обрыв."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.done = {line.strip() for line in f if line.strip()}
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def mark(self, user_id: str):
+        self.done.add(user_id)
+        self._file.write(f"{user_id}\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ReOcrRun:
+    def __init__(self, storage: StorageClient, ocr_queue: OcrQueue, checkpoint: Checkpoint, output,
+                 *, since: Optional[datetime], limit: Optional[int], country: Optional[str],
+                 download_concurrency: int):
+        self._storage = storage
+        self._ocr_queue = ocr_queue
+        self._checkpoint = checkpoint
+        self._output = output
+        self._since = since
+        self._limit = limit
+        self._country = country
+        self._download_concurrency = download_concurrency
+        self._started = 0
+        self.users = 0
+        self.failed = 0
+        self.skipped = 0
+        self.files = 0
+        self.bytes = 0
+
+    async def _iter_user_folders(self):
+        offset = 0
+        while True:
+            entries = await self._storage.list(STORAGE_BUCKET, '', limit=LIST_PAGE_SIZE, offset=offset)
+            for entry in entries:
+                # У папок нет id; файлы в корне бакета нас не интересуют
+                if entry.get('id') is None:
+                    yield entry['name']
+            if len(entries) < LIST_PAGE_SIZE:
+                return
+            offset += LIST_PAGE_SIZE
+
+    def _limit_reached(self) -> bool:
+        return self._limit is not None and self._started >= self._limit
+
+    async def _producer(self, queue: asyncio.Queue):
+        async for user_id in self._iter_user_folders():
+            if self._limit_reached():
+                break
+            if user_id in self._checkpoint.done:
+                self.skipped += 1
+                continue
+            await queue.put(user_id)
+
+    def _select_files(self, objects: List[dict]) -> List[dict]:
+        by_key = {obj['name'].rsplit('.', 1)[0]: obj for obj in objects if obj.get('id') is not None}
+        return [by_key[key] for key in OCR_KEYS if key in by_key]
+
+    def _is_recent(self, files: List[dict]) -> bool:
+        if self._since is None:
+            return True
+        stamps = [_parse_time(obj.get('updated_at') or obj.get('created_at')) for obj in files]
+        return any(stamp and stamp >= self._since for stamp in stamps)
+
+    async def _process_user(self, user_id: str):
+        files = self._select_files(await self._storage.list(STORAGE_BUCKET, user_id))
+        if not files or not self._is_recent(files) or self._limit_reached():
+            self.skipped += 1
+            return
+        self._started += 1
+
+        images = await asyncio.gather(*(
+            self._storage.download(STORAGE_BUCKET, f"{user_id}/{obj['name']}") for obj in files
+        ))
+        self.files += len(images)
+        self.bytes += sum(len(image) for image in images)
+
+        # Без гражданства в бакете: у кого есть патент — иностранец
+        country = self._country or ('foreign' if any(obj['name'].startswith('patent') for obj in files) else 'ru')
+        data = await self._ocr_queue.run(
+            recognize_document_from_images, list(images), country,
+            priority=OcrQueue.PRIORITY_BATCH, wait_timeout=None
+        )
+
+        record = {
+            'user_id': user_id,
+            'country': country,
+            'files': [obj['name'] for obj in files],
+            'processed_at': datetime.now(timezone.utc).isoformat(),
+        }
+        if 'error' in data:
+            record['error'] = data['error']
+            self.failed += 1
+        else:
+            record['data'] = data
+            self.users += 1
+        self._output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._output.flush()
+        # Ошибочных в чекпоинт не пишем: при повторном запуске попробуем снова
+        if 'error' not in data:
+            self._checkpoint.mark(user_id)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            user_id = await queue.get()
+            try:
+                await self._process_user(user_id)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Пользователь {user_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def run(self):
+        # Очередь короткая: списки папок не обгоняют скачивание слишком сильно
+        queue = asyncio.Queue(maxsize=self._download_concurrency * 2)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self._download_concurrency)]
+        try:
+            await self._producer(queue)
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Повторное распознавание документов из бакета passports")
+    parser.add_argument('--output', default='reocr.jsonl', help="JSONL с результатами (дописывается)")
+    parser.add_argument('--checkpoint', default='reocr.checkpoint', help="Файл с обработанными user_id")
+    parser.add_argument('--limit', type=int, help="Обработать не больше N новых пользователей")
+    parser.add_argument('--since', type=_parse_time,
+                        help="Только папки с фото, загруженными не раньше даты (ISO, напр. 2025-01-01)")
+    parser.add_argument('--country', help="Принудительно 'ru' или 'foreign' вместо определения по патенту")
+    parser.add_argument('--download-concurrency', type=int, default=8, help="Пользователей скачиваем одновременно")
+    parser.add_argument('--ocr-concurrency', type=int, default=4, help="Одновременных запросов к Gemini")
+    return parser.parse_args(argv)
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+
+    configure_gemini(
+        os.getenv('GOOGLE_API_KEY'),
+        default_model=os.getenv('GEMINI_MODEL', 'gemini-2.5-flash-lite'),
+        models=parse_model_overrides(os.getenv('GEMINI_MODELS', ''))
+    )
+    # Повторный прогон нужен как раз после смены промпта — старые ответы не годятся
+    configure_ocr_cache(max_entries=0)
+
+    storage = StorageClient(os.getenv('SUPABASE_URL'), os.getenv('SUPABASE_SERVICE_ROLE_KEY'),
+                            pool_size=args.download_concurrency * 2)
+    ocr_queue = OcrQueue(workers=args.ocr_concurrency, max_size=args.ocr_concurrency * 2)
+    checkpoint = Checkpoint(args.checkpoint)
+    started = time.monotonic()
+    await ocr_queue.start()
+    try:
+        with open(args.output, 'a', encoding='utf-8') as output:
+            run = ReOcrRun(storage, ocr_queue, checkpoint, output, since=args.since, limit=args.limit,
+                           country=args.country, download_concurrency=args.download_concurrency)
+            await run.run()
+    finally:
+        await ocr_queue.stop()
+        await storage.close()
+        checkpoint.close()
+
+    elapsed = max(time.monotonic() - started, 1e-6)
+    queue_stats = ocr_queue.stats()
+    print(
+        f"Готово за {elapsed:.1f} с: распознано {run.users}, ошибок {run.failed}, пропущено {run.skipped}\n"
+        f"Файлов {run.files} ({run.bytes / 1024 / 1024:.1f} МБ), "
+        f"{run.users / elapsed:.2f} польз./с, {run.files / elapsed:.2f} файлов/с, "
+        f"{run.bytes / 1024 / 1024 / elapsed:.2f} МБ/с\n"
+        f"Ожидание в очереди OCR: p50 {queue_stats['wait_p50']} с, p95 {queue_stats['wait_p95']} с"
+    )
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+import logging
+import time
+from typing import BinaryIO, Optional, Union
+from urllib.parse import quote
+
+import aiohttp
+
+from metrics import STORAGE_BYTES, STORAGE_ERRORS, STORAGE_SECONDS
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class StorageError(Exception):
+    """Ошибка ответа Supabase Storage (статус != 2xx)."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Storage returned status {status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class StorageClient:
+    """
+    Асинхронный клиент Supabase Storage поверх REST API.
+
+    Заменяет синхронные вызовы supabase-py внутри хэндлеров: все запросы идут
+    через одну aiohttp-сессию с пулом keep-alive соединений и не блокируют
+    event loop. Базовый URL задается явно, поэтому клиент можно направить
+    на локальный фейковый сервер Storage.
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, url: str, service_key: str, *, pool_size: int = 20, timeout: float = 60.0):
+        self._base_url = f"{(url or '').rstrip('/')}/storage/v1"
+        self._headers = {
+            'Authorization': f'Bearer {service_key}',
+            'apikey': service_key or '',
+        }
+        self._pool_size = pool_size
+        self._timeout = aiohttp.ClientTimeout(total=timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессию создаем лениво: ей нужен работающий event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, keepalive_timeout=60, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self._headers,
+                timeout=self._timeout
+            )
+        return self._session
+
+    def _object_url(self, bucket: str, path: str) -> str:
+        return f"{self._base_url}/object/{bucket}/{quote(path, safe='/')}"
+
+    @classmethod
+    async def _iter_chunks(cls, file: BinaryIO):
+        sent = STORAGE_BYTES.labels('upload')
+        while chunk := file.read(cls.CHUNK_SIZE):
+            sent.inc(len(chunk))
+            yield chunk
+
+    @staticmethod
+    def _observe(operation: str, started: float, ok: bool):
+        STORAGE_SECONDS.labels(operation).observe(time.perf_counter() - started)
+        if not ok:
+            STORAGE_ERRORS.labels(operation).inc()
+
+    @staticmethod
+    async def _read_json(response: aiohttp.ClientResponse):
+        if response.status >= 300:
+            raise StorageError(response.status, await response.text())
+        return await response.json(content_type=None)
+
+    async def upload(self, bucket: str, path: str, data: Union[bytes, bytearray, BinaryIO],
+                     content_type: str, upsert: bool = True, size: Optional[int] = None) -> dict:
+        """
+        Загружает объект в бакет. При upsert=True перезаписывает существующий.
+
+        `data` может быть файловым объектом: тогда он отправляется кусками по
+        CHUNK_SIZE без чтения целиком в память; `size` — его длина в байтах.
+        """
+        headers = {
+            'Content-Type': content_type,
+            'x-upsert': 'true' if upsert else 'false',
+        }
+        if not isinstance(data, (bytes, bytearray)):
+            if size is not None:
+                headers['Content-Length'] = str(size)
+            data = self._iter_chunks(data)
+        else:
+            STORAGE_BYTES.labels('upload').inc(len(data))
+        session = self._get_session()
+        started, ok = time.perf_counter(), False
+        try:
+            async with session.post(self._object_url(bucket, path), data=data, headers=headers) as response:
+                result = await self._read_json(response)
+            ok = True
+            return result
+        finally:
+            self._observe('upload', started, ok)
+
+    async def download(self, bucket: str, path: str) -> bytes:
+        """Скачивает объект целиком (как storage.from_(bucket).download(path))."""
+        session = self._get_session()
+        started, ok = time.perf_counter(), False
+        try:
+            async with session.get(self._object_url(bucket, path)) as response:
+                if response.status >= 300:
+                    raise StorageError(response.status, await response.text())
+                body = await response.read()
+            STORAGE_BYTES.labels('download').inc(len(body))
+            ok = True
+            return body
+        finally:
+            self._observe('download', started, ok)
+
+    async def list(self, bucket: str, prefix: str = '', limit: int = 100, offset: int = 0) -> list:
+        """Возвращает объекты папки `prefix` (как storage.from_(bucket).list(prefix))."""
+        payload = {
+            'prefix': prefix,
+            'limit': limit,
+            'offset': offset,
+            'sortBy': {'column': 'name', 'order': 'asc'},
+        }
+        session = self._get_session()
+        started, ok = time.perf_counter(), False
+        try:
+            async with session.post(f"{self._base_url}/object/list/{bucket}", json=payload) as response:
+                result = await self._read_json(response)
+            ok = True
+            return result
+        finally:
+            self._observe('list', started, ok)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
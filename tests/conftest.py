@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+from typing import Tuple
+
+from aiohttp import web
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# bot.py читает настройки при импорте: без внешних сервисов и файлов на диске
+os.environ.setdefault('SUPABASE_URL', 'http://127.0.0.1:9')
+os.environ.setdefault('SUPABASE_SERVICE_ROLE_KEY', 'test-service-role-key-0000')
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:TEST-token')
+os.environ['FSM_STORAGE_URL'] = 'memory://'
+os.environ['MEDIA_REGISTRY_PATH'] = os.path.join(tempfile.mkdtemp(), 'media_registry.json')
+
+
+async def serve(app: web.Application) -> Tuple[web.AppRunner, str]:
+    """Поднимает aiohttp-приложение на свободном локальном порту; возвращает (runner, base_url)."""
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
@@ -0,0 +1,86 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+import fsm_storage
+from fsm_storage import SQLiteStorage, count_sessions, create_fsm_storage
+
+
+class Reg(StatesGroup):
+    passport_main = State()
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_state_and_data_survive_reopen(tmp_path):
+    path = str(tmp_path / 'fsm.db')
+    data = {'language': 'ru', 'full_name': 'Пётр Иванов', 'uploaded_files': {'passport_main': {'size': 1024}}}
+
+    async def scenario():
+        storage = create_fsm_storage(f'sqlite:///{path}', ttl=3600)
+        assert isinstance(storage, SQLiteStorage)
+        await storage.set_state(key(1), Reg.passport_main)
+        await storage.set_data(key(1), data)
+        await storage.close()
+
+        # Как после перезапуска бота
+        reopened = SQLiteStorage(path, ttl=3600)
+        try:
+            return (await reopened.get_state(key(1)), await reopened.get_data(key(1)),
+                    await reopened.get_state(key(2)), await reopened.get_data(key(2)))
+        finally:
+            await reopened.close()
+
+    assert asyncio.run(scenario()) == ('Reg:passport_main', data, None, {})
+
+
+def test_ttl_slides_with_each_write(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fsm_storage, 'time', SimpleNamespace(time=lambda: now[0]))
+    storage = SQLiteStorage(str(tmp_path / 'fsm.db'), ttl=100)
+
+    async def scenario():
+        await storage.set_state(key(1), Reg.passport_main)
+        now[0] += 90
+        await storage.set_data(key(1), {'language': 'ru'})
+        now[0] += 60  # 150 с от первой записи, 60 — от последней
+        alive = await storage.get_state(key(1)), await storage.get_data(key(1))
+
+        now[0] += 50
+        expired = await storage.get_state(key(1)), await storage.get_data(key(1))
+        # Новая запись после истечения не «воскрешает» старое состояние
+        await storage.set_data(key(1), {'language': 'en'})
+        fresh = await storage.get_state(key(1)), await storage.get_data(key(1))
+        await storage.close()
+        return alive, expired, fresh
+
+    alive, expired, fresh = asyncio.run(scenario())
+    assert alive == ('Reg:passport_main', {'language': 'ru'})
+    assert expired == (None, {})
+    assert fresh == (None, {'language': 'en'})
+
+
+def test_count_sessions(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(fsm_storage, 'time', SimpleNamespace(time=lambda: now[0]))
+    storage = SQLiteStorage(str(tmp_path / 'fsm.db'), ttl=100)
+
+    async def scenario():
+        await storage.set_state(key(1), Reg.passport_main)
+        now[0] += 60
+        await storage.set_state(key(2), Reg.passport_main)
+        await storage.set_data(key(3), {'language': 'ru'})  # Данные без состояния — не сессия
+        await storage.set_state(key(4), Reg.passport_main)
+        await storage.set_state(key(4), None)  # Регистрация закончена
+        counts = [await count_sessions(storage)]
+
+        now[0] += 50  # Сессия пользователя 1 истекла
+        counts.append(await count_sessions(storage))
+        await storage.close()
+        return counts
+
+    assert asyncio.run(scenario()) == [2, 1]
@@ -0,0 +1,42 @@
+import json
+import os
+from string import Formatter
+
+import i18n
+from keyboards import build_country_keyboard, build_skip_keyboard
+
+TRANSLATIONS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'translations.json')
+
+
+def load_translations() -> dict:
+    with open(TRANSLATIONS, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def legacy_t(key: str, lang: str = 'en', **kwargs) -> str:
+    """t() до предкомпиляции: поиск в словаре и str.format на каждый вызов."""
+    text = load_translations().get(lang, {}).get(key, key)
+    if kwargs:
+        text = text.format(**kwargs)
+    return text
+
+
+def test_compiled_translations_match_str_format():
+    i18n.init_translations(TRANSLATIONS)
+    checked = 0
+    for lang, strings in load_translations().items():
+        for key, text in strings.items():
+            names = {name for _, name, _, _ in Formatter().parse(text) if name}
+            kwargs = {name: f'<{name}>' for name in names}
+            assert i18n.t(key, lang, **kwargs) == text.format(**kwargs), (lang, key)
+            checked += 1
+    assert checked
+    assert i18n.t('no_such_key', 'ru') == 'no_such_key'
+
+
+def test_keyboards_are_built_once_per_language():
+    i18n.init_translations(TRANSLATIONS)
+    for lang in ('ru', 'en'):
+        assert i18n.keyboard('country', lang) is i18n.keyboard('country', lang)
+        assert i18n.keyboard('country', lang) == build_country_keyboard(legacy_t, lang)
+        assert i18n.keyboard('skip', lang) == build_skip_keyboard(legacy_t, lang)
@@ -0,0 +1,84 @@
+import asyncio
+import io
+import time
+
+from PIL import Image
+
+import image_prep
+from image_prep import configure_preprocessing, prepare_images
+
+# Сколько может «залипнуть» event loop, пока пачка фото декодируется в пуле
+MAX_LOOP_LAG = 0.1
+TICK = 0.005
+
+
+def make_photo(seed: int, size=(4000, 3000)) -> bytes:
+    """Большое шумное фото в JPEG: декодирование и пережатие занимают заметное время."""
+    noise = Image.effect_noise(size, 64 + seed).convert('RGB')
+    buffer = io.BytesIO()
+    noise.save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+async def measure_lag(coro):
+    """Выполняет coro, параллельно тикая каждые TICK секунд; возвращает (результат, максимальная задержка тика)."""
+    max_lag = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal max_lag
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            max_lag = max(max_lag, time.perf_counter() - started - TICK)
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    try:
+        result = await coro
+    finally:
+        done.set()
+        await ticker_task
+    return result, max_lag
+
+
+def test_loop_stays_responsive_while_batch_decodes():
+    configure_preprocessing(max_edge=1600, workers=2)
+    photos = [make_photo(seed) for seed in range(6)]
+
+    started = time.perf_counter()
+    prepared, max_lag = asyncio.run(measure_lag(prepare_images(photos)))
+    elapsed = time.perf_counter() - started
+
+    assert len(prepared) == len(photos)
+    assert all(max(Image.open(io.BytesIO(p.data)).size) <= 1600 for p in prepared)
+    # Пачка обрабатывается заметно дольше допустимой задержки — иначе тест ничего не доказывает
+    assert elapsed > 3 * MAX_LOOP_LAG
+    assert max_lag < MAX_LOOP_LAG, f"event loop blocked for {max_lag:.3f} s"
+
+
+def test_jpeg_is_decoded_at_reduced_size(monkeypatch):
+    decoded = []
+    exif_transpose = image_prep.ImageOps.exif_transpose
+
+    def record_decoded(image, *args, **kwargs):
+        decoded.append(image.size)
+        return exif_transpose(image, *args, **kwargs)
+
+    monkeypatch.setattr(image_prep.ImageOps, 'exif_transpose', record_decoded)
+    settings = image_prep.PrepSettings(max_edge=1600)
+    for size in ((4000, 3000), (3000, 4000), (4032, 3024), (1200, 900)):
+        image_prep.prepare_image(make_photo(0, size), settings)
+
+    # Альбомные и портретные фото декодируются в 1/2 масштаба, не ниже max_edge; маленькие — как есть
+    assert decoded == [(2000, 1500), (1500, 2000), (2016, 1512), (1200, 900)]
+
+
+def test_run_in_pool_uses_prep_executor():
+    configure_preprocessing(workers=1)
+
+    async def scenario():
+        import threading
+        return await image_prep.run_in_pool(lambda: threading.current_thread().name)
+
+    assert asyncio.run(scenario()).startswith('image-prep')
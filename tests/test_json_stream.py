@@ -0,0 +1,48 @@
+import pytest
+
+from json_stream import JsonObjectStream, parse_json_object
+
+RESPONSE = '```json\n{"surname": "IVANOV", "name": "IVAN", "birthDate": "01.02.1990", "number": 123}\n```'
+
+
+def feed_by(text: str, size: int) -> tuple:
+    stream = JsonObjectStream()
+    emitted = []
+    for start in range(0, len(text), size):
+        emitted += stream.feed(text[start:start + size])
+    emitted += stream.finish()
+    return stream, emitted
+
+
+@pytest.mark.parametrize('size', [1, 3, 7, len(RESPONSE)])
+def test_fields_are_emitted_once_in_order(size):
+    stream, emitted = feed_by(RESPONSE, size)
+    assert emitted == [('surname', 'IVANOV'), ('name', 'IVAN'), ('birthDate', '01.02.1990'), ('number', 123)]
+    assert stream.complete
+
+
+@pytest.mark.parametrize('size', [1, 5, 1000])
+@pytest.mark.parametrize('text, expected', [
+    # Значение без кавычек, оборванный литерал, строка в одинарных кавычках
+    ('{"surname": IVANOV, "name": "IVAN", "number": 1}', {'name': 'IVAN', 'number': 1}),
+    ('{"surname": "IVANOV", "active": tru, "name": "IVAN"}', {'surname': 'IVANOV', 'name': 'IVAN'}),
+    ('{"surname": "IVANOV", "number": \'A 123\', "name": "IVAN"}', {'surname': 'IVANOV', 'name': 'IVAN'}),
+])
+def test_malformed_value_skips_only_that_field(text, expected, size):
+    stream, _ = feed_by(text, size)
+    assert stream.fields == expected
+    assert stream.complete
+
+
+def test_unfinished_nested_value_waits_for_more_data():
+    stream = JsonObjectStream()
+    assert stream.feed('{"address": {"city": "Moscow", "street": ') == []
+    assert stream.feed('"Lenina"}, "name": "IVAN"}') == [
+        ('address', {'city': 'Moscow', 'street': 'Lenina'}), ('name', 'IVAN'),
+    ]
+
+
+def test_truncated_tail_keeps_parsed_fields():
+    assert parse_json_object('{"surname": "IVANOV", "name": "IV') == {'surname': 'IVANOV'}
+    with pytest.raises(ValueError):
+        parse_json_object('no json here')
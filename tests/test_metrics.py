@@ -0,0 +1,93 @@
+import asyncio
+import re
+
+import aiohttp
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Update
+from aiohttp import web
+
+import bot
+from conftest import serve
+
+USER_ID = 77
+SAMPLE = re.compile(r'[a-zA-Z_:][a-zA-Z0-9_:]*(\{[^}]*\})? -?([0-9.e+-]+|\+Inf|-Inf|NaN)')
+
+
+def make_fake_telegram(calls: list) -> web.Application:
+    async def api_method(request: web.Request):
+        calls.append(request.match_info['method'])
+        data = await request.post()
+        return web.json_response({'ok': True, 'result': {
+            'message_id': len(calls), 'date': 0, 'text': data.get('text', ''),
+            'chat': {'id': USER_ID, 'type': 'private'},
+        }})
+
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api_method)
+    return app
+
+
+def samples(text: str) -> dict:
+    values = {}
+    for line in text.splitlines():
+        assert line.startswith('# ') or SAMPLE.fullmatch(line), f"bad sample line: {line!r}"
+        if not line.startswith('# '):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value)
+    return values
+
+
+def start_update() -> Update:
+    return Update.model_validate({'update_id': 1, 'message': {
+        'message_id': 1, 'date': 0, 'text': '/start register',
+        'chat': {'id': USER_ID, 'type': 'private'},
+        'from': {'id': USER_ID, 'is_bot': False, 'first_name': 'Test', 'language_code': 'ru'},
+    }}, context={'bot': bot.bot})
+
+
+def test_metrics_endpoint(monkeypatch):
+    monkeypatch.setattr(bot, 'METRICS_TOKEN', 'scrape-secret')
+    calls = []
+
+    async def scenario():
+        telegram_runner, telegram_url = await serve(make_fake_telegram(calls))
+        monkeypatch.setattr(bot.bot.session, 'api', TelegramAPIServer.from_base(telegram_url))
+        runner, base_url = await serve(bot.create_http_app())
+        headers = {'Authorization': 'Bearer scrape-secret'}
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'{base_url}/metrics') as response:
+                    unauthorized = response.status
+                async with session.get(f'{base_url}/metrics', headers={'Authorization': 'Bearer wrong'}) as response:
+                    wrong_token = response.status
+
+                async with session.get(f'{base_url}/metrics', headers=headers) as response:
+                    assert response.status == 200
+                    assert response.headers['Content-Type'].startswith('text/plain')
+                    before = samples(await response.text())
+
+                # /start register переводит пользователя в Reg.language и отвечает через Bot API
+                await bot.dp.feed_update(bot.bot, start_update())
+
+                async with session.get(f'{base_url}/metrics', headers=headers) as response:
+                    after = samples(await response.text())
+        finally:
+            await bot.dp.fsm.get_context(bot.bot, USER_ID, USER_ID).clear()
+            await bot.bot.session.close()
+            await runner.cleanup()
+            await telegram_runner.cleanup()
+        return unauthorized, wrong_token, before, after
+
+    unauthorized, wrong_token, before, after = asyncio.run(scenario())
+    assert (unauthorized, wrong_token) == (401, 401)
+    assert calls == ['sendMessage']
+
+    def delta(name: str) -> float:
+        return after.get(name, 0) - before.get(name, 0)
+
+    assert before['bot_fsm_sessions'] == 0
+    assert after['bot_fsm_sessions'] == 1
+    assert delta('bot_handler_seconds_count{event="message",state="none"}') == 1
+    assert delta('bot_handler_seconds_bucket{event="message",state="none",le="+Inf"}') == 1
+    assert delta('telegram_api_seconds_count{method="SendMessage"}') == 1
+    assert 'telegram_api_errors_total{method="SendMessage",error="TelegramBadRequest"}' not in after
@@ -0,0 +1,104 @@
+import pytest
+
+from mrz import check_digit, parse_mrz
+
+# Образцы из ICAO Doc 9303 (части 4 и 5)
+TD3 = (
+    'P<UTOERIKSSON<<ANNA<MARIA<<<<<<<<<<<<<<<<<<<',
+    'L898902C36UTO7408122F1204159ZE184226B<<<<<10',
+)
+TD1 = (
+    'I<UTOD231458907<<<<<<<<<<<<<<<',
+    '7408122F1204159UTO<<<<<<<<<<<6',
+    'ERIKSSON<<ANNA<MARIA<<<<<<<<<<',
+)
+# Номер длиннее 9 символов: продолжение и контрольная цифра — в optional data
+TD1_LONG_NUMBER = (
+    'I<UTOD23145890<7349<<<<<<<<<<<',
+    '3407127M9507122UTO<<<<<<<<<<<2',
+    'STEVENSON<<PETER<JOHN<<<<<<<<<',
+)
+
+
+def replace_at(line: str, index: int, char: str) -> str:
+    return line[:index] + char + line[index + 1:]
+
+
+@pytest.mark.parametrize('value, digit', [
+    ('L898902C3', '6'), ('740812', '2'), ('120415', '9'), ('ZE184226B<<<<<', '1'),
+    ('D23145890', '7'), ('D23145890734', '9'), ('<<<<<<<<<', '0'), ('', '0'),
+])
+def test_check_digit(value, digit):
+    assert check_digit(value) == digit
+
+
+def test_td3_specimen():
+    result = parse_mrz('\n'.join(TD3))
+    assert result.format == 'TD3' and result.valid
+    assert all(result.checks.values())
+    assert result.to_fields() == {
+        'documentType': 'international_passport_uto', 'lastName': 'ERIKSSON', 'firstName': 'ANNA MARIA',
+        'birthDate': '12.08.1974', 'number': 'L898902C3', 'personalNumber': 'ZE184226B',
+        'expiryDate': '15.04.2012',
+    }
+    assert (result.nationality, result.sex) == ('UTO', 'F')
+
+
+@pytest.mark.parametrize('lines, number', [(TD1, 'D23145890'), (TD1_LONG_NUMBER, 'D23145890734')])
+def test_td1_specimens(lines, number):
+    result = parse_mrz('\n'.join(lines))
+    assert result.format == 'TD1' and result.valid
+    assert all(result.checks.values())
+    assert result.number == number
+    assert result.to_fields()['documentType'] == 'id_card_uto'
+
+
+def test_td1_fields():
+    fields = parse_mrz('\n'.join(TD1)).to_fields()
+    assert fields == {
+        'documentType': 'id_card_uto', 'lastName': 'ERIKSSON', 'firstName': 'ANNA MARIA',
+        'birthDate': '12.08.1974', 'number': 'D23145890', 'personalNumber': None, 'expiryDate': '15.04.2012',
+    }
+
+
+@pytest.mark.parametrize('index, char, failed', [
+    (9, '5', {'number', 'composite'}),          # Контрольная цифра номера
+    (2, '7', {'number', 'composite'}),          # Ошибка OCR в самом номере
+    (19, '3', {'birth_date', 'composite'}),
+    (14, '5', {'birth_date', 'composite'}),     # Ошибка OCR в дате рождения
+    (27, '0', {'expiry_date', 'composite'}),
+    (42, '2', {'personal_number', 'composite'}),
+    (43, '1', {'composite'}),
+])
+def test_td3_failed_check_digits(index, char, failed):
+    result = parse_mrz('\n'.join((TD3[0], replace_at(TD3[1], index, char))))
+    assert {name for name, ok in result.checks.items() if not ok} == failed
+    assert not result.valid
+
+
+@pytest.mark.parametrize('line, index, char, failed', [
+    (0, 14, '1', {'number', 'composite'}),
+    (1, 6, '0', {'birth_date', 'composite'}),
+    (1, 14, '0', {'expiry_date', 'composite'}),
+    (1, 29, '0', {'composite'}),
+])
+def test_td1_failed_check_digits(line, index, char, failed):
+    lines = list(TD1)
+    lines[line] = replace_at(lines[line], index, char)
+    result = parse_mrz('\n'.join(lines))
+    assert {name for name, ok in result.checks.items() if not ok} == failed
+    assert not result.valid
+
+
+def test_ocr_noise_around_zone():
+    # Текст страницы вокруг зоны, пробелы между символами, «/‹ вместо '<', буква O вместо нуля в дате
+    line2 = replace_at(TD3[1], 15, 'O')
+    text = f"PASSPORT\nSurname ERIKSSON\n{TD3[0].replace('<<<', '«<‹')}\n{' '.join(line2[:20])}{line2[20:]}\n"
+    result = parse_mrz(text)
+    assert result.valid and result.birth_date == '12.08.1974'
+
+
+def test_no_zone_or_internal_passport():
+    assert parse_mrz('no machine readable zone here') is None
+    # PN — зона внутреннего паспорта РФ, не ICAO
+    assert parse_mrz('\n'.join(('PN' + TD3[0][2:], TD3[1]))) is None
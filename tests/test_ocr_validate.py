@@ -0,0 +1,80 @@
+from datetime import date
+
+import pytest
+
+from ocr_validate import REQUIRED_FIELDS, build_reask_prompt, field_confidence, validate_document
+
+TODAY = date(2025, 6, 1)
+
+RF_INTERNAL = {
+    'documentType': 'internal_passport_rf', 'lastName': 'Иванов', 'firstName': 'Иван',
+    'birthDate': '01.02.1990', 'series': '45 10', 'number': '123456', 'issuedBy': 'ОВД района',
+    'issueDate': '15.03.2010', 'departmentCode': '770-001',
+}
+KZ_ID = {
+    'documentType': 'id_card_kazakhstan', 'lastName': 'IVANOV', 'firstName': 'IVAN',
+    'birthDate': '01.02.1990', 'number': 'N1234567', 'personalNumber': '900201300123',
+    'issueDate': '10.01.2020', 'expiryDate': '10.01.2030',
+}
+
+
+@pytest.mark.parametrize('document', [RF_INTERNAL, KZ_ID])
+def test_valid_documents_pass(document):
+    assert validate_document(document, today=TODAY) == {}
+
+
+@pytest.mark.parametrize('document, changes, expected', [
+    # Паттерны номеров по стране
+    (RF_INTERNAL, {'number': '12345'}, {'number': 'pattern'}),
+    (RF_INTERNAL, {'series': '45A0'}, {'series': 'pattern'}),
+    (RF_INTERNAL, {'departmentCode': '770001'}, {'departmentCode': 'pattern'}),
+    (KZ_ID, {'number': '1234567'}, {'number': 'pattern'}),
+    (KZ_ID, {'personalNumber': '9002013001'}, {'personalNumber': 'pattern'}),
+    (KZ_ID, {'number': 'n 1234567'}, {}),  # Пробелы и регистр не важны
+    # Страна из documentType важнее выбранной пользователем
+    ({**KZ_ID, 'documentType': 'international_passport_kyrgyzstan'}, {'number': 'N1234567'},
+     {'number': 'pattern', 'personalNumber': 'pattern'}),
+    # Обязательные поля
+    (KZ_ID, {'lastName': None}, {'lastName': 'missing'}),
+    (KZ_ID, {'number': ''}, {'number': 'missing'}),
+    (RF_INTERNAL, {'departmentCode': None, 'issuedBy': ''}, {'departmentCode': 'missing', 'issuedBy': 'missing'}),
+    (KZ_ID, {'issuedBy': None}, {}),  # issuedBy обязателен только для внутреннего паспорта РФ
+    # Даты
+    (KZ_ID, {'birthDate': '1990-02-01'}, {'birthDate': 'format'}),
+    (KZ_ID, {'birthDate': '31.02.1990'}, {'birthDate': 'format'}),
+    (KZ_ID, {'birthDate': '01.02.2026'}, {'birthDate': 'order', 'issueDate': 'order'}),
+    (KZ_ID, {'issueDate': '10.01.2026'}, {'issueDate': 'order'}),
+    (KZ_ID, {'expiryDate': '10.01.2019'}, {'expiryDate': 'order'}),
+])
+def test_failures(document, changes, expected):
+    assert validate_document({**document, **changes}, country='kz', today=TODAY) == expected
+
+
+def test_empty_document_misses_all_required_fields():
+    assert validate_document({}, today=TODAY) == {field: 'missing' for field in REQUIRED_FIELDS}
+
+
+def test_reask_prompt_lists_only_failed_fields():
+    data = {**KZ_ID, 'number': '1234567', 'lastName': None, 'birthDate': '1990-02-01'}
+    failures = validate_document(data, today=TODAY)
+    prompt = build_reask_prompt(failures, data)
+
+    listed = [line.split(':', 1)[0][2:] for line in prompt.splitlines() if line.startswith('- ')]
+    assert listed == list(failures) == ['lastName', 'birthDate', 'number']
+    assert '- number: номер документа ровно как напечатан (не похоже на номер этой страны, распознано «1234567»)' in prompt
+    assert '- lastName: фамилия (не найдено)' in prompt
+    for field in ('firstName', 'personalNumber', 'issueDate', 'expiryDate', 'documentType'):
+        assert f'- {field}:' not in prompt
+
+
+def test_field_confidence():
+    data = {**KZ_ID, 'number': '1234567', 'middleName': None}
+    failures = {'number': 'pattern'}
+    flags = field_confidence(
+        data, failures, ('number', 'lastName', 'firstName', 'birthDate', 'middleName', 'personalNumber'),
+        mrz_fields=('birthDate', 'number'), reasked=('firstName',)
+    )
+    assert flags == {
+        'number': 'invalid', 'lastName': 'ok', 'firstName': 'reasked', 'birthDate': 'mrz',
+        'middleName': 'missing', 'personalNumber': 'ok',
+    }
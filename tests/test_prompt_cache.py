@@ -0,0 +1,174 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.api_core.exceptions import NotFound, ResourceExhausted
+
+import ocr
+from prompt_cache import InlinePromptBackend, PreparedPrompt, PromptBackend, PromptCache
+
+PROMPT = "Распознай паспорт и верни JSON с полями документа. " * 200
+IMAGE = {'mime_type': 'image/jpeg', 'data': b'\xff\xd8fake'}
+RESPONSE = '{"surname": "IVANOV", "name": "IVAN"}'
+IMAGE_TOKENS = 258  # Столько Gemini считает за одно изображение
+
+
+def approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeResponse:
+    """Как GenerateContentResponse: и целиком, и потоком."""
+
+    def __init__(self, text: str, usage_metadata=None, chunk_size: int = 0):
+        self.text = text
+        self.usage_metadata = usage_metadata
+        self._chunk_size = chunk_size
+
+    async def __aiter__(self):
+        size = self._chunk_size or len(self.text)
+        for start in range(0, len(self.text), size):
+            yield FakeResponse(self.text[start:start + size])
+
+
+class FakeModel:
+    """
+    GenerativeModel без сети. usage_metadata считается как в Gemini:
+    закэшированный промпт в запросе не уходит, но входит в prompt_token_count.
+    """
+
+    def __init__(self, model_name: str = 'models/gemini-test', cached_prompt: str = None):
+        self.model_name = model_name
+        self.cached_prompt = cached_prompt
+        self.requests = 0
+        self.sent_tokens = 0
+        self.error = None
+
+    async def generate_content_async(self, parts: list, stream: bool = False):
+        if self.error is not None:
+            raise self.error
+        sent = sum(approx_tokens(part) if isinstance(part, str) else IMAGE_TOKENS for part in parts)
+        cached = approx_tokens(self.cached_prompt) if self.cached_prompt is not None else 0
+        self.requests += 1
+        self.sent_tokens += sent
+        usage = SimpleNamespace(prompt_token_count=sent + cached, cached_content_token_count=cached,
+                                candidates_token_count=approx_tokens(RESPONSE))
+        return FakeResponse(RESPONSE, usage, chunk_size=7 if stream else 0)
+
+
+class FakeCachedBackend(PromptBackend):
+    """Как GeminiCachedContentBackend: на каждый prepare — новый «CachedContent»."""
+    name = 'fake'
+
+    def __init__(self):
+        self.caches = []
+
+    async def prepare(self, model, prompt: str, generation_config: dict) -> PreparedPrompt:
+        cached_model = FakeModel(model.model_name, cached_prompt=prompt)
+        handle = SimpleNamespace(name=f'cachedContents/{len(self.caches)}', model=cached_model, deleted=False)
+        self.caches.append(handle)
+        return PreparedPrompt(model=cached_model, prefix=[], cached=True, handle=handle)
+
+    async def release(self, prepared: PreparedPrompt):
+        prepared.handle.deleted = True
+
+
+@pytest.fixture
+def registry_model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(ocr, '_registry', SimpleNamespace(get=lambda variant: model, generation_config={}))
+    return model
+
+
+def recognize_times(monkeypatch, prompts: PromptCache, times: int, on_field=None):
+    monkeypatch.setattr(ocr, '_prompts', prompts)
+
+    async def scenario():
+        return [
+            await ocr._recognize_with_prompt('document', PROMPT, [IMAGE], {}, on_field, 'ru')
+            for _ in range(times)
+        ]
+
+    return asyncio.run(scenario())
+
+
+def test_cached_prompt_saves_sent_tokens(monkeypatch, registry_model):
+    backend = FakeCachedBackend()
+    cached = PromptCache(backend)
+    inline = PromptCache(InlinePromptBackend())
+
+    for data, complete in recognize_times(monkeypatch, cached, 3):
+        assert data == {'surname': 'IVANOV', 'name': 'IVAN'} and complete
+    # Поток (on_field) и обычный ответ считаются одинаково
+    recognize_times(monkeypatch, inline, 3, on_field=lambda key, value: None)
+
+    prompt_tokens = approx_tokens(PROMPT)
+    # Промпт зарегистрирован один раз, дальше запросы идут со ссылкой на кэш
+    assert len(backend.caches) == 1
+    assert cached.stats() == {
+        'backend': 'fake', 'requests': 3, 'cached_requests': 3,
+        'prompt_tokens': 3 * (prompt_tokens + IMAGE_TOKENS), 'cached_tokens': 3 * prompt_tokens,
+    }
+    assert inline.stats() == {
+        'backend': 'inline', 'requests': 3, 'cached_requests': 0,
+        'prompt_tokens': 3 * (prompt_tokens + IMAGE_TOKENS), 'cached_tokens': 0,
+    }
+    assert backend.caches[0].model.sent_tokens == 3 * IMAGE_TOKENS
+    # Inline идет через модель из реестра (созданную и прогретую заранее)
+    assert registry_model.requests == 3
+    assert registry_model.sent_tokens == 3 * (prompt_tokens + IMAGE_TOKENS)
+
+
+def test_missing_cache_is_retried_inline_and_recreated(monkeypatch, registry_model):
+    backend = FakeCachedBackend()
+    prompts = PromptCache(backend)
+    recognize_times(monkeypatch, prompts, 1)
+
+    # Кэш удален на стороне Gemini: запрос через него падает и повторяется inline
+    backend.caches[0].model.error = NotFound('CachedContent not found')
+    (data, complete), = recognize_times(monkeypatch, prompts, 1)
+    assert data == {'surname': 'IVANOV', 'name': 'IVAN'} and complete
+    assert registry_model.requests == 1
+    assert backend.caches[0].deleted
+
+    # Следующий запрос снова регистрирует кэш, а не остается на inline
+    recognize_times(monkeypatch, prompts, 1)
+    assert len(backend.caches) == 2 and backend.caches[1].model.requests == 1
+
+    prompt_tokens = approx_tokens(PROMPT)
+    assert prompts.stats() == {
+        'backend': 'fake', 'requests': 3, 'cached_requests': 2,
+        'prompt_tokens': 3 * (prompt_tokens + IMAGE_TOKENS), 'cached_tokens': 2 * prompt_tokens,
+    }
+
+
+def test_transient_error_keeps_cache(monkeypatch, registry_model):
+    backend = FakeCachedBackend()
+    prompts = PromptCache(backend)
+    recognize_times(monkeypatch, prompts, 1)
+
+    # 429 не повод пересоздавать кэш и слать полный промпт inline
+    backend.caches[0].model.error = ResourceExhausted('quota exceeded')
+    with pytest.raises(ResourceExhausted):
+        recognize_times(monkeypatch, prompts, 1)
+    assert registry_model.requests == 0
+    assert len(backend.caches) == 1 and not backend.caches[0].deleted
+
+    backend.caches[0].model.error = None
+    recognize_times(monkeypatch, prompts, 1)
+    assert backend.caches[0].model.requests == 2
+
+
+def test_refreshed_cache_deletes_previous(registry_model):
+    backend = FakeCachedBackend()
+    prompts = PromptCache(backend)
+
+    async def scenario():
+        first = await prompts.resolve(registry_model, PROMPT, {})
+        first.expires_at = 0  # Подошло время обновить кэш
+        second = await prompts.resolve(registry_model, PROMPT, {})
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is not second
+    assert first.handle.deleted and not second.handle.deleted
@@ -0,0 +1,50 @@
+import asyncio
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import bot
+from uploads import UploadResult
+
+USER_ID = 42
+
+
+def test_background_uploads_do_not_write_fsm(monkeypatch):
+    release = {}
+
+    async def fake_transfer(_bot, _storage, user_id, key, file_id):
+        await release.setdefault(key, asyncio.Event()).wait()
+        return UploadResult(key=key, file_id=file_id, content_type='image/jpeg',
+                            storage_path=f'{user_id}/{key}.jpg', size=1024)
+
+    monkeypatch.setattr(bot, 'transfer_file', fake_transfer)
+    storage = MemoryStorage()
+    state = FSMContext(storage, StorageKey(bot_id=1, chat_id=USER_ID, user_id=USER_ID))
+
+    async def scenario():
+        await bot.save_document(state, USER_ID, 'passport_main', 'main-id')
+        await asyncio.sleep(0)
+        release.setdefault('passport_main', asyncio.Event()).set()
+        # Загрузка завершается, пока пользователь присылает следующее фото
+        await bot.save_document(state, USER_ID, 'passport_reg', 'reg-id')
+        await bot.upload_tasks.get(USER_ID, 'passport_main')
+        after_main = await state.get_data()
+
+        release.setdefault('passport_reg', asyncio.Event()).set()
+        await bot.upload_tasks.get(USER_ID, 'passport_reg')
+        # Фоновая задача анкету не меняет: до следующего хэндлера данные те же
+        assert await state.get_data() == after_main
+        await bot.save_document(state, USER_ID, 'patent_front', 'front-id')
+        data = await state.get_data()
+        await bot.upload_tasks.cancel_user(USER_ID)
+        return data
+
+    data = asyncio.run(scenario())
+    assert data['passport_main_file_id'] == 'main-id'
+    assert data['passport_reg_file_id'] == 'reg-id'
+    assert data['patent_front_file_id'] == 'front-id'
+    assert data['uploaded_files'] == {
+        'passport_main': {'file_id': 'main-id', 'path': f'{USER_ID}/passport_main.jpg', 'size': 1024},
+        'passport_reg': {'file_id': 'reg-id', 'path': f'{USER_ID}/passport_reg.jpg', 'size': 1024},
+    }
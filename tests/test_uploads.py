@@ -0,0 +1,99 @@
+import asyncio
+import os
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from conftest import serve
+from storage_client import StorageClient
+from uploads import STORAGE_BUCKET, configure_transfers, transfer_file, upload_registration_files, verify_uploads
+
+TOKEN = '123456:TEST-token'
+
+
+def make_fake_server(files: dict, received: dict) -> web.Application:
+    """Telegram (getFile + скачивание) и Supabase Storage (загрузка + листинг) в одном приложении."""
+
+    async def get_file(request: web.Request):
+        file_id = (await request.post())['file_id']
+        return web.json_response({'ok': True, 'result': {
+            'file_id': file_id, 'file_unique_id': file_id, 'file_size': len(files[file_id]),
+            'file_path': f'photos/{file_id}.jpg',
+        }})
+
+    async def download(request: web.Request):
+        return web.Response(body=files[request.match_info['name']])
+
+    async def upload(request: web.Request):
+        body = await request.read()
+        received[request.match_info['path']] = {
+            'content_length': request.headers.get('Content-Length'),
+            'size': len(body),
+            'content_type': request.headers.get('Content-Type'),
+        }
+        return web.json_response({'Key': f"{STORAGE_BUCKET}/{request.match_info['path']}"})
+
+    async def list_objects(request: web.Request):
+        prefix = (await request.json())['prefix']
+        return web.json_response([
+            {'name': path.rsplit('/', 1)[-1], 'metadata': {'size': info['size'], 'mimetype': info['content_type']}}
+            for path, info in received.items() if path.startswith(f'{prefix}/')
+        ])
+
+    app = web.Application(client_max_size=16 * 1024 * 1024)
+    app.router.add_post(f'/bot{TOKEN}/getFile', get_file)
+    app.router.add_get(f'/file/bot{TOKEN}/photos/{{name}}.jpg', download)
+    app.router.add_post(f'/storage/v1/object/list/{STORAGE_BUCKET}', list_objects)
+    app.router.add_post(f'/storage/v1/object/{STORAGE_BUCKET}/{{path:.+}}', upload)
+    return app
+
+
+async def run_transfer(files: dict, spool_threshold: int):
+    received = {}
+    runner, base_url = await serve(make_fake_server(files, received))
+    configure_transfers(spool_threshold=spool_threshold, memory_budget=4 * spool_threshold)
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+    storage = StorageClient(base_url, 'service-key')
+    try:
+        results = await upload_registration_files(bot, storage, 42, {key: key for key in files})
+        manifest = await verify_uploads(bot, storage, 42, results)
+    finally:
+        await storage.close()
+        await bot.session.close()
+        await runner.cleanup()
+    return results, manifest, received
+
+
+def test_transfer_uploads_whole_file():
+    files = {'passport_main': os.urandom(300 * 1024), 'video_note': os.urandom(3 * 1024 * 1024 + 17)}
+    # Порог 1 МБ: фото остается в памяти, кружок уходит во временный файл на диске
+    results, manifest, received = asyncio.run(run_transfer(files, spool_threshold=1024 * 1024))
+
+    for key, payload in files.items():
+        result = results[key]
+        assert result.ok, result.error
+        assert result.size == len(payload)
+        uploaded = received[result.storage_path]
+        assert uploaded['size'] == len(payload)
+        assert uploaded['content_length'] == str(len(payload))
+    assert manifest['verified']
+    assert manifest['files']['video_note']['size'] == len(files['video_note'])
+
+
+def test_transfer_reports_error_instead_of_raising():
+    async def scenario():
+        runner, base_url = await serve(make_fake_server({}, {}))
+        bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(base_url)))
+        storage = StorageClient(base_url, 'service-key')
+        try:
+            return await transfer_file(bot, storage, 42, 'passport_main', 'missing')
+        finally:
+            await storage.close()
+            await bot.session.close()
+            await runner.cleanup()
+
+    result = asyncio.run(scenario())
+    assert not result.ok
+    assert result.error
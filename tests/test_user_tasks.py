@@ -0,0 +1,58 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import bot
+import user_tasks
+from user_tasks import UserTaskRegistry
+
+
+async def value(result):
+    return result
+
+
+def test_finished_tasks_are_pruned_after_ttl(monkeypatch):
+    now = [1000.0]
+    # Подменяем часы только реестру: цикл событий живет по настоящим
+    monkeypatch.setattr(user_tasks, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    registry = UserTaskRegistry('test', ttl=60)
+
+    async def scenario():
+        blocker = asyncio.Event()
+        await asyncio.gather(registry.start(1, 'done', value('ok')), registry.start(2, 'done', value('ok')))
+        running = registry.start(2, 'running', blocker.wait())
+        await asyncio.sleep(0)  # Колбэки завершения отмечают время
+        now[0] += 30
+        await registry.start(3, 'done', value('fresh'))
+        await asyncio.sleep(0)
+
+        now[0] += 31
+        removed = registry.prune()
+        stats = registry.stats()
+        running.cancel()
+        return removed, stats
+
+    removed, stats = asyncio.run(scenario())
+    assert removed == 2
+    # Пользователь 1 удален целиком, у 2 осталась незаконченная задача, у 3 — свежий результат
+    assert stats == {'users': 2, 'running': 1, 'done': 1}
+    assert registry.results(3) == {'done': 'fresh'}
+
+
+def test_collect_ocr_does_not_wait_for_running_recognition():
+    async def scenario():
+        bot.ocr_tasks.start(1, 'passport', value({'surname': 'IVANOV'}))
+        bot.ocr_tasks.start(2, 'passport', asyncio.sleep(30, {'surname': 'PETROV'}))
+        await asyncio.sleep(0)
+
+        started = time.perf_counter()
+        ready, pending = bot.collect_ocr(1), bot.collect_ocr(2)
+        elapsed = time.perf_counter() - started
+        await asyncio.sleep(0)
+        return ready, pending, elapsed
+
+    ready, pending, elapsed = asyncio.run(scenario())
+    assert ready == {'surname': 'IVANOV'}
+    assert pending is None
+    assert elapsed < 0.1
+    assert bot.ocr_tasks.stats() == {'users': 0, 'running': 0, 'done': 0}
@@ -0,0 +1,52 @@
+import asyncio
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message
+from aiohttp import web
+
+from conftest import serve
+from webhook import SECRET_HEADER, WebhookHandler
+
+SECRET = 'webhook-secret'
+UPDATE = {'update_id': 1, 'message': {
+    'message_id': 1, 'date': 0, 'text': 'hello',
+    'chat': {'id': 7, 'type': 'private'}, 'from': {'id': 7, 'is_bot': False, 'first_name': 'Test'},
+}}
+
+
+def test_webhook_accepts_valid_and_drops_poison_updates():
+    received = []
+    dp = Dispatcher()
+
+    @dp.message()
+    async def on_message(message: Message):
+        received.append(message.text)
+
+    async def scenario():
+        bot = Bot(token='123456:TEST-token')
+        handler = WebhookHandler(dp, bot, secret_token=SECRET)
+        app = web.Application()
+        app.router.add_post('/webhook', handler)
+        runner, base_url = await serve(app)
+        statuses = {}
+        try:
+            async with aiohttp.ClientSession(headers={SECRET_HEADER: SECRET}) as session:
+                async def post(name, **kwargs):
+                    async with session.post(f'{base_url}/webhook', **kwargs) as response:
+                        statuses[name] = response.status
+
+                await post('valid', json=UPDATE)
+                # Не разбирается ни как JSON, ни как Update: повтор от Telegram ничего не изменит
+                await post('not_json', data=b'{"update_id": ')
+                await post('bad_update', json={'update_id': 'x', 'message': 42})
+                await post('no_secret', json=UPDATE, headers={SECRET_HEADER: 'wrong'})
+            await handler.shutdown()
+        finally:
+            await runner.cleanup()
+            await bot.session.close()
+        return statuses
+
+    statuses = asyncio.run(scenario())
+    assert statuses == {'valid': 200, 'not_json': 200, 'bad_update': 200, 'no_secret': 401}
+    assert received == ['hello']
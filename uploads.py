@@ -0,0 +1,210 @@
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from aiogram import Bot
+
+from storage_client import StorageClient
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+STORAGE_BUCKET = "passports"
+
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+
+class ByteBudget:
+    """
+    Глобальный бюджет байт, одновременно находящихся в памяти при переносах.
+
+    Перенос резервирует столько, сколько файла может оказаться в памяти
+    (не больше порога спула), и ждет, пока бюджет освободится.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.used = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def reserve(self, size: int):
+        size = min(size, self.limit)
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.used + size <= self.limit)
+            self.used += size
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.used -= size
+                self._condition.notify_all()
+
+
+# Настройки потоковой передачи, см. configure_transfers()
+_spool_threshold = 1024 * 1024
+_memory_budget = ByteBudget(32 * 1024 * 1024)
+
+
+def configure_transfers(spool_threshold: int, memory_budget: int):
+    """
+    Настраивает потоковую передачу Telegram → Storage.
+
+    :param spool_threshold: Файл больше этого размера сбрасывается из памяти во временный файл на диске.
+    :param memory_budget: Сколько байт суммарно могут держать в памяти все переносы.
+    """
+    global _spool_threshold, _memory_budget
+    _spool_threshold = spool_threshold
+    _memory_budget = ByteBudget(memory_budget)
+    logger.info(f"Переносы файлов: спул на диск с {spool_threshold} байт, бюджет памяти {memory_budget} байт")
+
+
+@dataclass
+class UploadResult:
+    """Результат переноса одного файла из Telegram в Supabase Storage."""
+    key: str
+    file_id: str
+    content_type: str
+    storage_path: Optional[str] = None
+    size: int = 0
+    error: Optional[str] = None
+    verified: bool = False
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.storage_path is not None
+
+
+def content_type_for(key: str) -> str:
+    """Тип контента по ключу документа: кружок — mp4, остальное — jpeg."""
+    return 'video/mp4' if key == 'video_note' else 'image/jpeg'
+
+
+def storage_path_for(user_id: int, key: str) -> str:
+    """Путь в бакете, e.g. .../passport_main.jpeg или .../video_note.mp4"""
+    return f"{user_id}/{key}.{content_type_for(key).split('/')[1]}"
+
+
+async def transfer_file(bot: Bot, storage: StorageClient, user_id: int, key: str, file_id: str) -> UploadResult:
+    """
+    Скачивает один файл из Telegram и загружает его в Storage.
+
+    Никогда не бросает исключение: ошибка возвращается в поле `error`,
+    чтобы один битый файл не ронял всю регистрацию.
+    """
+    result = UploadResult(key=key, file_id=file_id, content_type=content_type_for(key))
+    try:
+        file_info = await bot.get_file(file_id)
+        storage_path = storage_path_for(user_id, key)
+
+        # Файл целиком в памяти не держим: до порога — в памяти, дальше — на диске
+        async with _memory_budget.reserve(min(file_info.file_size or _spool_threshold, _spool_threshold)):
+            with tempfile.SpooledTemporaryFile(max_size=_spool_threshold) as spool:
+                # seek=False: иначе aiogram перемотает спул в начало, и tell() вернет 0
+                await bot.download_file(
+                    file_info.file_path, destination=spool, chunk_size=DOWNLOAD_CHUNK_SIZE, seek=False
+                )
+                size = spool.tell()
+                spool.seek(0)
+
+                logger.info(f"📤 Uploading {key} to Storage: {storage_path}, size: {size} bytes")
+                upload_response = await storage.upload(
+                    STORAGE_BUCKET, storage_path, spool, content_type=result.content_type, size=size
+                )
+        logger.info(f"✅ Upload response for {key}: {upload_response}")
+
+        result.storage_path = storage_path
+        result.size = size
+    except Exception as e:
+        logger.error(f"Ошибка при обработке файла {key}: {e}")
+        result.error = str(e)
+    return result
+
+
+async def upload_registration_files(bot: Bot, storage: StorageClient, user_id: int, file_ids: Dict[str, str],
+                                    concurrency: int = 4) -> Dict[str, UploadResult]:
+    """
+    Переносит все файлы регистрации в Storage с ограниченным параллелизмом.
+
+    :param file_ids: Словарь {ключ документа: file_id}.
+    :param concurrency: Сколько файлов обрабатывается одновременно.
+    :return: Словарь {ключ документа: UploadResult} для каждого файла.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def worker(key: str, file_id: str) -> UploadResult:
+        async with semaphore:
+            return await transfer_file(bot, storage, user_id, key, file_id)
+
+    results = await asyncio.gather(*(worker(key, file_id) for key, file_id in file_ids.items()))
+    return {result.key: result for result in results}
+
+
+def _check_object(result: UploadResult, listed: Dict[str, dict]) -> str:
+    """Сверяет загруженный файл с листингом бакета и возвращает статус для манифеста."""
+    if not result.ok:
+        return 'failed'
+    obj = listed.get(result.storage_path.rsplit('/', 1)[-1])
+    if obj is None:
+        return 'missing'
+    metadata = obj.get('metadata') or {}
+    if metadata.get('size') != result.size or metadata.get('mimetype') != result.content_type:
+        return 'mismatch'
+    return 'ok'
+
+
+async def verify_uploads(bot: Bot, storage: StorageClient, user_id: int, results: Dict[str, UploadResult],
+                         concurrency: int = 4, retries: int = 1) -> dict:
+    """
+    Одна проверка после всех загрузок вместо листинга папки после каждого файла.
+
+    Сравнивает ожидаемый набор объектов (путь, размер, тип контента) с бакетом,
+    повторно переносит только отсутствующие/битые файлы и возвращает манифест
+    для formData. `results` обновляется на месте.
+    """
+    retried = []
+    statuses: Dict[str, str] = {}
+    for attempt in range(retries + 1):
+        try:
+            listing = await storage.list(STORAGE_BUCKET, str(user_id))
+            listed = {obj.get('name'): obj for obj in listing}
+        except Exception as e:
+            # Без листинга сверять не с чем: не перезаливаем вслепую, а помечаем как непроверенные
+            logger.error(f"Не удалось получить листинг папки {user_id}: {e}")
+            statuses = {key: 'unverified' if result.ok else 'failed' for key, result in results.items()}
+            break
+
+        statuses = {key: _check_object(result, listed) for key, result in results.items()}
+        broken = [key for key, status in statuses.items() if status != 'ok']
+        if not broken or attempt == retries:
+            break
+
+        logger.warning(f"Повторная загрузка для пользователя {user_id}: {broken}")
+        retried.extend(broken)
+        retry_results = await upload_registration_files(
+            bot, storage, user_id, {key: results[key].file_id for key in broken}, concurrency=concurrency
+        )
+        results.update(retry_results)
+
+    for key, status in statuses.items():
+        results[key].verified = status == 'ok'
+
+    manifest = {
+        'bucket': STORAGE_BUCKET,
+        'verified': all(status == 'ok' for status in statuses.values()),
+        'retried': sorted(set(retried)),
+        'files': {
+            key: {
+                'path': result.storage_path or storage_path_for(user_id, key),
+                'size': result.size,
+                'contentType': result.content_type,
+                'status': statuses.get(key, 'failed'),
+            }
+            for key, result in results.items()
+        },
+    }
+    logger.info(f"📁 Манифест загрузок пользователя {user_id}: verified={manifest['verified']}, retried={manifest['retried']}")
+    return manifest
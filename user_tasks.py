@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import math
+import time
+import weakref
+from typing import Any, Awaitable, Dict, Optional
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+
+class UserTaskRegistry:
+    """
+    Фоновые задачи регистрации по ключу (user_id, key): загрузки документов,
+    предварительное распознавание и т.п.
+
+    Новая задача с тем же ключом отменяет прежнюю. Завершенные задачи
+    остаются в реестре до take()/cancel_user(), чтобы финальный шаг мог
+    забрать их результат, но не дольше `ttl` секунд после завершения:
+    брошенные регистрации не копят результаты в памяти.
+    """
+    _PRUNE_EVERY = 100  # Чистим устаревшие задачи раз в N запусков
+
+    def __init__(self, name: str = 'tasks', ttl: Optional[float] = None):
+        self._name = name
+        self._ttl = ttl
+        self._tasks: Dict[int, Dict[str, asyncio.Task]] = {}
+        self._finished_at: 'weakref.WeakKeyDictionary[asyncio.Task, float]' = weakref.WeakKeyDictionary()
+        self._starts = 0
+
+    def start(self, user_id: int, key: str, coro: Awaitable) -> asyncio.Task:
+        self._starts += 1
+        if self._starts % self._PRUNE_EVERY == 0:
+            self.prune()
+        tasks = self._tasks.setdefault(user_id, {})
+        previous = tasks.get(key)
+        if previous is not None and not previous.done():
+            previous.cancel()
+        task = asyncio.ensure_future(coro)
+        tasks[key] = task
+        task.add_done_callback(lambda done: self._on_done(user_id, key, done))
+        return task
+
+    def _on_done(self, user_id: int, key: str, task: asyncio.Task):
+        self._finished_at[task] = time.monotonic()
+        self._log_failure(user_id, key, task)
+
+    def _log_failure(self, user_id: int, key: str, task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Фоновая задача {self._name}:{key} пользователя {user_id} упала: {task.exception()}")
+
+    def prune(self) -> int:
+        """Удаляет задачи, завершившиеся больше `ttl` секунд назад; возвращает их число."""
+        if not self._ttl:
+            return 0
+        deadline = time.monotonic() - self._ttl
+        removed = 0
+        for user_id in list(self._tasks):
+            tasks = self._tasks[user_id]
+            for key in [key for key, task in tasks.items() if self._finished_at.get(task, math.inf) <= deadline]:
+                del tasks[key]
+                removed += 1
+            if not tasks:
+                del self._tasks[user_id]
+        if removed:
+            logger.info(f"Из реестра {self._name} удалено {removed} устаревших задач")
+        return removed
+
+    def get(self, user_id: int, key: str) -> Optional[asyncio.Task]:
+        return self._tasks.get(user_id, {}).get(key)
+
+    def results(self, user_id: int) -> Dict[str, Any]:
+        """Результаты успешно завершенных задач пользователя; задачи остаются в реестре."""
+        return {
+            key: task.result() for key, task in self._tasks.get(user_id, {}).items()
+            if task.done() and not task.cancelled() and task.exception() is None
+        }
+
+    def take(self, user_id: int) -> Dict[str, asyncio.Task]:
+        """Забирает все задачи пользователя из реестра (и завершенные, и идущие)."""
+        return self._tasks.pop(user_id, {})
+
+    async def cancel_user(self, user_id: int):
+        """Отменяет задачи пользователя и дожидается их остановки (например, на /start)."""
+        tasks = list(self.take(user_id).values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stop(self):
+        for user_id in list(self._tasks):
+            await self.cancel_user(user_id)
+
+    def stats(self) -> dict:
+        tasks = [task for user_tasks in self._tasks.values() for task in user_tasks.values()]
+        return {
+            'users': len(self._tasks),
+            'running': sum(1 for task in tasks if not task.done()),
+            'done': sum(1 for task in tasks if task.done()),
+        }
+
+
+def finished_result(task: asyncio.Task):
+    """Результат завершенной задачи; None — задача отменена или упала."""
+    if task.cancelled() or task.exception() is not None:
+        return None
+    return task.result()
+
+
+async def wait_result(task: asyncio.Task, timeout: Optional[float] = None):
+    """
+    Результат задачи не дольше `timeout` секунд; None — задача не успела,
+    отменена или упала. Сама задача по таймауту не отменяется.
+    """
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout)
+    except asyncio.TimeoutError:
+        return None
+    except asyncio.CancelledError:
+        if task.cancelled():
+            return None
+        raise
+    except Exception:
+        return None
+
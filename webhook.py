@@ -0,0 +1,74 @@
+import asyncio
+import hmac
+import logging
+from typing import Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+# Настраиваем логгер
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookHandler:
+    """
+    aiohttp-хэндлер для апдейтов Telegram в режиме вебхука.
+
+    Проверяет секретный токен, сразу отвечает 200 и обрабатывает апдейт
+    в фоне. Одновременно обрабатывается не больше `workers` апдейтов, а в
+    очереди ждет не больше `max_pending`: сверх этого отвечаем 503, и Telegram
+    сам повторит доставку позже.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret_token: Optional[str] = None,
+                 workers: int = 32, max_pending: int = 1000):
+        self._dp = dp
+        self._bot = bot
+        self._secret_token = secret_token
+        self._semaphore = asyncio.Semaphore(workers)
+        self._max_pending = max_pending
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._tasks)
+
+    def _check_secret(self, request: web.Request) -> bool:
+        if not self._secret_token:
+            return True
+        received = request.headers.get(SECRET_HEADER, '')
+        return hmac.compare_digest(received, self._secret_token)
+
+    async def __call__(self, request: web.Request) -> web.Response:
+        if not self._check_secret(request):
+            return web.Response(status=401, text='Unauthorized')
+        if len(self._tasks) >= self._max_pending:
+            logger.warning(f"Очередь вебхука переполнена ({len(self._tasks)}), просим Telegram повторить")
+            return web.Response(status=503, text='Busy')
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self._bot})
+        except Exception as e:
+            # Отвечаем 200: на ошибку Telegram доставлял бы тот же апдейт снова и снова
+            logger.error(f"Некорректный апдейт в вебхуке пропущен: {e}")
+            return web.Response(status=200)
+
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response(status=200)
+
+    async def _process(self, update: Update):
+        async with self._semaphore:
+            try:
+                await self._dp.feed_update(self._bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}", exc_info=True)
+
+    async def shutdown(self, timeout: float = 10.0):
+        """Дожидается уже принятых апдейтов перед остановкой."""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)